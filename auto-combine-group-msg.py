@@ -1,10 +1,20 @@
 import argparse
-import http.client
 import json
 from datetime import timedelta
 
 import time
 
+from batch_packer import add_packing_arguments, estimate_tokens, fixed_batches, open_packer
+from dataset_store import DatasetWriter, load_records
+from llm_cache import add_cache_arguments, open_cache
+from llm_output import add_schema_argument, output_stats, parse_output, string_list_schema
+from ollama_client import get_client
+from ordered_dispatch import run_ordered
+from stream_guard import JsonListValidator, add_stream_arguments, open_stream
+
+OUTPUT_TOKEN_RATIO = 1.1
+"""按 token 预算分批时，预计输出的 token 数与输入之比（合并后的语句与原句总长相近）"""
+
 
 def format_time(seconds):
     """格式化时间显示"""
@@ -24,35 +34,18 @@ def preview_results(results, preview_count=3, max_length=50):
     return "\n".join(preview)
 
 
-def read_json(file_path):
-    """读取JSON文件"""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-
-def save_json(file_path, data):
-    """保存JSON文件"""
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
-
-def send_to_ollama(model, data_chunk, max_retries=100):
-    """发送合并请求到Ollama并进行自动重试"""
-    for attempt in range(max_retries + 1):
-        conn = None
-        try:
-            conn = http.client.HTTPConnection("127.0.0.1:11434")
-            headers = {"Content-Type": "application/json"}
-            payload = {
-                "model": model,
-                "stream": False,
-                "options": {
-                    "temperature": 0.7
-                },
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": """\
+def build_payload(model, data_chunk):
+    """生成合并请求内容"""
+    return {
+        "model": model,
+        "stream": False,
+        "options": {
+            "temperature": 0.7
+        },
+        "messages": [
+            {
+                "role": "system",
+                "content": """\
 你是一个助手，你会收到一个群成员的聊天记录，你要帮我进行数据集的生成
 
 要求如下：
@@ -94,120 +87,174 @@ def send_to_ollama(model, data_chunk, max_retries=100):
 - 第4句也是AIR产品相关话题，但根据“不信就算了”，前面很可能有人插话，因此与第3句分开
 - 第5句也是AIR产品相关话题，但根据“对”，前面很可能有人插话，因此与第4句分开
 """
-                    },
-                    {
-                        "role": "user",
-                        "content": json.dumps([row["output"] for row in data_chunk], ensure_ascii=False, indent=4)
-                    }
-                ]
+            },
+            {
+                "role": "user",
+                "content": json.dumps([row["output"] for row in data_chunk], ensure_ascii=False, indent=4)
             }
-            conn.request("POST", "/api/chat", body=json.dumps(payload), headers=headers)
-            response = conn.getresponse()
-
-            if response.status != 200:
-                raise Exception(f"API错误: {response.status} {response.reason}")
-
-            response_data = json.loads(response.read().decode())
-            content: str = response_data["message"]["content"]
-
-            content = content.replace("```", "")
-            if (think_index := content.find("</think>")) != -1:
-                content = content[think_index + len("</think>"):]
-
-            merged_content = json.loads(content)
-
-            # 验证合并结果格式
-            if not isinstance(merged_content, list):
-                raise ValueError("返回结果不是有效的列表格式")
+        ]
+    }
+
+
+def send_to_ollama(model, data_chunk, max_retries=100, cache=None, on_parse_error=None, stream=None, use_schema=False):
+    """
+    发送合并请求到Ollama并进行自动重试
+
+    :param on_parse_error: 每次返回内容无法解析时调用，参数为错误信息
+    :param stream: 指定时流式请求，返回内容不是字符串列表、条数多于输入或超出限制时提前中止
+    :param use_schema: 是否通过 format 字段要求 Ollama 按 JSON Schema 输出
+    """
+    # 合并后的条数不会多于原始条数
+    schema = string_list_schema(len(data_chunk))
+    payload = build_payload(model, data_chunk)
+    if use_schema:
+        payload["format"] = schema
+    expected_tokens = estimate_tokens(payload["messages"][-1]["content"]) * OUTPUT_TOKEN_RATIO
+    for attempt in range(max_retries + 1):
+        try:
+            if stream is None:
+                response_data = get_client().chat(payload, cache)
+            else:
+                response_data = get_client().chat_stream(
+                    payload, JsonListValidator(max_items=len(data_chunk)),
+                    stream.token_cap(expected_tokens), stream.max_seconds, cache
+                )
+            # 验证合并结果格式，先在本地修复，无法修复时才重试
+            merged_content = parse_output(response_data["message"]["content"], schema)
 
             merged_content = [{"instruction": "", "input": "", "output": merged_output} for merged_output in
                               merged_content]
+            # 只缓存通过校验的响应
+            if cache is not None:
+                cache.put(payload, response_data)
             return merged_content
 
         except (json.JSONDecodeError, KeyError, ValueError) as e:
+            if cache is not None:
+                cache.delete(payload)
             print(f"解析失败（尝试 {attempt + 1}/{max_retries}）: {str(e)}")
+            if on_parse_error is not None:
+                on_parse_error(str(e))
             if attempt >= max_retries:
                 raise Exception("达到最大重试次数，请检查合并结果格式")
-        finally:
-            if conn:
-                conn.close()
 
 
-def process_merge(model, json_data, merged_json_data, process_indices, batch_size, start_batch, output_path):
-    """分批处理合并任务"""
+def process_merge(model, json_data, merged_json_data, process_indices, batch_size, start_batch, output_path,
+                  concurrency=1, cache=None, packer=None, start_item=0, stream=None, use_schema=False):
+    """
+    分批处理合并任务
+
+    :param packer: 指定时按 token 预算分批，从第 ``start_item`` 条数据开始，忽略 ``batch_size`` 和 ``start_batch``
+    """
     total_items = len(process_indices)
     total_batches = (total_items + batch_size - 1) // batch_size
+    if packer is None:
+        batches = fixed_batches(total_items, batch_size, start_batch)
+        start_item = min(start_batch * batch_size, total_items)
+    else:
+        batches = packer.batches([json_data[i]["output"] for i in process_indices], start_item)
     start_time = time.time()
     time_records = []
-
-    for batch_num in range(start_batch, total_batches):
-        batch_start_time = time.time()
-        start_idx = batch_num * batch_size
-        end_idx = min(start_idx + batch_size, total_items)
-        batch_indices = process_indices[start_idx:end_idx]
-        current_batch = [json_data[i] for i in batch_indices]
+    writer = DatasetWriter(output_path, merged_json_data)
+    last_commit_time = start_time
+    next_batch = start_batch
+    next_item = start_item
+
+    def send(batch):
+        _, start_idx, end_idx, _ = batch
+        current_batch = [json_data[i] for i in process_indices[start_idx:end_idx]]
+        parse_errors = 0
+
+        def on_parse_error(_):
+            nonlocal parse_errors
+            parse_errors += 1
+
+        request_start = time.time()
+        merged_batch = send_to_ollama(model, current_batch, cache=cache, on_parse_error=on_parse_error, stream=stream,
+                                      use_schema=use_schema)
+        if packer is not None:
+            packer.record(batch, time.time() - request_start, parse_errors)
+        return current_batch, merged_batch
+
+    def commit(batch, result):
+        nonlocal last_commit_time, next_batch, next_item
+        batch_num, _, end_idx, budget = batch
+        current_batch, merged_batch = result
+
+        # 并发时按提交间隔计算每批耗时，反映实际吞吐
+        now = time.time()
+        time_records.append(now - last_commit_time)
+        last_commit_time = now
+        avg_item_time = (now - start_time) / (end_idx - start_item)
 
         # 进度显示
-        elapsed = time.time() - start_time
-        avg_time = sum(time_records) / len(time_records) if time_records else 0
-        remaining = (total_batches - batch_num) * avg_time if avg_time > 0 else 0
-
         print(f"\n{'=' * 40}")
-        print(f"处理进度: {batch_num + 1}/{total_batches} 批（原始数据共{len(json_data)}条）")
-        print(f"已用时间: {format_time(elapsed)}")
-        print(f"预计剩余: {format_time(remaining) if remaining > 0 else '计算中...'}")
-
-        try:
-            merged_batch = send_to_ollama(model, current_batch)
-
-            print(f"\n合并结果预览（原始{len(current_batch)}条 → 合并为{len(merged_batch)}条）：")
-            print(preview_results(merged_batch))
-
-            # 将合并结果添加到新列表
-            merged_json_data.extend(merged_batch)
+        if packer is None:
+            print(f"处理进度: {batch_num + 1}/{total_batches} 批（原始数据共{len(json_data)}条）")
+        else:
+            print(f"处理进度: {end_idx}/{total_items} 条，第 {batch_num + 1} 批 {len(current_batch)} 条（token 预算 {budget}）")
+        print(f"已用时间: {format_time(now - start_time)}")
+        print(f"预计剩余: {format_time((total_items - end_idx) * avg_item_time)}")
+
+        print(f"\n合并结果预览（原始{len(current_batch)}条 → 合并为{len(merged_batch)}条）：")
+        print(preview_results(merged_batch))
+
+        # 将合并结果添加到新列表并立即保存进度
+        writer.extend(merged_batch)
+        next_batch = batch_num + 1
+        next_item = end_idx
+        print(f"本批处理时间: {time_records[-1]:.1f}秒")
 
-            # 立即保存进度
-            save_json(output_path, merged_json_data)
-
-            batch_time = time.time() - batch_start_time
-            time_records.append(batch_time)
-            print(f"本批处理时间: {batch_time:.1f}秒")
-
-        except Exception as e:
-            save_json(output_path, merged_json_data)
-            print(f"\n错误：处理批次 {batch_num + 1} 时失败，已保存当前进度")
-            command = f"python script.py --input {output_path} --output {output_path} " \
-                      f"--batch-size {batch_size} --start-batch {batch_num}"
-            print(f"续处理命令：\n{command}")
-            raise
+    try:
+        run_ordered(batches, send, commit, concurrency)
+    except Exception:
+        writer.close()
+        command = f"python script.py --input {output_path} --output {output_path} "
+        if packer is None:
+            print(f"\n错误：处理批次 {next_batch + 1} 时失败，已保存当前进度")
+            command += f"--batch-size {batch_size} --start-batch {next_batch}"
+        else:
+            print(f"\n错误：处理第 {next_item + 1} 条数据时失败，已保存当前进度")
+            command += f"--token-budget {packer.budget} --start-item {next_item}"
+        print(f"续处理命令：\n{command}")
+        raise
+
+    writer.close()
 
     # 最终统计
     total_time = time.time() - start_time
     print(f"\n{'=' * 40}")
     print(f"合并完成！总耗时: {format_time(total_time)}")
     print(f"原始条目数: {len(json_data)} → 合并后条目数: {len(merged_json_data)}")
-    print(f"平均每批处理时间: {sum(time_records) / len(time_records):.1f}秒")
+    if time_records:
+        print(f"平均每批处理时间: {sum(time_records) / len(time_records):.1f}秒")
     return merged_json_data
 
 
 def main():
     parser = argparse.ArgumentParser(description="数据合并工具")
-    parser.add_argument("--input", required=True, help="输入JSON文件路径")
-    parser.add_argument("--output", required=True, help="输出JSON文件路径")
+    parser.add_argument("--input", required=True, help="输入文件路径（JSON 或 JSONL）")
+    parser.add_argument("--output", required=True, help="输出文件路径（JSON 或 JSONL）")
     parser.add_argument("--batch-size", type=int, default=10, help="每批处理数量（默认10）")
     parser.add_argument("--start-batch", type=int, default=0, help="起始批次号（从0开始）")
+    add_packing_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="同时发送的请求数（默认1），需配合 Ollama 的 OLLAMA_NUM_PARALLEL 使用")
+    add_cache_arguments(parser)
+    add_stream_arguments(parser)
+    add_schema_argument(parser)
     parser.add_argument("--model", type=str, default="qwen2.5:14b", help="所用模型名称（默认qwen2.5:14b）")
 
     args = parser.parse_args()
 
     try:
-        original_data = read_json(args.input)
+        original_data = load_records(args.input)
     except Exception as e:
         print(f"无法读取输入文件: {str(e)}")
         return
 
     try:
-        processed_data = read_json(args.output)
+        processed_data = load_records(args.output)
     except Exception as e:
         print(f"无法读取输出文件，将设置已合并数据为空: {str(e)}")
         processed_data = []
@@ -217,10 +264,20 @@ def main():
 
     # 验证起始批次
     total_batches = (len(process_indices) + args.batch_size - 1) // args.batch_size
-    if args.start_batch >= total_batches and total_batches > 0:
+    if args.token_budget is not None:
+        if args.start_item >= len(process_indices) > 0:
+            print(f"错误：起始条目 {args.start_item} 超出总条数 {len(process_indices)}")
+            return
+    elif args.start_batch >= total_batches and total_batches > 0:
         print(f"错误：起始批次 {args.start_batch} 超出总批次数 {total_batches}")
         return
 
+    system_prompt = build_payload(args.model, [])["messages"][0]["content"]
+    packer = open_packer(args, OUTPUT_TOKEN_RATIO, estimate_tokens(system_prompt))
+    use_schema = not args.no_schema and get_client().supports_schema()
+    if not args.no_schema and not use_schema:
+        print("Ollama 版本过低或无法获取版本，不发送 JSON Schema，仅在本地修复和校验输出")
+    cache = open_cache(args)
     try:
         process_merge(
             model=args.model,
@@ -229,11 +286,22 @@ def main():
             process_indices=process_indices,
             batch_size=args.batch_size,
             start_batch=args.start_batch,
-            output_path=args.output
+            output_path=args.output,
+            concurrency=args.concurrency,
+            cache=cache,
+            packer=packer,
+            start_item=args.start_item,
+            stream=open_stream(args),
+            use_schema=use_schema
         )
         print("\n合并完成！")
     except Exception as e:
         print(f"\n处理中断: {str(e)}")
+    finally:
+        print(output_stats.summary())
+        if cache is not None:
+            print(cache.stats())
+            cache.close()
 
 
 if __name__ == "__main__":
@@ -1,148 +1,147 @@
-import csv
 from multiprocessing import Pool, freeze_support
-import json
-from datetime import datetime
-from collections import defaultdict
+from collections import deque
 
+from dataset_store import save_records
+from external_sort import ExternalSorter
+from group_msg_io import parse_timestamp, read_group_msg_rows
+from msg_cleaner import MultiPatternCleaner
+from msg_merge import merge_message_stream
+from stage_profiler import StageProfiler
 
-INPUT_CSV_PATH = r"group_msg.csv"
+
+INPUT_CSV_PATH = r"group_msg.csv"  # 也可以是 qq_nt_parse 输出的 Parquet 文件
 INPUT_CSV_ENCODING = "gbk"
-OUTPUT_JSON_PATH = r"auto-combine-group-msg_no-llm.json"
+OUTPUT_JSON_PATH = r"auto-combine-group-msg_no-llm.json"  # 扩展名为 .jsonl 或 .jsonl.zst 时输出带偏移索引的 JSONL 文件
+PROFILE_REPORT_PATH = None  # 性能报告输出路径（JSON），为 None 时不统计各阶段耗时
+SPECIAL_TOKENS = ["[表情]", "[语音通话]", "@天才工具 人战兔"]  # 与@昵称一同删除的特殊内容
+CLEAN_WORKERS = None  # 清理片段的进程数，None 为 CPU 核心数，1 则不使用子进程
+CLEAN_CHUNK_SIZE = 2000  # 每次发送给子进程的消息条数
+MERGE_MAX_OTHER_MESSAGES = 2  # 同一用户相邻两条消息之间最多夹有几条他人消息时合并
+MERGE_MAX_INTERVAL_SECONDS = 60  # 同一用户相邻两条消息最多间隔多少秒时合并
+INGEST_MEMORY_BUDGET_MB = 2048  # 读取的消息超过该内存占用时按时间排序后写入临时文件
+SPILL_DIR = None  # 临时文件目录，None 为系统临时目录
+
+_cleaner = None  # 子进程中的清理器，由 init_clean_worker 设置
 
-def remove_at_nickname(args):
-    text_list, nickname_list = args
+def remove_at_nickname(text_list, cleaner):
     for i in range(len(text_list)):
-        for nickname in nickname_list:
-            text_list[i] = text_list[i].replace(f"@{nickname}", "")
+        # 一次性删除所有@昵称和特殊内容
+        text_list[i] = cleaner.sub(text_list[i])
         while text_list[i].startswith("@"):
             text_parts = text_list[i].split(" ")
             text_list[i] = "".join(text_parts[1:])
-        text_list[i] = text_list[i].replace("[表情]", "").replace("[语音通话]", "").replace("@天才工具 人战兔", "").strip()
+        text_list[i] = text_list[i].strip()
     return list(filter(bool, text_list))
 
+def init_clean_worker(cleaner):
+    # 清理器只在子进程启动时传递一次，不随每个任务重复序列化
+    global _cleaner
+    _cleaner = cleaner
+
+def clean_segments(text_list):
+    return remove_at_nickname(text_list, _cleaner)
+
+def iter_cleaned_segments(content_list, cleaner, workers=CLEAN_WORKERS, chunk_size=CLEAN_CHUNK_SIZE):
+    # 按原顺序逐条返回清理结果，任务分批发送，不一次性生成所有结果
+    if workers == 1:
+        yield from (remove_at_nickname(text_list, cleaner) for text_list in content_list)
+        return
+    with Pool(workers, initializer=init_clean_worker, initargs=(cleaner,)) as pool:
+        yield from pool.imap(clean_segments, content_list, chunksize=chunk_size)
+
+def estimate_record_size(record):
+    # 粗略估算一条消息在内存中占用的字节数
+    return 200 + sum(80 + 2 * len(segment) for segment in record[2])
+
+def read_records(path, encoding, nicknames, invalid_records):
+    # 只读取一次输入文件：收集所有可能的用户昵称，同时逐条返回 (时间戳, 用户ID, 聊天片段)
+    for row in read_group_msg_rows(path, encoding):
+        nicknames.add(row[2])  # 第三列为用户昵称
+        if row[2].startswith("?"):
+            nicknames.add(row[2][1:])
+        if row[2].endswith("?"):
+            nicknames.add(row[2][:-1])
+
+        # 解析聊天内容，Parquet 文件中已是片段列表
+        if isinstance(row[4], list):
+            content_seg = row[4]
+        else:
+            content_str = row[4].replace("', '", "','")  # 处理格式问题
+            try:
+                content_seg = [seg.strip("'") for seg in content_str[1:-1].split("','")]
+            except:
+                content_seg = []
+
+        try:
+            timestamp = parse_timestamp(row[1])
+        except ValueError:
+            # 清理后内容为空的消息不需要时间，时间无效的消息留到清理后再检查
+            invalid_records.append((row[1], row[3], content_seg))
+            continue
+        yield timestamp, row[3], content_seg
+
 if __name__ == "__main__":
     freeze_support()
+    profiler = StageProfiler("auto-combine-group-msg_no-llm", enabled=PROFILE_REPORT_PATH is not None)
 
     try:
-        # Step 1: 读取所有可能的用户昵称
-        nicknames = set()
-        with open(INPUT_CSV_PATH, 'r', encoding=INPUT_CSV_ENCODING) as f:
-            reader = csv.reader(f)
-            for row in reader:
-                nicknames.add(row[2])  # 第三列为用户昵称
-                if row[2].startswith("?"):
-                    nicknames.add(row[2][1:])
-                if row[2].endswith("?"):
-                    nicknames.add(row[2][:-1])   
-        nicknames.discard("")
-        nicknames.discard(" ")
-
-        # Step 2: 处理聊天内容并合并片段
-        processed_rows = []
-        with open(INPUT_CSV_PATH, 'r', encoding=INPUT_CSV_ENCODING) as f:
-            reader = csv.reader(f)
-            content_list = []
-            row_list = []
-            for row in reader:
-                # 解析聊天内容
-                content_str = row[4].replace("', '", "','")  # 处理格式问题
-                try:
-                    content_seg = [seg.strip("'") for seg in content_str[1:-1].split("','")]
-                except:
-                    content_seg = []
-                row_list.append(row)
-                content_list.append(content_seg)
-            
-            # 处理每个片段
-            nickname_list = list(nicknames)
-            with Pool() as pool:
-                cleaned_segments_parts = list(
-                    pool.map(remove_at_nickname, map(lambda x: (x, nickname_list), content_list))
-                )
-            
-            for (row, cleaned_segments) in zip(row_list, cleaned_segments_parts):
-                if not cleaned_segments:
-                    continue
-                merged_content = '，'.join(cleaned_segments)
-                
-                # 解析时间
-                dt = datetime.fromisoformat(row[1].replace('Z', '+00:00'))
-                
-                processed_rows.append({
-                    'datetime': dt,
-                    'user_id': row[3],
-                    'content': merged_content
-                })
-
-        # 按时间排序
-        processed_rows.sort(key=lambda x: x['datetime'])
-
-        # Step 3: 合并符合条件的记录
-        user_indices = defaultdict(list)
-        for idx, msg in enumerate(processed_rows):
-            user_indices[msg['user_id']].append(idx)
-
-        all_merged = []
-        for user_id, indices in user_indices.items():
-            if not indices:
-                continue
-            
-            groups = []
-            current_group = [indices[0]]
-            
-            for i in range(1, len(indices)):
-                prev_idx = indices[i-1]
-                current_idx = indices[i]
-                
-                # 计算中间他人消息数量
-                other_count = 0
-                for between_idx in range(prev_idx + 1, current_idx):
-                    if processed_rows[between_idx]['user_id'] != user_id:
-                        other_count += 1
-                
-                # 计算时间差
-                time_diff = (processed_rows[current_idx]['datetime'] - processed_rows[prev_idx]['datetime']).total_seconds()
-                
-                if other_count <= 2 and time_diff <= 60:
-                    current_group.append(current_idx)
-                else:
-                    groups.append(current_group)
-                    current_group = [current_idx]
-            
-            groups.append(current_group)
-            
-            # 生成合并后的消息
-            for group in groups:
-                content_list = [processed_rows[i]['content'] for i in group]
-                merged_content = '，'.join(content_list)
-                avg_time = sum(processed_rows[i]['datetime'].timestamp() for i in group) / len(group)
-                merged_dt = datetime.fromtimestamp(avg_time)
-                all_merged.append({
-                    'user_id': user_id,
-                    'datetime': merged_dt,
-                    'content': merged_content
-                })
-
-        # Step 4: 按时间排序合并后的记录
-        all_merged.sort(key=lambda x: x['datetime'])
-
-        # Step 5: 计算时间差
-        result = []
-        prev_time = None
-        for msg in all_merged:
-            current_time = msg['datetime']
-            delta_seconds = 0
-            if prev_time is not None:
-                delta_seconds = int((current_time - prev_time).total_seconds())
-            result.append({
-                'user_id': msg['user_id'],
-                'content': msg['content'],
-                'delta': f"{delta_seconds}秒"
-            })
-            prev_time = current_time
-
-        # Step 6: 导出为JSON
-        with open(OUTPUT_JSON_PATH, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
+        sorter = ExternalSorter(
+            key=lambda x: x[0],
+            memory_budget=INGEST_MEMORY_BUDGET_MB * 1024 * 1024,
+            sizeof=estimate_record_size,
+            spill_dir=SPILL_DIR
+        )
+        with sorter:
+            # Step 1: 读取所有可能的用户昵称和聊天内容，按时间排序，超出内存预算的部分暂存到临时文件
+            with profiler.stage("read"):
+                nicknames = set()
+                invalid_records = []
+                read_count = 0
+                for record in read_records(INPUT_CSV_PATH, INPUT_CSV_ENCODING, nicknames, invalid_records):
+                    sorter.add(record)
+                    read_count += 1
+                nicknames.discard("")
+                nicknames.discard(" ")
+
+            # Step 2: 构建清理器，时间无效的消息清理后仍有内容时报错
+            with profiler.stage("build_cleaner"):
+                cleaner = MultiPatternCleaner([f"@{nickname}" for nickname in nicknames] + SPECIAL_TOKENS)
+                for raw_time, user_id, content_seg in invalid_records:
+                    if remove_at_nickname(content_seg, cleaner):
+                        parse_timestamp(raw_time)  # 抛出时间格式错误
+
+            # Step 3: 按时间顺序逐条清理聊天内容，逐个窗口合并符合条件的记录并计算时间差，边合并边导出
+            with profiler.stage("process"):
+                # 子进程按顺序返回清理结果，时间和用户ID暂存在队列中与结果一一对应
+                pending = deque()
+
+                def iter_segments():
+                    for timestamp, user_id, content_seg in sorter:
+                        pending.append((timestamp, user_id))
+                        yield content_seg
+
+                def iter_cleaned_messages():
+                    for cleaned_segments in iter_cleaned_segments(iter_segments(), cleaner):
+                        timestamp, user_id = pending.popleft()
+                        if cleaned_segments:
+                            yield timestamp, user_id, '，'.join(cleaned_segments)
+
+                def iter_result():
+                    for user_id, content, delta_seconds in merge_message_stream(
+                            iter_cleaned_messages(), MERGE_MAX_OTHER_MESSAGES, MERGE_MAX_INTERVAL_SECONDS
+                    ):
+                        yield {
+                            'user_id': user_id,
+                            'content': content,
+                            'delta': f"{delta_seconds}秒"
+                        }
+
+                # 输出为 JSONL 时逐条写入；输出为 JSON 数组时仍需在内存中生成完整结果
+                save_records(OUTPUT_JSON_PATH, iter_result())
+
+        profiler.count("read", read_count + len(invalid_records))
+        profiler.count("process", read_count)
+        if PROFILE_REPORT_PATH:
+            profiler.save(PROFILE_REPORT_PATH)
     except KeyboardInterrupt:
         print("用户中断了程序")
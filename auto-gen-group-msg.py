@@ -1,11 +1,21 @@
 import argparse
-import http.client
 import json
 from datetime import timedelta
 
 import time
 
+from batch_packer import add_packing_arguments, estimate_tokens, fixed_batches, open_packer
+from batch_salvage import DEFAULT_DEAD_LETTER_PATH, DeadLetterFile, salvage_batch
+from dataset_store import DatasetWriter, load_records
+from llm_cache import add_cache_arguments, open_cache
+from llm_output import add_schema_argument, output_stats, pair_list_schema, parse_output
+from ollama_client import get_client
+from ordered_dispatch import run_ordered
+from stream_guard import JsonListValidator, add_stream_arguments, open_stream
+
 USER_NAME = "JY"
+OUTPUT_TOKEN_RATIO = 2.5
+"""按 token 预算分批时，预计输出的 token 数与输入之比（输出包含原句和生成的内容）"""
 
 
 def format_time(seconds):
@@ -26,35 +36,18 @@ def preview_results(results, preview_count=3, max_length=50):
     return "\n".join(preview)
 
 
-def read_json(file_path):
-    """读取JSON文件"""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-
-def save_json(file_path, data):
-    """保存JSON文件"""
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
-
-def send_to_ollama(model, data_chunk, max_retries=100):
-    """发送请求到Ollama并进行自动重试"""
-    for attempt in range(max_retries + 1):
-        conn = None
-        try:
-            conn = http.client.HTTPConnection("127.0.0.1:11434")
-            headers = {"Content-Type": "application/json"}
-            payload = {
-                "model": model,
-                "stream": False,
-                "options": {
-                    "temperature": 1.5
-                },
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": """\
+def build_payload(model, data_chunk):
+    """生成请求内容"""
+    return {
+        "model": model,
+        "stream": False,
+        "options": {
+            "temperature": 1.5
+        },
+        "messages": [
+            {
+                "role": "system",
+                "content": """\
 请帮我进行数据集的生成，你会收到 JSON 列表格式的聊天记录，是一个群成员在回复别人的消息。
 
 你需要根据 该成员的回复语句，推测聊天话题和上下文语境，猜测 被该成员回复 的消息内容。
@@ -96,139 +89,224 @@ A: 千层面是西餐中的经典 B 回复道: 千层面好吃
 ]
 \
 """
-                    },
-                    #                                         {
-                    #                                             "role": "assistant",
-                    #                                             "content": """\
-                    # <think>
-                    # 嗯，我现在需要帮用户生成一个数据集，根据给定的JSON列表中的聊天记录，为每个成员的消息生成对应的其他成员的前文。
-
-                    # 接下来，我需要分析用户提供的例子，理解正确的处理方式。例如，当输入是["康帅博", "好饿啊该吃什么", "吆西，来吃kfc"]时，正确的输出是根据每个回复生成合理的前文，比如第一个回复“康帅博”对应的前文可能是询问品牌的问题，而不是直接提到康帅博。而第二个回复可能没有合适的前文，所以用null。第三个回复则是针对去吃的建议，前文可能是询问地点。
-
-                    # 现在，我需要处理一个具体的输入例子，假设输入是三个消息。首先，针对每条消息，我需要推测可能的上下文。例如，第一条消息是“康帅博”，这可能是在回答关于泡面品牌的问题，所以前文可能是“你喜欢哪个品牌的泡面？”。而第二条“好饿啊该吃什么”可能是一个发起的话题，但如果没有更合适的上下文，可能使用null。第三条“吆西，来吃kfc”可能是回答去哪吃的问题，所以前文是“去哪里吃？”。
-
-                    # 需要注意避免前文重复回复中的关键词，例如，不能直接问“你喜欢康帅博吗？”，而是更自然的问题。同时，确保每个前文和回复之间的逻辑连贯，符合日常对话的习惯。
-
-                    # 在处理过程中，如果遇到某些回复确实无法推断出合适的上下文，就使用null。必须确保生成的列表数量与输入一致，不能多也不能少。最后，输出的格式应该是严格的JSON列表，
-                    # </think>
-                    # 好的，请发送你要处理的数据\
-                    # """
-                    #                                         },
-                    {
-                        "role": "user",
-                        "content": json.dumps([row["output"] for row in data_chunk], ensure_ascii=False, indent=4)
-                    }
-                ]
+            },
+            #                                         {
+            #                                             "role": "assistant",
+            #                                             "content": """\
+            # <think>
+            # 嗯，我现在需要帮用户生成一个数据集，根据给定的JSON列表中的聊天记录，为每个成员的消息生成对应的其他成员的前文。
+
+            # 接下来，我需要分析用户提供的例子，理解正确的处理方式。例如，当输入是["康帅博", "好饿啊该吃什么", "吆西，来吃kfc"]时，正确的输出是根据每个回复生成合理的前文，比如第一个回复“康帅博”对应的前文可能是询问品牌的问题，而不是直接提到康帅博。而第二个回复可能没有合适的前文，所以用null。第三个回复则是针对去吃的建议，前文可能是询问地点。
+
+            # 现在，我需要处理一个具体的输入例子，假设输入是三个消息。首先，针对每条消息，我需要推测可能的上下文。例如，第一条消息是“康帅博”，这可能是在回答关于泡面品牌的问题，所以前文可能是“你喜欢哪个品牌的泡面？”。而第二条“好饿啊该吃什么”可能是一个发起的话题，但如果没有更合适的上下文，可能使用null。第三条“吆西，来吃kfc”可能是回答去哪吃的问题，所以前文是“去哪里吃？”。
+
+            # 需要注意避免前文重复回复中的关键词，例如，不能直接问“你喜欢康帅博吗？”，而是更自然的问题。同时，确保每个前文和回复之间的逻辑连贯，符合日常对话的习惯。
+
+            # 在处理过程中，如果遇到某些回复确实无法推断出合适的上下文，就使用null。必须确保生成的列表数量与输入一致，不能多也不能少。最后，输出的格式应该是严格的JSON列表，
+            # </think>
+            # 好的，请发送你要处理的数据\
+            # """
+            #                                         },
+            {
+                "role": "user",
+                "content": json.dumps([row["output"] for row in data_chunk], ensure_ascii=False, indent=4)
             }
-            conn.request("POST", "/api/chat", body=json.dumps(payload), headers=headers)
-            response = conn.getresponse()
-
-            if response.status != 200:
-                raise Exception(f"API错误: {response.status} {response.reason}")
-
-            response_data = json.loads(response.read().decode())
-            content: str = response_data["message"]["content"]
-
-            content = content.replace("```json", "").replace("```", "")
-            if (think_index := content.find("</think>")) != -1:
-                content = content[think_index + len("</think>"):]
-            generated_content = json.loads(content)
-
-            if not isinstance(generated_content, list) or len(generated_content) != len(data_chunk):
-                raise ValueError("返回数据格式或长度不正确")
-
-            generated_content = [
-                {
-                    "instruction": "请你答复下面这位网络群聊成员发送的消息",
-                    "input": input_,
-                    "output": output_row["output"],
-                    "system": f"你不是机器人，而是一个名字叫“{USER_NAME}”的网络群聊成员，他说话比较直接，喜欢用粗话。接下来你会收到其他群聊成员发送的消息，你要以他的身份答复。说话不要太正式，要简短些。"
-                } for output_row, (input_, _) in zip(data_chunk, filter(lambda x: bool(x[0]), generated_content))
-            ]
-
-            return generated_content
-
-        except (json.JSONDecodeError, KeyError, ValueError) as e:
-            print(content)
-            print(f"解析失败（尝试 {attempt + 1}/{max_retries}）: {str(e)}")
-            if attempt >= max_retries:
-                raise Exception("达到最大重试次数，请检查生成内容格式")
-        finally:
-            if conn:
-                conn.close()
-
-
-def process_json_in_batches(model, json_data, process_indices, batch_size, start_batch, output_path, skip_existing):
-    """分批处理数据并自动保存进度"""
+        ]
+    }
+
+
+def parse_item(output_row, generated_item):
+    """校验单条生成结果并转换为数据集条目，提问为空或格式不正确时抛出 ValueError"""
+    # 每条结果应为 [生成的提问, 原句]，不检查时长度为 2 的字符串等也能被解包
+    if not (isinstance(generated_item, list) and len(generated_item) == 2
+            and all(v is None or isinstance(v, str) for v in generated_item)):
+        raise ValueError("生成结果不是 [提问, 原句]")
+    input_, _ = generated_item
+    if not input_:
+        raise ValueError("生成的提问为空")
+    return {
+        "instruction": "请你答复下面这位网络群聊成员发送的消息",
+        "input": input_,
+        "output": output_row["output"],
+        "system": f"你不是机器人，而是一个名字叫“{USER_NAME}”的网络群聊成员，他说话比较直接，喜欢用粗话。接下来你会收到其他群聊成员发送的消息，你要以他的身份答复。说话不要太正式，要简短些。"
+    }
+
+
+def request_batch(model, data_chunk, attempt, cache=None, stream=None, use_schema=False):
+    """
+    请求一批数据，返回与之对应的结果列表
+
+    :param stream: 指定时流式请求，返回内容不是条数正确的列表或超出限制时提前中止
+    :param use_schema: 是否通过 format 字段要求 Ollama 按 JSON Schema 输出
+    """
+    schema = pair_list_schema(len(data_chunk))
+    payload = build_payload(model, data_chunk)
+    if use_schema:
+        payload["format"] = schema
+    # 重试时不读取缓存，重新生成
+    request_cache = cache if attempt == 0 else None
+    if stream is None:
+        response_data = get_client().chat(payload, request_cache)
+    else:
+        expected_tokens = estimate_tokens(payload["messages"][-1]["content"]) * OUTPUT_TOKEN_RATIO
+        response_data = get_client().chat_stream(
+            payload, JsonListValidator(len(data_chunk)),
+            stream.token_cap(expected_tokens), stream.max_seconds, request_cache
+        )
+    # 先在本地修复，列表本身无法修复时才重试；格式不正确的条目保持原样，由 parse_item 逐条校验
+    generated_content = parse_output(response_data["message"]["content"], schema, strict_items=False)
+
+    # 只缓存长度正确的响应，其中无效的条目会单独重新请求
+    if cache is not None:
+        cache.put(payload, response_data)
+    return generated_content
+
+
+def send_to_ollama(model, data_chunk, cache=None, on_dead_letter=None, on_parse_error=None, stream=None,
+                   use_schema=False):
+    """
+    发送请求到Ollama，返回与 data_chunk 一一对应的结果
+
+    返回内容无法解析时重试或拆分批次，部分条目无效时保留其余有效结果，只重新请求无效的条目；
+    多次失败的条目调用 ``on_dead_letter(序号, 错误信息)``，结果为 None；
+    每次返回内容无法解析时调用 ``on_parse_error(错误信息)``
+    """
+    return salvage_batch(
+        data_chunk,
+        lambda chunk, attempt: request_batch(model, chunk, attempt, cache, stream, use_schema),
+        parse_item,
+        on_dead_letter,
+        on_parse_error
+    )
+
+
+def process_json_in_batches(model, json_data, process_indices, batch_size, start_batch, output_path, skip_existing,
+                            concurrency=1, cache=None, dead_letter=None, packer=None, start_item=0, stream=None,
+                            use_schema=False):
+    """
+    分批处理数据并自动保存进度
+
+    :param packer: 指定时按 token 预算分批，从第 ``start_item`` 条待处理数据开始，忽略 ``batch_size`` 和 ``start_batch``
+    """
     total_items = len(process_indices)
     total_batches = (total_items + batch_size - 1) // batch_size
+    if packer is None:
+        batches = fixed_batches(total_items, batch_size, start_batch)
+        start_item = min(start_batch * batch_size, total_items)
+    else:
+        batches = packer.batches([json_data[i]["output"] for i in process_indices], start_item)
     start_time = time.time()
     time_records = []
+    writer = DatasetWriter(output_path, json_data)
+    last_commit_time = start_time
+    next_batch = start_batch
+    next_item = start_item
 
-    for batch_num in range(start_batch, total_batches):
-        batch_start_time = time.time()
-        start_idx = batch_num * batch_size
-        end_idx = min(start_idx + batch_size, total_items)
+    def send(batch):
+        _, start_idx, end_idx, _ = batch
         batch_indices = process_indices[start_idx:end_idx]
-        current_batch = [json_data[i] for i in batch_indices]
+        parse_errors = 0
+
+        def on_dead_letter(position, error):
+            if dead_letter is not None:
+                dead_letter.add(batch_indices[position], json_data[batch_indices[position]], error)
+
+        def on_parse_error(_):
+            nonlocal parse_errors
+            parse_errors += 1
+
+        request_start = time.time()
+        response = send_to_ollama(model, [json_data[i] for i in batch_indices], cache, on_dead_letter, on_parse_error,
+                                  stream, use_schema)
+        if packer is not None:
+            packer.record(batch, time.time() - request_start, parse_errors)
+        return batch_indices, response
+
+    def commit(batch, result):
+        nonlocal last_commit_time, next_batch, next_item
+        batch_num, _, end_idx, budget = batch
+        batch_indices, response = result
+        # 多次处理失败的条目保持原样
+        updated = [(idx, resp_item) for idx, resp_item in zip(batch_indices, response) if resp_item is not None]
+
+        # 并发时按提交间隔计算每批耗时，反映实际吞吐
+        now = time.time()
+        time_records.append(now - last_commit_time)
+        last_commit_time = now
+        avg_item_time = (now - start_time) / (end_idx - start_item)
 
         # 进度显示
-        elapsed = time.time() - start_time
-        avg_time = sum(time_records) / len(time_records) if time_records else 0
-        remaining = (total_batches - batch_num) * avg_time if avg_time > 0 else 0
-
         print(f"\n{'=' * 40}")
-        print(f"处理进度: {batch_num + 1}/{total_batches} 批（共{total_items}条需处理）")
-        print(f"已用时间: {format_time(elapsed)}")
-        print(f"预计剩余: {format_time(remaining) if remaining > 0 else '计算中...'}")
-
-        try:
-            response = send_to_ollama(model, current_batch)
+        if packer is None:
+            print(f"处理进度: {batch_num + 1}/{total_batches} 批（共{total_items}条需处理）")
+        else:
+            print(f"处理进度: {end_idx}/{total_items} 条，第 {batch_num + 1} 批 {len(batch_indices)} 条（token 预算 {budget}）")
+        print(f"已用时间: {format_time(now - start_time)}")
+        print(f"预计剩余: {format_time((total_items - end_idx) * avg_item_time)}")
 
-            print(f"\n当前批次结果预览：")
-            print(preview_results(response))
+        print(f"\n当前批次结果预览：")
+        print(preview_results([resp_item for _, resp_item in updated]))
 
-            # 更新原数据
-            for idx, resp_item in zip(batch_indices, response):
-                json_data[idx] = resp_item
+        # 更新原数据
+        for idx, resp_item in updated:
+            json_data[idx] = resp_item
 
-            save_json(output_path, json_data)
+        writer.update([idx for idx, _ in updated])
+        next_batch = batch_num + 1
+        next_item = end_idx
+        print(f"本批处理时间: {time_records[-1]:.1f}秒")
 
-            batch_time = time.time() - batch_start_time
-            time_records.append(batch_time)
-            print(f"本批处理时间: {batch_time:.1f}秒")
-
-        except Exception as e:
-            save_json(output_path, json_data)
-            print(f"\n错误：处理批次 {batch_num + 1} 时失败，已保存当前进度")
-            # 构造续处理命令
-            command = f"python script.py --input {output_path} --output {output_path} " \
-                      f"--batch-size {batch_size} --start-batch {batch_num}"
-            if skip_existing:
-                command += " --skip-existing"
-            print(f"请使用以下命令继续处理：\n{command}")
-            raise
+    try:
+        run_ordered(batches, send, commit, concurrency)
+    except Exception:
+        writer.close()
+        # 构造续处理命令
+        command = f"python script.py --input {output_path} --output {output_path} "
+        if packer is None:
+            print(f"\n错误：处理批次 {next_batch + 1} 时失败，已保存当前进度")
+            command += f"--batch-size {batch_size} --start-batch {next_batch}"
+        else:
+            print(f"\n错误：处理第 {next_item + 1} 条待处理数据时失败，已保存当前进度")
+            command += f"--token-budget {packer.budget}"
+            # 跳过已处理的条目时，待处理数据会重新筛选，从头开始即可
+            if not skip_existing:
+                command += f" --start-item {next_item}"
+        if skip_existing:
+            command += " --skip-existing"
+        print(f"请使用以下命令继续处理：\n{command}")
+        raise
+
+    writer.close()
 
     total_time = time.time() - start_time
     print(f"\n{'=' * 40}")
     print(f"处理完成！总耗时: {format_time(total_time)}")
-    print(f"平均每批处理时间: {sum(time_records) / len(time_records):.1f}秒")
+    if time_records:
+        print(f"平均每批处理时间: {sum(time_records) / len(time_records):.1f}秒")
 
 
 def main():
     parser = argparse.ArgumentParser(description="JSON数据批量处理工具")
-    parser.add_argument("--input", required=True, help="输入JSON文件路径")
-    parser.add_argument("--output", required=True, help="输出JSON文件路径")
+    parser.add_argument("--input", required=True, help="输入文件路径（JSON 或 JSONL）")
+    parser.add_argument("--output", required=True, help="输出文件路径（JSON 或 JSONL）")
     parser.add_argument("--model", type=str, default="qwen2.5:14b", help="所用模型名称（默认qwen2.5:14b）")
     parser.add_argument("--batch-size", type=int, default=25, help="每批处理数量（默认25）")
     parser.add_argument("--start-batch", type=int, default=0, help="起始批次号（从0开始）")
+    add_packing_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="同时发送的请求数（默认1），需配合 Ollama 的 OLLAMA_NUM_PARALLEL 使用")
+    add_cache_arguments(parser)
+    add_stream_arguments(parser)
+    add_schema_argument(parser)
+    parser.add_argument("--dead-letter", default=DEFAULT_DEAD_LETTER_PATH,
+                        help=f"多次处理失败的条目追加保存到该文件（默认{DEFAULT_DEAD_LETTER_PATH}）")
     parser.add_argument("--skip-existing", action='store_true',
                         help="跳过已存在instruction的条目")
 
     args = parser.parse_args()
 
     try:
-        data = read_json(args.input)
+        data = load_records(args.input)
     except Exception as e:
         print(f"无法读取输入文件: {str(e)}")
         return
@@ -241,10 +319,21 @@ def main():
 
     # 验证起始批次
     total_batches = (len(process_indices) + args.batch_size - 1) // args.batch_size
-    if args.start_batch >= total_batches and total_batches > 0:
+    if args.token_budget is not None:
+        if args.start_item >= len(process_indices) > 0:
+            print(f"错误：起始条目 {args.start_item} 超出待处理条数 {len(process_indices)}")
+            return
+    elif args.start_batch >= total_batches and total_batches > 0:
         print(f"错误：起始批次 {args.start_batch} 超出总批次数 {total_batches}")
         return
 
+    system_prompt = build_payload(args.model, [])["messages"][0]["content"]
+    packer = open_packer(args, OUTPUT_TOKEN_RATIO, estimate_tokens(system_prompt))
+    use_schema = not args.no_schema and get_client().supports_schema()
+    if not args.no_schema and not use_schema:
+        print("Ollama 版本过低或无法获取版本，不发送 JSON Schema，仅在本地修复和校验输出")
+    cache = open_cache(args)
+    dead_letter = DeadLetterFile(args.dead_letter)
     try:
         process_json_in_batches(
             model=args.model,
@@ -253,11 +342,26 @@ def main():
             batch_size=args.batch_size,
             start_batch=args.start_batch,
             output_path=args.output,
-            skip_existing=args.skip_existing
+            skip_existing=args.skip_existing,
+            concurrency=args.concurrency,
+            cache=cache,
+            dead_letter=dead_letter,
+            packer=packer,
+            start_item=args.start_item,
+            stream=open_stream(args),
+            use_schema=use_schema
         )
         print("\n处理完成！")
     except Exception as e:
         print(f"\n处理中断: {str(e)}")
+    finally:
+        dead_letter.close()
+        if dead_letter.count:
+            print(f"{dead_letter.count} 条多次处理失败，已跳过并保存到 {args.dead_letter}")
+        print(output_stats.summary())
+        if cache is not None:
+            print(cache.stats())
+            cache.close()
 
 
 if __name__ == "__main__":
@@ -1,30 +1,50 @@
 import argparse
-import http.client
-import json
-from urllib.parse import urlparse
 
 import time
 
+from dataset_store import DatasetWriter, load_records
+from llm_cache import add_cache_arguments, open_cache
+from llm_output import INTEGER_SCHEMA, add_schema_argument, output_stats, parse_output
+from ollama_client import get_client
+from stream_guard import IntegerValidator, add_stream_arguments, open_stream
+
 USER_NAME = "JY"
+PAIR_ANSWER_TOKENS = 4
+"""流式请求时预计输出的 token 数（一个序号）"""
+
+
+def make_record(input_text, output_text):
+    """生成数据集条目"""
+    return {
+        "instruction": "请你答复下面这位网络群聊成员发送的消息",
+        "input": input_text,
+        "output": output_text,
+        "system": f"你不是机器人，而是一个名字叫“{USER_NAME}”的网络群聊成员，他说话比较直接，喜欢用粗话。接下来你会收到其他群聊成员发送的消息，你要以他的身份答复。说话不要太正式，要简短些。"
+    }
 
 
 def main():
     parser = argparse.ArgumentParser(description='处理聊天记录并生成对话对')
-    parser.add_argument('--input', required=True, help='输入的JSON文件路径')
-    parser.add_argument('--output', required=True, help='输出的JSON文件路径')
+    parser.add_argument('--input', required=True, help='输入的JSON/JSONL文件路径')
+    parser.add_argument('--output', required=True, help='输出的JSON/JSONL文件路径')
     parser.add_argument('--user', required=True, help='目标用户ID')
     parser.add_argument('--model', default='llama2', help='Ollama模型名称')
     parser.add_argument('--api', default='http://localhost:11434', help='Ollama API地址')
+    add_cache_arguments(parser)
+    add_stream_arguments(parser)
+    add_schema_argument(parser)
     args = parser.parse_args()
 
-    # 解析API地址
-    parsed_url = urlparse(args.api)
-    api_host = parsed_url.hostname
-    api_port = parsed_url.port or 11434
+    # 所有请求共用连接池
+    client = get_client(args.api)
+    cache = open_cache(args)
+    stream = open_stream(args)
+    use_schema = not args.no_schema and client.supports_schema()
+    if not args.no_schema and not use_schema:
+        print("Ollama 版本过低或无法获取版本，不发送 JSON Schema，仅在本地修复和校验输出")
 
     # 读取原始数据
-    with open(args.input, 'r', encoding='utf-8') as f:
-        messages = json.load(f)
+    messages = load_records(args.input)
 
     # 预处理有效目标消息
     valid_targets = []
@@ -53,8 +73,9 @@ def main():
             })
 
     # 初始化处理状态
-    dialogue_pairs = []
-    not_found_list = []
+    # 结果实时保存，JSONL 文件只追加新增的记录
+    pair_writer = DatasetWriter(args.output, [], indent=2)
+    not_found_writer = DatasetWriter("not_found_list.json", [], indent=2)
     discard_count = 0
     failed_count = 0
     total = len(valid_targets)
@@ -78,9 +99,6 @@ def main():
 
         for attempt in range(max_retries):
             try:
-                # 创建新的HTTP连接
-                conn = http.client.HTTPConnection(api_host, port=api_port)
-                headers = {"Content-Type": "application/json"}
                 payload = {
                     "model": args.model,
                     "stream": False,
@@ -128,24 +146,20 @@ def main():
                         }
                     ]
                 }
-                # 发送请求
-                conn.request("POST", "/api/chat", body=json.dumps(payload), headers=headers)
-                response = conn.getresponse()
-
-                # 检查HTTP状态码
-                if response.status != 200:
-                    raise Exception(f"API错误: {response.status} {response.reason}")
-
-                # 解析响应数据
-                response_data = json.loads(response.read().decode())
-                response_content = response_data["message"]["content"]
-
-                # 处理潜在的</think>标签
-                if (think_index := response_content.find("</think>")) != -1:
-                    response_content = response_content[think_index + len("</think>"):]
-
-                # 提取序号
-                match = int(response_content.strip())
+                if use_schema:
+                    payload["format"] = INTEGER_SCHEMA
+                # 发送请求并解析响应数据，状态码不为200时抛出异常。未找到后的重试不读取缓存，重新询问
+                request_cache = cache if not_found_times == 0 else None
+                if stream is None:
+                    response_data = client.chat(payload, request_cache)
+                else:
+                    # 只需输出一个序号
+                    response_data = client.chat_stream(payload, IntegerValidator(), stream.token_cap(PAIR_ANSWER_TOKENS),
+                                                       stream.max_seconds, request_cache)
+                # 提取序号，去除思考内容，必要时从文字中修复
+                match = parse_output(response_data["message"]["content"], INTEGER_SCHEMA)
+                if cache is not None:
+                    cache.put(payload, response_data)
                 if match == -1:
                     if not_found_times >= max_retries_not_found:
                         break
@@ -155,14 +169,13 @@ def main():
                     break  # 成功则退出重试循环
 
             except Exception as e:
+                if cache is not None:
+                    cache.delete(payload)
                 print(f"处理失败（第{attempt + 1}次重试）: {str(e)}")
                 if not attempt < max_retries - 1:
                     print("已达到最大重试次数，放弃处理该消息")
                     match = -1
                     failed_count += 1
-            finally:
-                if 'conn' in locals():
-                    conn.close()  # 确保连接关闭
 
         # 处理匹配结果
         if 0 <= match < len(context):
@@ -170,39 +183,25 @@ def main():
                 print(f"出现复读: {content[:50]}...")
                 discard_count += 1
             else:
-                dialogue_pairs.append([context[match]['content'], content])
+                pair_writer.append(make_record(context[match]['content'], content))
         else:
             print(f"未匹配到上下文: {content[:50]}...")
-            not_found_list.append(content)
+            not_found_writer.append(make_record("", content))
             discard_count += 1
 
-        # 实时保存结果
-        with open(args.output, 'w', encoding='utf-8') as f:
-            json.dump([
-                {
-                    "instruction": "请你答复下面这位网络群聊成员发送的消息",
-                    "input": input_text,
-                    "output": output_text,
-                    "system": f"你不是机器人，而是一个名字叫“{USER_NAME}”的网络群聊成员，他说话比较直接，喜欢用粗话。接下来你会收到其他群聊成员发送的消息，你要以他的身份答复。说话不要太正式，要简短些。"
-                } for (input_text, output_text) in dialogue_pairs
-            ], f, indent=2, ensure_ascii=False)
-        with open("not_found_list.json", 'w', encoding='utf-8') as f:
-            json.dump([
-                {
-                    "instruction": "请你答复下面这位网络群聊成员发送的消息",
-                    "input": "",
-                    "output": output_text,
-                    "system": f"你不是机器人，而是一个名字叫“{USER_NAME}”的网络群聊成员，他说话比较直接，喜欢用粗话。接下来你会收到其他群聊成员发送的消息，你要以他的身份答复。说话不要太正式，要简短些。"
-                } for output_text in not_found_list
-            ], f, indent=2, ensure_ascii=False)
-
         # 计算进度
         elapsed = time.time() - start_time
         avg_time = elapsed / processed
         remain = total - processed
         print(f"进度: {processed}/{total} | 剩余时间: {avg_time * remain:.1f}s")
 
-    print(f"处理完成，有效对话对: {len(dialogue_pairs)}，丢弃消息: {discard_count}，失败消息：{failed_count}")
+    pair_writer.close()
+    not_found_writer.close()
+    print(output_stats.summary())
+    if cache is not None:
+        print(cache.stats())
+        cache.close()
+    print(f"处理完成，有效对话对: {len(pair_writer.records)}，丢弃消息: {discard_count}，失败消息：{failed_count}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,156 @@
+import argparse
+import re
+import threading
+from collections.abc import Iterator, Sequence
+from typing import Optional
+
+ITEM_OVERHEAD_TOKENS = 4
+"""每条数据在 JSON 列表中额外占用的 token 数（引号、逗号、缩进等）"""
+MIN_BUDGET_RATIO = 0.25
+"""预算下限默认为初始预算的该倍数"""
+MAX_BUDGET_RATIO = 2
+"""预算上限默认为初始预算的该倍数"""
+ADJUST_EVERY = 3
+"""同一预算下完成多少批后调整一次预算"""
+STEP_RATIO = 0.2
+"""每次调整预算的幅度"""
+BACKOFF_RATIO = 0.7
+"""解析失败过多时预算乘以该值"""
+MAX_FAILURE_RATE = 0.2
+"""每批平均解析失败次数超过该值时减小预算"""
+
+_WIDE_CHAR_PATTERN = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中日韩文字和全角符号每个约 1 个 token，其他字符约 4 个 1 个 token"""
+    wide = len(_WIDE_CHAR_PATTERN.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def fixed_batches(count: int, batch_size: int, start_batch: int = 0) -> Iterator[tuple[int, int, int, None]]:
+    """按固定条数分批，生成 (批次号, 起始位置, 结束位置, None)"""
+    for batch_num in range((count + batch_size - 1) // batch_size)[start_batch:]:
+        yield batch_num, batch_num * batch_size, min((batch_num + 1) * batch_size, count), None
+
+
+class TokenBudgetPacker:
+    """
+    按估计的 token 数分批：每批的提示词、输入和预计输出的 token 数之和不超过预算
+
+    每批完成后调用 :meth:`record` 反馈耗时和解析失败次数，同一预算下完成 ``ADJUST_EVERY`` 批后调整预算：
+    解析失败过多（多为超出上下文长度）时按 ``BACKOFF_RATIO`` 减小，并把预算上限降到失败时的预算以下；
+    否则比较平均每个输入 token 的耗时（各条数据长短不一，按条数计算波动太大），
+    比上次快就继续沿同一方向调整，变慢则反向，使每小时处理的条数尽量多。
+    分批是惰性的，并发时新的一批按当时的预算划分；可在多个线程中调用 :meth:`record`
+    """
+
+    def __init__(
+            self,
+            token_budget: int,
+            output_ratio: float,
+            fixed_tokens: int = 0,
+            min_budget: Optional[int] = None,
+            max_budget: Optional[int] = None,
+            adaptive: bool = True
+    ):
+        """
+        :param token_budget: 初始预算，应不大于模型的上下文长度（Ollama 的 ``num_ctx``）
+        :param output_ratio: 预计输出的 token 数与输入 token 数之比
+        :param fixed_tokens: 每批固定占用的 token 数（系统提示词等）
+        """
+        self.output_ratio = output_ratio
+        self.fixed_tokens = fixed_tokens
+        self.min_budget = min_budget or int(token_budget * MIN_BUDGET_RATIO)
+        self.max_budget = max_budget or int(token_budget * MAX_BUDGET_RATIO)
+        self.budget = max(self.min_budget, min(token_budget, self.max_budget))
+        self.adaptive = adaptive
+        self._direction = 1
+        self._last_seconds_per_token: Optional[float] = None
+        self._window = [0, 0.0, 0, 0]  # token 数、耗时、批数、解析失败次数
+        self._texts: Sequence[str] = ()
+        self._lock = threading.Lock()
+
+    def item_tokens(self, text: str) -> int:
+        """一条数据占用的 token 数（输入和预计输出）"""
+        return int((estimate_tokens(text) + ITEM_OVERHEAD_TOKENS) * (1 + self.output_ratio))
+
+    def batches(self, texts: Sequence[str], start: int = 0) -> Iterator[tuple[int, int, int, int]]:
+        """
+        从 ``start`` 开始分批，生成 (批次号, 起始位置, 结束位置, 所用预算)；每批至少一条
+
+        :param texts: 每条数据发送给 LLM 的文本
+        """
+        self._texts = texts
+        batch_num = 0
+        while start < len(texts):
+            with self._lock:
+                budget = self.budget
+            end = start + 1
+            used = self.fixed_tokens + self.item_tokens(texts[start])
+            while end < len(texts):
+                used += self.item_tokens(texts[end])
+                if used > budget:
+                    break
+                end += 1
+            yield batch_num, start, end, budget
+            batch_num += 1
+            start = end
+
+    def record(self, batch: tuple[int, int, int, int], seconds: float, failures: int = 0):
+        """
+        反馈一批的处理情况
+
+        :param batch: :meth:`batches` 生成的批次，所用预算与当前预算不同时（并发时预算已调整）忽略
+        :param failures: 该批的解析失败次数
+        """
+        _, start, end, budget = batch
+        if not self.adaptive:
+            return
+        tokens = sum(self.item_tokens(text) for text in self._texts[start:end])
+        with self._lock:
+            if budget != self.budget:
+                return
+            window = self._window
+            window[0] += tokens
+            window[1] += seconds
+            window[2] += 1
+            window[3] += failures
+            if window[2] < ADJUST_EVERY:
+                return
+            self._window = [0, 0.0, 0, 0]
+            seconds_per_token = window[1] / max(window[0], 1)
+            if window[3] / window[2] > MAX_FAILURE_RATE:
+                self._direction = -1
+                self._last_seconds_per_token = None
+                self.max_budget = max(self.min_budget, int(budget * (1 - STEP_RATIO / 2)))
+                new_budget = budget * BACKOFF_RATIO
+            else:
+                if self._last_seconds_per_token is not None and seconds_per_token > self._last_seconds_per_token:
+                    self._direction = -self._direction
+                self._last_seconds_per_token = seconds_per_token
+                new_budget = budget * (1 + STEP_RATIO * self._direction)
+            self.budget = max(self.min_budget, min(int(new_budget), self.max_budget))
+            if self.budget == budget:
+                # 到达上下限后反向探索
+                self._direction = -self._direction
+            print(f"每千 token 平均耗时 {seconds_per_token * 1000:.2f}秒，解析失败 {window[3]} 次，token 预算调整为 {self.budget}")
+
+
+def add_packing_arguments(parser: argparse.ArgumentParser):
+    """添加按 token 预算分批相关的命令行参数"""
+    parser.add_argument("--token-budget", type=int,
+                        help="按 token 预算分批（含提示词和预计输出），不再使用 --batch-size；应不大于模型的上下文长度")
+    parser.add_argument("--max-token-budget", type=int,
+                        help=f"自动调整时的预算上限（默认为初始预算的{MAX_BUDGET_RATIO}倍）")
+    parser.add_argument("--fixed-token-budget", action="store_true", help="不根据耗时和解析失败次数自动调整预算")
+    parser.add_argument("--start-item", type=int, default=0,
+                        help="按 token 预算分批时，从第几条待处理数据开始（从0开始）")
+
+
+def open_packer(args: argparse.Namespace, output_ratio: float, fixed_tokens: int) -> Optional[TokenBudgetPacker]:
+    """根据命令行参数创建分批器，未指定 ``--token-budget`` 时返回 None"""
+    if args.token_budget is None:
+        return None
+    return TokenBudgetPacker(args.token_budget, output_ratio, fixed_tokens,
+                             max_budget=args.max_token_budget, adaptive=not args.fixed_token_budget)
@@ -0,0 +1,118 @@
+import json
+import threading
+from collections.abc import Callable, Sequence
+from typing import Any, Optional, TypeVar
+
+from dataset_store import JsonlStore
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BATCH_ATTEMPTS = 2
+"""一批请求返回的列表无法使用时，拆分前的重试次数"""
+SINGLE_ITEM_ATTEMPTS = 3
+"""单条请求的重试次数，仍失败则写入死信文件"""
+DEFAULT_DEAD_LETTER_PATH = "dead_letter.jsonl"
+"""默认的死信文件路径"""
+
+RESPONSE_ERRORS = (json.JSONDecodeError, KeyError, ValueError, TypeError, IndexError)
+"""响应内容不符合要求时可能出现的异常"""
+
+
+def salvage_batch(
+        items: Sequence[T],
+        request: Callable[[Sequence[T], int], list],
+        parse_item: Callable[[T, Any], R],
+        on_dead_letter: Optional[Callable[[int, str], None]] = None,
+        on_parse_error: Optional[Callable[[str], None]] = None,
+        batch_attempts: int = BATCH_ATTEMPTS,
+        single_item_attempts: int = SINGLE_ITEM_ATTEMPTS
+) -> list[Optional[R]]:
+    """
+    批量请求 LLM，尽量保留有效结果
+
+    - ``request`` 返回的列表长度与请求的条数一致时逐条用 ``parse_item`` 校验，保留有效的结果，
+      只把无效的几条组成新的一批重新请求
+    - 返回的内容无法解析或长度不一致时重试，超过 ``batch_attempts`` 次后拆成两半分别处理，直到单条
+    - 单条请求失败 ``single_item_attempts`` 次后放弃，调用 ``on_dead_letter(序号, 错误信息)``，结果为 None
+
+    :param request: ``request(一批数据, 第几次尝试)`` 返回与之对应的列表，重试（第几次尝试大于 0）时不应使用缓存的响应；
+        内容不符合要求时抛出 :data:`RESPONSE_ERRORS` 中的异常，其他异常（如网络错误）直接向上抛出
+    :param parse_item: 校验并转换单条结果，无效时抛出 ValueError 等异常
+    :param on_parse_error: 每次返回的内容无法解析或长度不一致时调用，参数为错误信息
+    :return: 与 ``items`` 一一对应的结果，放弃的条目为 None
+    """
+    results: list[Optional[R]] = [None] * len(items)
+    _salvage(list(range(len(items))), items, request, parse_item, on_dead_letter, on_parse_error,
+             batch_attempts, single_item_attempts, results)
+    return results
+
+
+def _salvage(positions, items, request, parse_item, on_dead_letter, on_parse_error, batch_attempts, single_item_attempts,
+             results):
+    attempts = single_item_attempts if len(positions) == 1 else batch_attempts
+    error = ""
+    for attempt in range(attempts):
+        try:
+            raw_items = request([items[i] for i in positions], attempt)
+            if not isinstance(raw_items, list) or len(raw_items) != len(positions):
+                raise ValueError("返回数据格式或长度不正确")
+        except RESPONSE_ERRORS as e:
+            error = str(e)
+            print(f"解析失败（{len(positions)}条，尝试 {attempt + 1}/{attempts}）: {error}")
+            if on_parse_error is not None:
+                on_parse_error(error)
+            continue
+
+        failed = []
+        for position, raw_item in zip(positions, raw_items):
+            try:
+                results[position] = parse_item(items[position], raw_item)
+            except RESPONSE_ERRORS as e:
+                failed.append(position)
+                error = f"第{position + 1}条结果无效: {e}"
+        if not failed:
+            return
+        if len(failed) < len(positions):
+            print(f"保留 {len(positions) - len(failed)} 条有效结果，重新请求其余 {len(failed)} 条")
+            _salvage(failed, items, request, parse_item, on_dead_letter, on_parse_error,
+                     batch_attempts, single_item_attempts, results)
+            return
+        print(f"全部 {len(positions)} 条结果无效（尝试 {attempt + 1}/{attempts}）: {error}")
+
+    if len(positions) == 1:
+        print(f"第{positions[0] + 1}条多次处理失败，已放弃: {error}")
+        if on_dead_letter is not None:
+            on_dead_letter(positions[0], error)
+        return
+    middle = len(positions) // 2
+    print(f"拆分为 {middle} 条和 {len(positions) - middle} 条分别重试")
+    for half in (positions[:middle], positions[middle:]):
+        _salvage(half, items, request, parse_item, on_dead_letter, on_parse_error,
+                 batch_attempts, single_item_attempts, results)
+
+
+class DeadLetterFile:
+    """多次处理失败的条目，追加写入 JSONL 文件，可在多个线程中共用"""
+
+    def __init__(self, path: str = DEFAULT_DEAD_LETTER_PATH):
+        self.path = path
+        self.count = 0
+        self._store: Optional[JsonlStore] = None
+        self._lock = threading.Lock()
+
+    def add(self, index: int, item: Any, error: str):
+        """
+        :param index: 条目在输入文件中的序号
+        """
+        with self._lock:
+            if self._store is None:
+                self._store = JsonlStore(self.path)
+            self._store.append({"index": index, "item": item, "error": error})
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._store is not None:
+                self._store.close()
+                self._store = None
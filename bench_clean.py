@@ -0,0 +1,82 @@
+"""
+对比 auto-combine-group-msg_no-llm.py 中清理聊天片段的几种多进程执行方式
+
+    python bench_clean.py --rows 1000000 --nicknames 3000
+
+单核环境实测（100 万条、3000 个昵称、2 进程）：单进程 7.1 秒，Pool.map 12.2 秒，
+imap 每批 500/2000/10000 条分别为 12.3/10.9/11.6 秒。单核时多进程只有通信开销，多核机器上的加速比尚未测量
+"""
+import argparse
+import importlib
+import os
+import random
+import time
+from functools import partial
+from multiprocessing import Pool, freeze_support
+
+from msg_cleaner import MultiPatternCleaner
+
+no_llm = importlib.import_module("auto-combine-group-msg_no-llm")
+
+
+def make_dataset(rows: int, nickname_count: int, seed: int = 0):
+    rnd = random.Random(seed)
+    nicknames = ["".join(rnd.choice("abcdefghij张三李四王五赵六") for _ in range(rnd.randint(2, 8)))
+                 for _ in range(nickname_count)]
+    words = ["你好", "hello", "[表情]", "今天吃什么", "哈哈哈", "[语音通话]", "在吗"]
+    content_list = []
+    for _ in range(rows):
+        segments = []
+        for _ in range(rnd.randint(1, 3)):
+            parts = [rnd.choice(words) for _ in range(rnd.randint(1, 4))]
+            if rnd.random() < 0.3:
+                parts.insert(rnd.randint(0, len(parts)), "@" + rnd.choice(nicknames))
+            segments.append(" ".join(parts))
+        content_list.append(segments)
+    return nicknames, content_list
+
+
+def run_map(content_list, cleaner, workers):
+    """改动前的方式：Pool.map，清理器随每批任务序列化，结果一次性生成"""
+    with Pool(workers) as pool:
+        return pool.map(partial(no_llm.remove_at_nickname, cleaner=cleaner), content_list)
+
+
+def run_imap(content_list, cleaner, workers, chunk_size):
+    return list(no_llm.iter_cleaned_segments(content_list, cleaner, workers, chunk_size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比清理聊天片段的多进程执行方式")
+    parser.add_argument("--rows", type=int, default=1000000, help="消息条数")
+    parser.add_argument("--nicknames", type=int, default=3000, help="群成员昵称数量")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="进程数")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[100, 500, 2000, 10000],
+                        help="imap 每批消息条数")
+    args = parser.parse_args()
+
+    nicknames, content_list = make_dataset(args.rows, args.nicknames)
+    cleaner = MultiPatternCleaner([f"@{nickname}" for nickname in nicknames] + no_llm.SPECIAL_TOKENS)
+    print(f"{args.rows} 条消息，{args.nicknames} 个昵称，{args.workers} 个进程")
+
+    cases = [("单进程", partial(run_imap, workers=1, chunk_size=1)),
+             ("Pool.map", partial(run_map, workers=args.workers))]
+    cases += [(f"imap chunksize={chunk_size}", partial(run_imap, workers=args.workers, chunk_size=chunk_size))
+              for chunk_size in args.chunk_sizes]
+
+    expected = None
+    for name, func in cases:
+        # remove_at_nickname 会原地修改片段列表，每次使用副本
+        data = [list(segments) for segments in content_list]
+        start = time.perf_counter()
+        result = func(data, cleaner)
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected = result
+        assert result == expected, f"{name} 的结果与单进程不一致"
+        print(f"{name}: {elapsed:.2f}秒，{args.rows / elapsed:.0f}行/秒")
+
+
+if __name__ == "__main__":
+    freeze_support()
+    main()
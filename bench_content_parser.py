@@ -0,0 +1,91 @@
+"""
+验证 group_msg_io.parse_content_list 与 ast.literal_eval 的结果一致，并对比两者速度
+
+    python bench_content_parser.py --csv group_msg.csv --encoding gbk
+"""
+import argparse
+import ast
+import random
+import time
+
+from group_msg_io import parse_content_list, read_group_msg_rows
+
+_ALPHABET = "ab 你好'\"\\\n\r\t\0,[]@😀 "
+
+
+def evaluate(func, value):
+    """返回解析结果，出错时返回异常类型，便于比较"""
+    try:
+        return func(value)
+    except Exception as e:
+        return type(e)
+
+
+def make_corpus(count: int, seed: int = 0) -> list[str]:
+    """生成 str(list) 格式的聊天内容，其中一部分随机改动以覆盖格式错误的情况"""
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        segments = ["".join(rnd.choice(_ALPHABET) for _ in range(rnd.randint(0, 8)))
+                    for _ in range(rnd.randint(0, 4))]
+        value = str(segments)
+        if rnd.random() < 0.2 and value:
+            position = rnd.randrange(len(value))
+            if rnd.random() < 0.5:
+                value = value[:position] + value[position + 1:]
+            else:
+                value = value[:position] + rnd.choice(_ALPHABET) + value[position:]
+        corpus.append(value)
+    return corpus
+
+
+def make_chat_corpus(count: int, seed: int = 0) -> list[str]:
+    """生成接近真实聊天记录的内容用于计时，少数片段含引号、换行等需要转义的字符"""
+    rnd = random.Random(seed)
+    words = ["你好", "哈哈哈", "[表情]", "@张三 ", "今天吃什么", "ok", "[图片]", "明天见"]
+    rare_words = ["it's", "C:\\Users", "第一行\n第二行"]
+
+    def make_segment():
+        segment = "".join(rnd.choice(words) for _ in range(rnd.randint(1, 6)))
+        return segment + rnd.choice(rare_words) if rnd.random() < 0.05 else segment
+
+    return [str([make_segment() for _ in range(rnd.randint(1, 3))]) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="验证并对比聊天内容列的解析速度")
+    parser.add_argument("--csv", help="用于验证和计时的聊天记录 CSV 文件，不指定时使用随机生成的聊天内容计时")
+    parser.add_argument("--encoding", default="utf-8", help="CSV 文件编码")
+    parser.add_argument("--synthetic", type=int, default=200000, help="随机生成的验证用例数量")
+    parser.add_argument("--repeat", type=int, default=3, help="计时重复次数，取最快的一次")
+    args = parser.parse_args()
+
+    csv_corpus = []
+    if args.csv:
+        csv_corpus = [row[4] for row in read_group_msg_rows(args.csv, args.encoding) if len(row) > 4]
+    corpus = make_corpus(args.synthetic) + csv_corpus
+
+    mismatches = [value for value in corpus
+                  if evaluate(parse_content_list, value) != evaluate(ast.literal_eval, value)]
+    for value in mismatches[:10]:
+        print(f"结果不一致：{value!r}")
+    print(f"验证 {len(corpus)} 条，不一致 {len(mismatches)} 条")
+
+    # 计时只使用格式正确的内容
+    timing_corpus = csv_corpus or make_chat_corpus(args.synthetic)
+    valid = [value for value in timing_corpus if isinstance(evaluate(ast.literal_eval, value), list)]
+    timings = {}
+    for name, func in (("ast.literal_eval", ast.literal_eval), ("parse_content_list", parse_content_list)):
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for value in valid:
+                func(value)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+        print(f"{name}: {best:.3f}秒，{len(valid) / best:.0f}条/秒")
+    print(f"加速 {timings['ast.literal_eval'] / timings['parse_content_list']:.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
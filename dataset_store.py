@@ -0,0 +1,518 @@
+import hashlib
+import json
+import os
+import struct
+import time
+from collections.abc import Iterable, Iterator, Mapping
+from typing import Any, Optional
+
+ZSTD_FRAME_RECORDS = 1000
+"""zstd 压缩时每个独立帧包含的最大记录数，随机读取一条记录只需解压其所在的帧"""
+ZSTD_LEVEL = 3
+"""zstd 压缩级别"""
+JOURNAL_COMPACT_SECONDS = 60
+"""分批保存 JSON 文件时，每隔多少秒将日志中的修改合并进 JSON 文件"""
+
+_INDEX_MAGIC = b"JLIX"
+_INDEX_VERSION = 1
+# 标识, 版本, 数据文件大小, 记录数, 主键字段名
+_HEADER = struct.Struct("<4sIQQ64s")
+# 块偏移, 块大小, 块内偏移, 记录长度, 主键哈希。未压缩时一行即一块，压缩时一个 zstd 帧为一块
+_ENTRY = struct.Struct("<QIIIq")
+_READ_CHUNK_SIZE = 1 << 20
+
+
+def is_jsonl_path(path: str) -> bool:
+    """是否为 JSONL 格式（``.jsonl`` 或 zstd 压缩的 ``.jsonl.zst``）"""
+    return path.endswith((".jsonl", ".jsonl.zst"))
+
+
+def index_path(path: str) -> str:
+    """JSONL 文件的偏移索引路径"""
+    return path + ".idx"
+
+
+def journal_path(path: str) -> str:
+    """JSON 文件的修改日志路径，见 :class:`DatasetWriter`"""
+    return path + ".journal"
+
+
+def iter_records(path: str) -> Iterator[Any]:
+    """逐条读取数据集，JSONL 文件流式读取，JSON 文件读取整个数组并应用尚未合并的修改日志"""
+    if is_jsonl_path(path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"文件不存在: {path}")
+        with JsonlStore(path) as store:
+            yield from store
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    if os.path.exists(journal_path(path)):
+        _replay_journal(journal_path(path), records)
+    yield from records
+
+
+def load_records(path: str) -> list:
+    """读取数据集，支持 JSON 数组和 JSONL 文件"""
+    return list(iter_records(path))
+
+
+def save_records(path: str, records: Iterable, indent: Optional[int] = 2):
+    """
+    保存数据集，按扩展名选择格式：JSONL 文件同时生成偏移索引，其他按 JSON 数组保存
+
+    :param indent: JSON 数组的缩进，JSONL 文件忽略
+    """
+    if is_jsonl_path(path):
+        JsonlStore.create(path, records).close()
+        return
+    # 先写入临时文件再替换，中断时原文件保持完整
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(list(records), f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    # 旧的修改日志已包含在新文件中（或已不再适用）
+    if os.path.exists(journal_path(path)):
+        os.remove(journal_path(path))
+
+
+def _replay_journal(path: str, records: list):
+    """按顺序将修改日志应用到 ``records``，每条日志重复应用的结果不变"""
+    with open(path, "rb") as f:
+        for line in f:
+            # 最后一行可能在写入时中断，其修改未完成保存，忽略
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if entry["op"] == "extend":
+                start = entry["start"]
+                if start > len(records):
+                    raise ValueError(f"修改日志与数据文件不一致: {path}")
+                records[start:start + len(entry["records"])] = entry["records"]
+            else:
+                for position, record in entry["records"]:
+                    records[position] = record
+
+
+def _dump_line(record: Any) -> bytes:
+    return json.dumps(record, ensure_ascii=False).encode("utf-8")
+
+
+def _key_hash(value: Any) -> int:
+    digest = hashlib.blake2b(json.dumps(value, ensure_ascii=False).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("读写 .jsonl.zst 文件需要安装 zstandard") from None
+    return zstandard
+
+
+class JsonlStore:
+    """
+    带偏移索引的 JSONL 数据集，支持按序号随机读取、流式遍历、追加和按序号或主键替换记录
+
+    索引保存在 ``<文件名>.idx`` 中，记录每条记录所在的位置，缺失或与数据文件大小不一致时重新扫描生成。
+    替换记录时新内容不超过原行长度则原地覆盖（用空格补齐），否则追加到文件末尾并将原行改为空格，
+    记录的序号和遍历顺序以索引为准，可用 :meth:`compact` 按索引顺序重写文件。
+
+    ``.jsonl.zst`` 文件由多个独立的 zstd 帧组成，可以直接用 ``zstd -d`` 解压为普通 JSONL；
+    压缩文件无法原地修改，替换的记录总是追加到末尾，批量修改时应使用 :meth:`extend`、:meth:`update`
+    一次写入多条，避免每条记录单独成帧
+
+    用法::
+
+        with JsonlStore("data.jsonl", key="id") as store:
+            record = store[10]
+            store.replace_by_key("abc", {"id": "abc", "output": "..."})
+    """
+
+    def __init__(self, path: str, key: Optional[str] = None, compressed: Optional[bool] = None, sync: bool = False):
+        """
+        :param key: 主键字段名，用于 :meth:`find` 等按主键查找的方法；为 None 时沿用索引中记录的字段名
+        :param compressed: 是否为 zstd 压缩文件，为 None 时根据扩展名判断
+        :param sync: 每次写入后调用 fsync，系统崩溃或断电时已写入的记录也不会丢失
+        """
+        self.path = path
+        self.compressed = path.endswith(".zst") if compressed is None else compressed
+        self.sync = sync
+        self._zstd = _import_zstandard() if self.compressed else None
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        self._file = open(path, "rb")
+        self._write_file = None
+        self._index_file = None
+        self._frame_cache: tuple[int, bytes] = (-1, b"")
+        self._positions_by_hash: Optional[dict[int, list[int]]] = None
+        self.key = key
+        self._entries = self._load_index()
+
+    # 索引
+
+    def _load_index(self) -> bytearray:
+        data_size = os.path.getsize(self.path)
+        try:
+            with open(index_path(self.path), "rb") as f:
+                buffer = bytearray(f.read())
+            magic, version, indexed_size, count, key = _HEADER.unpack_from(buffer)
+            key = key.rstrip(b"\0").decode("utf-8") or None
+            if (magic == _INDEX_MAGIC and version == _INDEX_VERSION and indexed_size == data_size
+                    and len(buffer) == _HEADER.size + count * _ENTRY.size and (self.key or key) == key):
+                self.key = key
+                return buffer[_HEADER.size:]
+        except (OSError, struct.error):
+            pass
+        entries = self._scan()
+        self._write_index(entries, data_size)
+        return entries
+
+    def _scan(self) -> bytearray:
+        """按文件顺序扫描所有记录生成索引，跳过空白行"""
+        entries = bytearray()
+        self._file.seek(0)
+        if self.compressed:
+            for frame_offset, frame_size, data in self._iter_frames():
+                position = 0
+                for line in data.splitlines(keepends=True):
+                    record = line.strip()
+                    if record:
+                        start = position + line.index(record[:1])
+                        entries += _ENTRY.pack(frame_offset, frame_size, start, len(record),
+                                               self._hash_record(json.loads(record)))
+                    position += len(line)
+        else:
+            offset = 0
+            for line in self._file:
+                record = line.strip()
+                if record:
+                    start = offset + line.index(record[:1])
+                    entries += _ENTRY.pack(start, len(record), 0, len(record), self._hash_record(json.loads(record)))
+                offset += len(line)
+        return entries
+
+    def _iter_frames(self) -> Iterator[tuple[int, int, bytes]]:
+        """依次解压各 zstd 帧，返回 (帧偏移, 帧大小, 解压后的内容)"""
+        decompressor = self._zstd.ZstdDecompressor()
+        offset = 0
+        buffer = b""
+        while True:
+            if not buffer:
+                buffer = self._file.read(_READ_CHUNK_SIZE)
+                if not buffer:
+                    return
+            decompress_obj = decompressor.decompressobj()
+            parts = []
+            size = 0
+            while True:
+                parts.append(decompress_obj.decompress(buffer))
+                size += len(buffer)
+                if decompress_obj.eof:
+                    buffer = decompress_obj.unused_data
+                    size -= len(buffer)
+                    break
+                buffer = self._file.read(_READ_CHUNK_SIZE)
+                if not buffer:
+                    raise ValueError(f"{self.path} 的最后一个 zstd 帧不完整")
+            yield offset, size, b"".join(parts)
+            offset += size
+
+    def _write_index(self, entries: bytearray, data_size: int):
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        with open(index_path(self.path), "wb") as f:
+            f.write(self._pack_header(data_size, len(entries) // _ENTRY.size))
+            f.write(entries)
+
+    def _pack_header(self, data_size: int, count: int) -> bytes:
+        return _HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, data_size, count, (self.key or "").encode("utf-8"))
+
+    def _hash_record(self, record: Any) -> int:
+        if self.key is None:
+            return 0
+        return _key_hash(record.get(self.key) if isinstance(record, dict) else None)
+
+    def _entry(self, position: int) -> tuple[int, int, int, int, int]:
+        return _ENTRY.unpack_from(self._entries, position * _ENTRY.size)
+
+    def _set_entry(self, position: int, entry: tuple[int, int, int, int, int]):
+        if self._positions_by_hash is not None:
+            old_hash = self._entry(position)[4] if position < len(self) else None
+            if old_hash != entry[4]:
+                if old_hash is not None:
+                    self._positions_by_hash[old_hash].remove(position)
+                self._positions_by_hash.setdefault(entry[4], []).append(position)
+        if position == len(self):
+            self._entries += _ENTRY.pack(*entry)
+        else:
+            _ENTRY.pack_into(self._entries, position * _ENTRY.size, *entry)
+
+    # 读取
+
+    def __len__(self) -> int:
+        return len(self._entries) // _ENTRY.size
+
+    def _read_raw(self, entry: tuple[int, int, int, int, int]) -> bytes:
+        block_offset, block_size, offset, length, _ = entry
+        if not self.compressed:
+            self._file.seek(block_offset)
+            return self._file.read(length)
+        if self._frame_cache[0] != block_offset:
+            self._file.seek(block_offset)
+            self._frame_cache = (block_offset, self._zstd.ZstdDecompressor().decompress(self._file.read(block_size)))
+        return self._frame_cache[1][offset:offset + length]
+
+    def __getitem__(self, position: int) -> Any:
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(f"记录序号超出范围: {position}")
+        return json.loads(self._read_raw(self._entry(position)))
+
+    def __iter__(self) -> Iterator[Any]:
+        """按序号顺序流式读取所有记录"""
+        for entry in _ENTRY.iter_unpack(bytes(self._entries)):
+            yield json.loads(self._read_raw(entry))
+
+    def find(self, value: Any) -> int:
+        """返回主键等于 ``value`` 的第一条记录的序号，不存在时抛出 KeyError"""
+        if self.key is None:
+            raise ValueError("未设置主键字段，无法按主键查找")
+        if self._positions_by_hash is None:
+            self._positions_by_hash = {}
+            for position, entry in enumerate(_ENTRY.iter_unpack(bytes(self._entries))):
+                self._positions_by_hash.setdefault(entry[4], []).append(position)
+        for position in sorted(self._positions_by_hash.get(_key_hash(value), ())):
+            record = self[position]
+            if isinstance(record, dict) and record.get(self.key) == value:
+                return position
+        raise KeyError(value)
+
+    def get(self, value: Any, default: Any = None) -> Any:
+        """返回主键等于 ``value`` 的记录，不存在时返回 ``default``"""
+        try:
+            return self[self.find(value)]
+        except KeyError:
+            return default
+
+    # 写入
+
+    def _writer(self):
+        if self._write_file is None:
+            self._write_file = open(self.path, "r+b")
+            self._index_file = open(index_path(self.path), "r+b")
+        return self._write_file
+
+    def _append_lines(self, lines: list[bytes]) -> list[tuple[int, int, int, int]]:
+        """将各行追加到文件末尾，返回各行的 (块偏移, 块大小, 块内偏移, 记录长度)"""
+        f = self._writer()
+        offset = f.seek(0, os.SEEK_END)
+        locations = []
+        if not self.compressed:
+            for line in lines:
+                locations.append((offset, len(line), 0, len(line)))
+                offset += len(line) + 1
+            f.write(b"".join(line + b"\n" for line in lines))
+            return locations
+        compressor = self._zstd.ZstdCompressor(level=ZSTD_LEVEL)
+        for start in range(0, len(lines), ZSTD_FRAME_RECORDS):
+            frame_lines = lines[start:start + ZSTD_FRAME_RECORDS]
+            frame = compressor.compress(b"".join(line + b"\n" for line in frame_lines))
+            position = 0
+            for line in frame_lines:
+                locations.append((offset, len(frame), position, len(line)))
+                position += len(line) + 1
+            f.write(frame)
+            offset += len(frame)
+        return locations
+
+    def _commit(self, positions: Iterable[int]):
+        """将数据写入磁盘后更新索引文件中修改过的条目和文件头"""
+        f = self._writer()
+        f.flush()
+        if self.sync:
+            os.fsync(f.fileno())
+        for position in sorted(positions):
+            self._index_file.seek(_HEADER.size + position * _ENTRY.size)
+            self._index_file.write(self._entries[position * _ENTRY.size:(position + 1) * _ENTRY.size])
+        self._index_file.seek(0)
+        self._index_file.write(self._pack_header(f.seek(0, os.SEEK_END), len(self)))
+        self._index_file.flush()
+        if self.sync:
+            os.fsync(self._index_file.fileno())
+
+    def append(self, record: Any) -> int:
+        """追加一条记录，返回其序号"""
+        return self.extend([record])[0]
+
+    def extend(self, records: Iterable) -> list[int]:
+        """追加多条记录，返回各记录的序号"""
+        records = list(records)
+        locations = self._append_lines([_dump_line(record) for record in records])
+        positions = list(range(len(self), len(self) + len(records)))
+        for position, record, location in zip(positions, records, locations):
+            self._set_entry(position, (*location, self._hash_record(record)))
+        self._commit(positions)
+        return positions
+
+    def update(self, records: Mapping[int, Any]):
+        """按序号替换多条记录"""
+        f = self._writer()
+        moved = []
+        for position, record in records.items():
+            if not 0 <= position < len(self):
+                raise IndexError(f"记录序号超出范围: {position}")
+            line = _dump_line(record)
+            block_offset, block_size, _, _, _ = self._entry(position)
+            if not self.compressed and len(line) <= block_size:
+                f.seek(block_offset)
+                f.write(line + b" " * (block_size - len(line)))
+                self._set_entry(position, (block_offset, block_size, 0, len(line), self._hash_record(record)))
+            else:
+                moved.append((position, line, self._hash_record(record), block_offset, block_size))
+        locations = self._append_lines([line for _, line, _, _, _ in moved])
+        for (position, _, key_hash, _, _), location in zip(moved, locations):
+            self._set_entry(position, (*location, key_hash))
+        self._commit(records.keys())
+        # 新内容和索引写入后再清除原行，避免中断时丢失记录
+        if not self.compressed and moved:
+            for _, _, _, block_offset, block_size in moved:
+                f.seek(block_offset)
+                f.write(b" " * block_size)
+            f.flush()
+
+    def replace(self, position: int, record: Any):
+        """按序号替换一条记录"""
+        self.update({position: record})
+
+    def replace_by_key(self, value: Any, record: Any):
+        """替换主键等于 ``value`` 的记录，不存在时抛出 KeyError"""
+        self.update({self.find(value): record})
+
+    # 整体写入
+
+    @classmethod
+    def create(cls, path: str, records: Iterable, key: Optional[str] = None,
+               compressed: Optional[bool] = None, sync: bool = False) -> "JsonlStore":
+        """写入新的数据集（先写入临时文件再替换，已有文件内容可以作为 ``records``），返回打开的数据集"""
+        compressed = path.endswith(".zst") if compressed is None else compressed
+        temp_path = path + ".tmp"
+        for stale_path in (temp_path, index_path(temp_path)):
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+        with cls(temp_path, key=key, compressed=compressed, sync=sync) as store:
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) >= ZSTD_FRAME_RECORDS:
+                    store.extend(batch)
+                    batch = []
+            if batch:
+                store.extend(batch)
+        os.replace(temp_path, path)
+        os.replace(index_path(temp_path), index_path(path))
+        return cls(path, key=key, compressed=compressed, sync=sync)
+
+    def compact(self):
+        """按序号顺序重写数据文件，去除替换记录留下的空白行和旧帧"""
+        compacted = JsonlStore.create(self.path + ".compact", self, key=self.key, compressed=self.compressed)
+        compacted.close()
+        self.close()
+        os.replace(compacted.path, self.path)
+        os.replace(index_path(compacted.path), index_path(self.path))
+        self.__init__(self.path, key=self.key, compressed=self.compressed, sync=self.sync)
+
+    def close(self):
+        for f in (self._file, self._write_file, self._index_file):
+            if f is not None:
+                f.close()
+        self._write_file = None
+        self._index_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DatasetWriter:
+    """
+    分批处理时保存进度，每批只写入新增和修改的记录，并调用 fsync 确保已保存的进度不会丢失
+
+    - JSONL 文件直接在原文件中追加和替换记录
+    - JSON 文件把每批的修改追加到 ``<文件名>.journal`` 日志，每隔 ``compact_seconds`` 秒及关闭时
+      再合并进 JSON 文件（写入临时文件后替换，中断时不会损坏）。中断后 :func:`load_records` 读取该文件时会自动应用日志
+
+    :param records: 当前的全部记录，创建时完整写入一次，之后由 :meth:`extend`、:meth:`update` 维护
+    """
+
+    def __init__(self, path: str, records: list, indent: Optional[int] = 4,
+                 compact_seconds: float = JOURNAL_COMPACT_SECONDS):
+        self.path = path
+        self.records = records
+        self.indent = indent
+        self.compact_seconds = compact_seconds
+        self.store = JsonlStore.create(path, records, sync=True) if is_jsonl_path(path) else None
+        self._journal = None
+        if self.store is None:
+            self.compact()
+
+    def append(self, record: Any):
+        """追加一条记录并保存"""
+        self.extend([record])
+
+    def extend(self, new_records: Iterable):
+        """追加记录并保存"""
+        new_records = list(new_records)
+        start = len(self.records)
+        self.records.extend(new_records)
+        if self.store is not None:
+            self.store.extend(new_records)
+        elif new_records:
+            self._log({"op": "extend", "start": start, "records": new_records})
+
+    def update(self, positions: Iterable[int]):
+        """``records`` 中这些序号的记录已修改，保存修改"""
+        positions = list(positions)
+        if self.store is not None:
+            self.store.update({position: self.records[position] for position in positions})
+        elif positions:
+            self._log({"op": "update", "records": [[position, self.records[position]] for position in positions]})
+
+    def _log(self, entry: dict):
+        if self._journal is None:
+            self._journal = open(journal_path(self.path), "ab")
+        self._journal.write(_dump_line(entry) + b"\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        if time.monotonic() - self._last_compact >= self.compact_seconds:
+            self.compact()
+
+    def compact(self):
+        """将全部记录写入 JSON 文件并删除日志"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        save_records(self.path, self.records, self.indent)
+        self._last_compact = time.monotonic()
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+        elif self._journal is not None:
+            self.compact()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,100 @@
+import heapq
+import os
+import pickle
+import tempfile
+from collections.abc import Callable, Iterator
+from typing import Any, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+SPILL_BATCH_SIZE = 1000
+"""写入临时文件时每批序列化的元素数量"""
+
+
+class ExternalSorter(Generic[T]):
+    """
+    稳定的外部排序：逐个添加元素，内存占用超过预算时将已添加的部分排序后写入临时文件，
+    遍历时多路归并各段。数据量未超过预算时直接在内存中排序，不产生临时文件
+
+    用法::
+
+        with ExternalSorter(key, memory_budget, sizeof) as sorter:
+            for item in items:
+                sorter.add(item)
+            for item in sorter:
+                ...
+    """
+
+    def __init__(
+            self,
+            key: Callable[[T], Any],
+            memory_budget: int,
+            sizeof: Callable[[T], int],
+            spill_dir: Optional[str] = None
+    ):
+        """
+        :param memory_budget: 内存预算（字节）
+        :param sizeof: 估算单个元素占用的内存（字节）
+        :param spill_dir: 临时文件目录，为 None 时使用系统临时目录
+        """
+        self.key = key
+        self.memory_budget = memory_budget
+        self.sizeof = sizeof
+        self.spill_dir = spill_dir
+        self._run: list[T] = []
+        self._run_size = 0
+        self._temp_dir: Optional[tempfile.TemporaryDirectory] = None
+        self._run_paths: list[str] = []
+
+    @property
+    def spilled_runs(self) -> int:
+        """已写入临时文件的段数"""
+        return len(self._run_paths)
+
+    def add(self, item: T):
+        self._run.append(item)
+        self._run_size += self.sizeof(item)
+        if self._run_size >= self.memory_budget:
+            self._spill()
+
+    def _spill(self):
+        if self._temp_dir is None:
+            self._temp_dir = tempfile.TemporaryDirectory(prefix="external_sort_", dir=self.spill_dir)
+        self._run.sort(key=self.key)
+        path = os.path.join(self._temp_dir.name, f"run_{len(self._run_paths)}.pkl")
+        with open(path, "wb") as f:
+            for start in range(0, len(self._run), SPILL_BATCH_SIZE):
+                pickle.dump(self._run[start:start + SPILL_BATCH_SIZE], f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._run_paths.append(path)
+        self._run = []
+        self._run_size = 0
+
+    def __iter__(self) -> Iterator[T]:
+        """按键排序后逐个返回所有元素，键相同的元素保持添加顺序"""
+        self._run.sort(key=self.key)
+        if not self._run_paths:
+            return iter(self._run)
+        # heapq.merge 在键相同时按参数顺序输出，各段又是按添加顺序排列的，因此整体仍是稳定排序
+        return heapq.merge(*map(_read_run, self._run_paths), iter(self._run), key=self.key)
+
+    def close(self):
+        """删除临时文件"""
+        if self._temp_dir is not None:
+            self._temp_dir.cleanup()
+            self._temp_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _read_run(path: str) -> Iterator:
+    with open(path, "rb") as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield from batch
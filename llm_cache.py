@@ -0,0 +1,142 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+DEFAULT_CACHE_PATH = "llm_cache.sqlite3"
+"""LLM 响应缓存的默认路径"""
+DEFAULT_MAX_MB = 512
+"""缓存的默认大小上限（MB），超过时删除最久未使用的响应"""
+
+_KEY_FIELDS = ("model", "options", "format", "messages")
+
+
+def cache_key(payload: dict) -> str:
+    """根据模型、生成参数和全部消息（含系统提示词与用户内容）计算请求的哈希"""
+    relevant = {field: payload.get(field) for field in _KEY_FIELDS}
+    return hashlib.sha256(json.dumps(relevant, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    以请求内容哈希为键的 LLM 响应缓存（sqlite），可在多次运行、多个脚本之间共用
+
+    调用方应在响应通过格式校验后再调用 :meth:`put`，避免缓存无法解析的响应；
+    命中的响应校验失败时应调用 :meth:`delete`，下次重试会重新请求。
+    总大小超过上限时按最近使用时间淘汰
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_mb: float = DEFAULT_MAX_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+            CREATE INDEX IF NOT EXISTS responses_model ON responses (model);
+        """)
+        self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, payload: dict) -> Optional[dict]:
+        """返回缓存的响应，未命中时返回 None"""
+        key = cache_key(payload)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, payload: dict, response: dict):
+        """缓存已通过校验的响应"""
+        data = json.dumps(response, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        key = cache_key(payload)
+        with self._lock, self._conn:
+            # 覆盖已有的响应时减去其大小
+            self._total_size -= self._size_of(key)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, payload.get("model", ""), data, size, time.time())
+            )
+            self._total_size += size
+            if self._total_size > self.max_bytes:
+                self._evict()
+
+    def _size_of(self, key: str) -> int:
+        row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def _evict(self):
+        # 其他进程可能也在写入，先重新统计实际大小
+        self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        excess = self._total_size - self.max_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+            self._total_size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def delete(self, payload: dict):
+        """删除该请求的缓存"""
+        key = cache_key(payload)
+        with self._lock, self._conn:
+            self._total_size -= self._size_of(key)
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def invalidate_model(self, model: str) -> int:
+        """删除该模型的全部缓存，返回删除的条数"""
+        with self._lock, self._conn:
+            count = self._conn.execute("DELETE FROM responses WHERE model = ?", (model,)).rowcount
+            self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        return count
+
+    def stats(self) -> str:
+        """命中统计"""
+        total = self.hits + self.misses
+        rate = f"{self.hits / total:.0%}" if total else "-"
+        return f"LLM 响应缓存：命中 {self.hits} 次，未命中 {self.misses} 次（命中率 {rate}）"
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser):
+    """添加响应缓存相关的命令行参数"""
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH,
+                        help=f"LLM 响应缓存路径（默认{DEFAULT_CACHE_PATH}），相同的请求直接使用缓存结果")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_MB,
+                        help=f"缓存大小上限（MB，默认{DEFAULT_MAX_MB}）")
+    parser.add_argument("--no-cache", action="store_true", help="不读取也不写入响应缓存")
+    parser.add_argument("--invalidate-cache", action="store_true", help="运行前删除所用模型的全部缓存")
+
+
+def open_cache(args: argparse.Namespace) -> Optional[ResponseCache]:
+    """根据命令行参数打开响应缓存，``--no-cache`` 时返回 None"""
+    if args.no_cache:
+        return None
+    cache = ResponseCache(args.cache, args.cache_max_mb)
+    if args.invalidate_cache:
+        print(f"已删除模型 {args.model} 的 {cache.invalidate_model(args.model)} 条缓存")
+    return cache
@@ -0,0 +1,264 @@
+import argparse
+import ast
+import json
+import re
+import threading
+from collections import Counter
+from typing import Any, Optional
+
+_INTEGER_PATTERN = re.compile(r"-?\d+")
+_JSON_TYPES = {
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "array": lambda v: isinstance(v, list),
+    "object": lambda v: isinstance(v, dict),
+    "null": lambda v: v is None,
+}
+_CLOSING = {"[": "]", "{": "}"}
+
+JOIN_SEPARATOR = "，"
+"""需要字符串却返回了字符串列表时，用于连接各片段的分隔符"""
+INTEGER_SCHEMA = {"type": "integer"}
+"""一个整数（如 auto-pair 的序号）"""
+
+
+def string_list_schema(max_items: Optional[int] = None) -> dict:
+    """字符串列表（如 auto-combine 的合并结果）"""
+    schema = {"type": "array", "items": {"type": "string"}}
+    if max_items is not None:
+        schema["maxItems"] = max_items
+    return schema
+
+
+def pair_list_schema(item_count: int) -> dict:
+    """由 ``[字符串, 字符串]`` 组成、共 ``item_count`` 条的列表（如 auto-gen、auto-style 的结果），字符串可为 null"""
+    pair = {"type": "array", "items": {"type": ["string", "null"]}, "minItems": 2, "maxItems": 2}
+    return {"type": "array", "items": pair, "minItems": item_count, "maxItems": item_count}
+
+
+class OutputError(ValueError):
+    """LLM 输出无法解析或修复后仍不符合 schema"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"输出格式不正确: {reason}")
+        self.reason = reason
+
+
+class OutputStats:
+    """统计输出直接通过、修复后通过和无法修复（需重试）的次数，可在多个线程中共用"""
+
+    def __init__(self):
+        self.clean = 0
+        self.repaired = 0
+        self.failed = 0
+        self.repairs: Counter[str] = Counter()
+        """各类修复的次数"""
+        self._lock = threading.Lock()
+
+    def record(self, repairs: list[str], failed: bool = False):
+        with self._lock:
+            if failed:
+                self.failed += 1
+            elif repairs:
+                self.repaired += 1
+                self.repairs.update(repairs)
+            else:
+                self.clean += 1
+
+    def summary(self) -> str:
+        """修复率与重试率"""
+        total = self.clean + self.repaired + self.failed
+        if not total:
+            return "LLM 输出：无"
+        text = f"LLM 输出：共 {total} 次，直接通过 {self.clean} 次，修复后通过 {self.repaired} 次（{self.repaired / total:.0%}），" \
+               f"无法修复需重试 {self.failed} 次（{self.failed / total:.0%}）"
+        if self.repairs:
+            text += "；修复：" + "、".join(f"{kind} {count} 次" for kind, count in self.repairs.most_common())
+        return text
+
+
+output_stats = OutputStats()
+"""本进程中所有 :func:`parse_output` 调用的统计"""
+
+
+def clean_output(content: str) -> str:
+    """去除思考内容和 Markdown 代码块标记"""
+    if (think_index := content.find("</think>")) != -1:
+        content = content[think_index + len("</think>"):]
+    return content.replace("```json", "").replace("```", "").strip()
+
+
+def parse_output(content: str, schema: dict, strict_items: bool = True) -> Any:
+    """
+    解析 LLM 输出并按 ``schema`` 校验，不符合时先尝试在本地修复，无法修复才抛出 :class:`OutputError`
+
+    可修复的问题：JSON 前后夹杂的说明文字、多余的尾随逗号、缺少结尾的括号（最后一条完整，只是没有闭合列表）、
+    字符串中未转义的换行、Python 格式的列表（单引号、None），以及类型不符但含义明确的值
+    （需要字符串时返回了字符串列表或数字、需要整数时返回了数字字符串、只有一个整数的列表或只含一个整数的文字）。
+    被截断在字符串中间的内容不会修复，以免生成不完整的数据
+
+    :param schema: JSON Schema 的子集，支持 ``type``、``items``、``minItems``、``maxItems``
+    :param strict_items: 为 False 时列表中无法修复的元素保持原样，由调用方逐条校验
+    """
+    repairs = []
+    try:
+        text = clean_output(content)
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            value = _repair_text(text, schema, repairs)
+        value = _conform(value, schema, "输出", strict_items, repairs)
+    except OutputError:
+        output_stats.record(repairs, failed=True)
+        raise
+    output_stats.record(repairs)
+    return value
+
+
+def _repair_text(text: str, schema: dict, repairs: list[str]) -> Any:
+    if _allows(schema, "integer") and not _allows(schema, "array"):
+        # 文字中有多个整数时无法确定哪个是答案（如“第 1 条和第 3 条……”），不猜测
+        integers = _INTEGER_PATTERN.findall(text)
+        if len(integers) != 1:
+            raise OutputError("找不到整数" if not integers else f"有 {len(integers)} 个整数，无法确定答案")
+        repairs.append("提取整数")
+        return int(integers[0])
+
+    opening = "[" if _allows(schema, "array") else "{"
+    start = text.find(opening)
+    if start == -1:
+        raise OutputError("找不到 JSON 内容")
+    if text[:start].strip():
+        repairs.append("去除前面的文字")
+    fixed, rest = _balance(text[start:], repairs)
+    if rest.strip():
+        repairs.append("去除后面的文字")
+    try:
+        return json.loads(fixed, strict=False)
+    except json.JSONDecodeError as e:
+        error = e
+    try:
+        value = ast.literal_eval(fixed)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise OutputError(str(error))
+    repairs.append("转换 Python 格式")
+    return value
+
+
+def _balance(text: str, repairs: list[str]) -> tuple[str, str]:
+    """
+    截取第一个完整的 JSON 值并去除尾随逗号，缺少结尾括号时补全
+
+    :return: (修复后的 JSON 文本, 其后剩余的文本)
+    """
+    out = []
+    stack = []
+    quote = None
+    escape = False
+    for index, char in enumerate(text):
+        if quote is not None:
+            out.append(char)
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == quote:
+                quote = None
+            elif char == "\n":
+                if "字符串中的换行" not in repairs:
+                    repairs.append("字符串中的换行")
+            continue
+        if char in "\"'":
+            quote = char
+        elif char in "[{":
+            stack.append(char)
+        elif char in "]}":
+            if not stack or _CLOSING[stack.pop()] != char:
+                raise OutputError("括号不匹配")
+            if _strip_trailing_comma(out):
+                repairs.append("去除尾随逗号")
+            out.append(char)
+            if not stack:
+                return "".join(out), text[index + 1:]
+            continue
+        out.append(char)
+    if quote is not None:
+        raise OutputError("内容在字符串中间被截断")
+    # 最后一条已完整，只缺少结尾的括号
+    _strip_trailing_comma(out)
+    while stack:
+        out.append(_CLOSING[stack.pop()])
+    repairs.append("补全结尾括号")
+    return "".join(out), ""
+
+
+def _strip_trailing_comma(out: list[str]) -> bool:
+    index = len(out) - 1
+    while index >= 0 and out[index].isspace():
+        index -= 1
+    if index >= 0 and out[index] == ",":
+        del out[index]
+        return True
+    return False
+
+
+def _allows(schema: dict, type_: str) -> bool:
+    types = schema.get("type")
+    return types is None or type_ == types or (isinstance(types, list) and type_ in types)
+
+
+def _matches(value: Any, schema: dict) -> bool:
+    types = schema.get("type")
+    if types is None:
+        return True
+    return any(_JSON_TYPES[type_](value) for type_ in ([types] if isinstance(types, str) else types))
+
+
+def _conform(value: Any, schema: dict, path: str, strict_items: bool, repairs: list[str]) -> Any:
+    if not _matches(value, schema):
+        value = _coerce(value, schema, path, repairs)
+    if isinstance(value, list):
+        if "minItems" in schema and len(value) < schema["minItems"]:
+            raise OutputError(f"{path}的条数为 {len(value)}，应不少于 {schema['minItems']}")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            raise OutputError(f"{path}的条数为 {len(value)}，应不多于 {schema['maxItems']}")
+        if "items" in schema:
+            items = []
+            for i, item in enumerate(value):
+                try:
+                    items.append(_conform(item, schema["items"], f"{path}第{i + 1}条", True, repairs))
+                except OutputError:
+                    if strict_items:
+                        raise
+                    items.append(item)
+            value = items
+    return value
+
+
+def _coerce(value: Any, schema: dict, path: str, repairs: list[str]) -> Any:
+    if _allows(schema, "string"):
+        if isinstance(value, list) and value and all(isinstance(v, (str, int, float)) for v in value):
+            repairs.append("连接字符串列表")
+            return JOIN_SEPARATOR.join(str(v) for v in value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            repairs.append("数字转为字符串")
+            return str(value)
+    if _allows(schema, "integer"):
+        if isinstance(value, str) and (match := _INTEGER_PATTERN.fullmatch(value.strip())):
+            repairs.append("字符串转为整数")
+            return int(match.group())
+        if isinstance(value, float) and value.is_integer():
+            repairs.append("小数转为整数")
+            return int(value)
+        if isinstance(value, list) and len(value) == 1:
+            repairs.append("取出列表中的整数")
+            return _conform(value[0], schema, path, True, repairs)
+    raise OutputError(f"{path}的类型应为 {schema.get('type')}")
+
+
+def add_schema_argument(parser: argparse.ArgumentParser):
+    """添加 JSON Schema 相关的命令行参数"""
+    parser.add_argument("--no-schema", action="store_true",
+                        help="不通过 format 字段向 Ollama 发送 JSON Schema（默认在 Ollama 支持时发送），仍在本地修复和校验输出")
@@ -0,0 +1,112 @@
+import re
+from collections import deque
+from collections.abc import Iterable
+
+
+def _is_word_char(char: str) -> bool:
+    """与正则表达式 ``\\w`` 的判断一致"""
+    return char.isalnum() or char == "_"
+
+
+class MultiPatternCleaner:
+    """
+    多模式字符串清理器，用于一次性删除聊天内容中的所有@昵称和特殊内容（如 ``[表情]``）
+
+    所有模式编译为一个 Aho-Corasick 自动机，每条消息只需线性扫描一遍，
+    耗时与模式数量无关。匹配规则与按长度降序排列的正则表达式 ``a|b|c`` 一致：
+    优先最左侧的匹配，同一位置优先最长的匹配，匹配结果互不重叠
+    """
+
+    def __init__(self, patterns: Iterable[str], boundary: bool = False):
+        """
+        :param patterns: 要删除的字符串
+        :param boundary: 为 True 时，匹配结果之后必须是非单词字符或文本末尾，
+            相当于正则表达式 ``(?=\\W|$)``
+        """
+        self.boundary = boundary
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._lengths: list[tuple[int, ...]] = [()]
+        """以各节点结尾的所有模式长度（包括失配链接上的节点）"""
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build()
+        first_chars = "".join(re.escape(char) for char in sorted(self._goto[0]))
+        self._first_char_regex = re.compile(f"[{first_chars}]") if first_chars else None
+
+    def _add(self, pattern: str):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._lengths.append(())
+            node = next_node
+        self._lengths[node] = (len(pattern),)
+
+    def _build(self):
+        """按广度优先顺序计算失配链接，并合并失配链接上的模式长度"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail if fail != child else 0
+                self._lengths[child] = self._lengths[child] + self._lengths[self._fail[child]]
+                queue.append(child)
+
+    def find_spans(self, text: str) -> list[tuple[int, int]]:
+        """返回所有匹配结果的 ``(起始位置, 结束位置)``，按位置排序且互不重叠"""
+        if self._first_char_regex is None:
+            return []
+        goto, fail, lengths = self._goto, self._fail, self._lengths
+        text_len = len(text)
+        longest_end: dict[int, int] = {}
+        state = 0
+        pos = 0
+        while pos < text_len:
+            if state == 0:
+                # 处于根节点时直接跳到下一个可能开始匹配的字符
+                match = self._first_char_regex.search(text, pos)
+                if match is None:
+                    break
+                pos = match.start()
+            char = text[pos]
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            pos += 1
+            for length in lengths[state]:
+                if self.boundary and pos < text_len and _is_word_char(text[pos]):
+                    continue
+                start = pos - length
+                if longest_end.get(start, -1) < pos:
+                    longest_end[start] = pos
+
+        spans = []
+        last_end = 0
+        for start in sorted(longest_end):
+            if start >= last_end:
+                last_end = longest_end[start]
+                spans.append((start, last_end))
+        return spans
+
+    def sub(self, text: str, repl: str = "") -> str:
+        """将所有匹配结果替换为 ``repl``，默认直接删除"""
+        spans = self.find_spans(text)
+        if not spans:
+            return text
+        parts = []
+        last_end = 0
+        for start, end in spans:
+            parts.append(text[last_end:start])
+            last_end = end
+        parts.append(text[last_end:])
+        return repl.join(parts)
@@ -0,0 +1,210 @@
+import heapq
+import time
+from collections.abc import Iterable, Iterator, Sequence
+
+import numpy as np
+
+MAX_OTHER_MESSAGES = 2
+"""同一用户相邻两条消息之间最多夹有几条他人消息时合并"""
+MAX_INTERVAL_SECONDS = 60
+"""同一用户相邻两条消息最多间隔多少秒时合并"""
+WINDOW_MIN_MESSAGES = 10000
+"""流式合并时每个窗口至少包含的消息数，窗口在间隔超过合并上限的相邻消息之间切分"""
+
+_SECONDS_PER_DAY = 86400
+_MICROSECONDS = 1_000_000
+_MAX_OFFSET_DECREASE = _SECONDS_PER_DAY * _MICROSECONDS
+"""假设本地时区的 UTC 偏移之后不会比当前减少超过一天"""
+
+
+def local_utc_offsets(seconds: np.ndarray) -> np.ndarray:
+    """
+    各时间戳在本地时区的 UTC 偏移（秒），与 ``datetime.fromtimestamp`` 的结果一致
+
+    只对数据中出现的每个 UTC 自然日查询首尾两次时区，有夏令时切换的日期再二分查找切换时刻，
+    假设同一天内最多切换一次
+    """
+    if not len(seconds):
+        return np.zeros(0, dtype=np.int64)
+
+    def offset(second: int) -> int:
+        return time.localtime(second).tm_gmtoff
+
+    points: list[int] = []
+    values: list[int] = []
+    for day in np.unique(seconds // _SECONDS_PER_DAY).tolist():
+        start = day * _SECONDS_PER_DAY
+        end = start + _SECONDS_PER_DAY - 1
+        start_offset, end_offset = offset(start), offset(end)
+        if not values or values[-1] != start_offset:
+            points.append(start)
+            values.append(start_offset)
+        if start_offset != end_offset:
+            low, high = start, end
+            while high - low > 1:
+                middle = (low + high) // 2
+                if offset(middle) == start_offset:
+                    low = middle
+                else:
+                    high = middle
+            points.append(high)
+            values.append(end_offset)
+    index = np.searchsorted(np.asarray(points, dtype=np.int64), seconds, side="right") - 1
+    return np.asarray(values, dtype=np.int64)[index]
+
+
+def to_local_microseconds(timestamps: np.ndarray) -> np.ndarray:
+    """
+    将浮点时间戳转换为本地时间的微秒数，
+    与 ``datetime.fromtimestamp`` 相同：微秒部分四舍六入五成双，结果为不带时区的本地时间
+    """
+    fraction, whole = np.modf(timestamps)
+    microseconds = np.rint(fraction * _MICROSECONDS)
+    carry = microseconds >= _MICROSECONDS
+    microseconds[carry] -= _MICROSECONDS
+    whole[carry] += 1
+    borrow = microseconds < 0
+    microseconds[borrow] += _MICROSECONDS
+    whole[borrow] -= 1
+    seconds = whole.astype(np.int64)
+    return (seconds + local_utc_offsets(seconds)) * _MICROSECONDS + microseconds.astype(np.int64)
+
+
+def merge_messages(
+        times: Sequence[int],
+        user_ids: Sequence[str],
+        contents: Sequence[str],
+        max_other_messages: int = MAX_OTHER_MESSAGES,
+        max_interval_seconds: int = MAX_INTERVAL_SECONDS,
+        separator: str = "，"
+) -> list[tuple[str, str, int]]:
+    """
+    将同一用户连续发送的消息合并为一条，并计算相邻合并消息的时间差
+
+    消息按时间排序后，同一用户相邻两条消息之间的他人消息不超过 ``max_other_messages`` 条、
+    且间隔不超过 ``max_interval_seconds`` 秒时合并。合并后的时间为各条消息时间的平均值（本地时间），
+    按该时间排序后计算与上一条的时间差（秒，向零取整）
+
+    :param times: 各条消息的秒级时间戳
+    :return: 按时间排序的 ``(用户ID, 合并后的内容, 与上一条的时间差)``
+    """
+    count = len(times)
+    if not count:
+        return []
+    order = np.argsort(np.asarray(times, dtype=np.int64), kind="stable")
+    sorted_times = np.asarray(times, dtype=np.int64)[order]
+
+    # 按用户首次出现的顺序编号，同一用户的消息保持时间顺序排在一起
+    user_codes: dict[str, int] = {}
+    codes = np.fromiter(
+        (user_codes.setdefault(user_ids[i], len(user_codes)) for i in order.tolist()),
+        dtype=np.int64, count=count
+    )
+    by_user, starts, ends, local_times = _group_messages(sorted_times, codes, max_other_messages, max_interval_seconds)
+    merged_order = np.argsort(local_times, kind="stable")
+    deltas = np.zeros(len(starts), dtype=np.int64)
+    deltas[1:] = np.trunc(np.diff(local_times[merged_order]) / _MICROSECONDS)
+
+    message_order = order[by_user].tolist()
+    starts_list, ends_list = starts.tolist(), ends.tolist()
+    result = []
+    for group, delta in zip(merged_order.tolist(), deltas.tolist()):
+        indices = message_order[starts_list[group]:ends_list[group]]
+        result.append((
+            user_ids[indices[0]],
+            separator.join([contents[i] for i in indices]),
+            delta
+        ))
+    return result
+
+
+def merge_message_stream(
+        messages: Iterable[tuple[int, str, str]],
+        max_other_messages: int = MAX_OTHER_MESSAGES,
+        max_interval_seconds: int = MAX_INTERVAL_SECONDS,
+        separator: str = "，",
+        window_min_messages: int = WINDOW_MIN_MESSAGES
+) -> Iterator[tuple[str, str, int]]:
+    """
+    :func:`merge_messages` 的流式版本，逐个窗口合并已按时间排序的消息，结果与其相同
+
+    相邻两条消息的间隔超过 ``max_interval_seconds`` 时，之后的消息不会与之前的合并，在此处切分窗口，
+    每个窗口至少包含 ``window_min_messages`` 条消息。合并后的消息按本地时间排序，
+    平均时间早于下一窗口起点一天以上的先输出，其余留到之后的窗口一起排序。
+    内存占用取决于最长的一段没有长间隔的消息，而不是消息总数
+
+    :param messages: 按时间排序的 ``(秒级时间戳, 用户ID, 内容)``
+    :return: 按时间排序的 ``(用户ID, 合并后的内容, 与上一条的时间差)``
+    """
+    user_codes: dict[str, int] = {}
+    # 待输出的合并消息：(本地时间, 用户编号, 首条消息序号, 用户ID, 内容)，与 merge_messages 的排序一致
+    buffered: list[tuple[int, int, int, str, str]] = []
+    last_local_time = None
+    window: list[tuple[int, str, str]] = []
+    window_start = 0
+
+    def merge_window():
+        times = np.fromiter((message[0] for message in window), dtype=np.int64, count=len(window))
+        codes = np.fromiter(
+            (user_codes.setdefault(message[1], len(user_codes)) for message in window),
+            dtype=np.int64, count=len(window)
+        )
+        by_user, starts, ends, local_times = _group_messages(times, codes, max_other_messages, max_interval_seconds)
+        message_order = by_user.tolist()
+        codes_list = codes.tolist()
+        for start, end, local_time in zip(starts.tolist(), ends.tolist(), local_times.tolist()):
+            indices = message_order[start:end]
+            heapq.heappush(buffered, (
+                local_time, codes_list[indices[0]], window_start + indices[0],
+                window[indices[0]][1], separator.join([window[i][2] for i in indices])
+            ))
+
+    def release(before: float):
+        nonlocal last_local_time
+        while buffered and buffered[0][0] < before:
+            local_time, _, _, user_id, content = heapq.heappop(buffered)
+            delta = 0 if last_local_time is None else int((local_time - last_local_time) / _MICROSECONDS)
+            last_local_time = local_time
+            yield user_id, content, delta
+
+    for message in messages:
+        if len(window) >= window_min_messages and message[0] - window[-1][0] > max_interval_seconds:
+            merge_window()
+            window_start += len(window)
+            window = []
+            # 之后的合并消息平均时间不早于 message[0]，时区偏移减少不超过一天时本地时间不早于该界限
+            yield from release(to_local_microseconds(np.array([message[0]], dtype=np.float64))[0]
+                               - _MAX_OFFSET_DECREASE)
+        window.append(message)
+    if window:
+        merge_window()
+    yield from release(float("inf"))
+
+
+def _group_messages(
+        sorted_times: np.ndarray,
+        codes: np.ndarray,
+        max_other_messages: int,
+        max_interval_seconds: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    将按时间排序的消息分组
+
+    :param codes: 各条消息的用户编号，按用户首次出现的顺序编号
+    :return: ``(按用户排列的消息位置, 各组的起点, 各组的终点, 各组平均时间的本地微秒数)``，
+        各组按用户编号、时间排列
+    """
+    count = len(sorted_times)
+    by_user = np.argsort(codes, kind="stable")
+
+    # 同一用户相邻两条消息的位置差减一即为中间他人消息的数量
+    same_user = codes[by_user[1:]] == codes[by_user[:-1]]
+    other_messages = by_user[1:] - by_user[:-1] - 1
+    intervals = sorted_times[by_user[1:]] - sorted_times[by_user[:-1]]
+    joined = same_user & (other_messages <= max_other_messages) & (intervals <= max_interval_seconds)
+    starts = np.flatnonzero(np.concatenate(([True], ~joined)))
+    ends = np.append(starts[1:], count)
+
+    # 整数求和与逐条累加浮点数的结果一致
+    averages = np.add.reduceat(sorted_times[by_user], starts) / (ends - starts)
+    return by_user, starts, ends, to_local_microseconds(averages)
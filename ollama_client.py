@@ -0,0 +1,269 @@
+import http.client
+import json
+import re
+import threading
+import time
+from queue import Empty, Full, LifoQueue
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import urlparse
+
+from stream_guard import OutputValidator, StreamAborted
+
+if TYPE_CHECKING:
+    from llm_cache import ResponseCache
+
+DEFAULT_BASE_URL = "http://127.0.0.1:11434"
+"""Ollama API 默认地址"""
+CONNECT_TIMEOUT = 10
+"""建立连接的超时时间（秒）"""
+READ_TIMEOUT = 600
+"""等待响应的超时时间（秒），需大于生成一批内容所需的时间"""
+MAX_IDLE_CONNECTIONS = 16
+"""连接池最多保留的空闲连接数"""
+SCHEMA_MIN_VERSION = (0, 5, 0)
+"""支持在 ``format`` 字段中使用 JSON Schema 的最低 Ollama 版本"""
+STREAM_DRAIN_SECONDS = 0.5
+"""流式请求的内容已完整后，等待生成结束以复用连接的最长时间（秒），超时则断开连接"""
+STREAM_DRAIN_TOKENS = 8
+"""流式请求的内容已完整后，最多再接收的 token 数，超过则断开连接"""
+
+
+class OllamaError(Exception):
+    """Ollama API 返回了非 200 状态码"""
+
+    def __init__(self, status: int, reason: str, body: bytes = b""):
+        super().__init__(f"API错误: {status} {reason}")
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+
+class OllamaClient:
+    """
+    Ollama API 客户端，多个线程共用一个连接池，请求结束后保持连接以供复用
+
+    连接与读取分别设置超时，服务端无响应时抛出 ``TimeoutError``，不会一直阻塞。
+    复用的空闲连接可能已被服务端关闭，此时会自动换用新连接重发请求
+    """
+
+    def __init__(
+            self,
+            base_url: str = DEFAULT_BASE_URL,
+            connect_timeout: float = CONNECT_TIMEOUT,
+            read_timeout: float = READ_TIMEOUT,
+            max_idle_connections: int = MAX_IDLE_CONNECTIONS
+    ):
+        parsed_url = urlparse(base_url)
+        self.https = parsed_url.scheme == "https"
+        self.host = parsed_url.hostname or "127.0.0.1"
+        self.port = parsed_url.port or (443 if self.https else 11434)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle: LifoQueue[http.client.HTTPConnection] = LifoQueue(maxsize=max_idle_connections)
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        """累计新建的连接数"""
+        self._version: Optional[tuple[int, ...]] = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        conn = connection_class(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+    def _release(self, conn: http.client.HTTPConnection):
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    def _open(self, method: str, path: str, body: Optional[bytes],
+              headers: Optional[dict]) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """发送请求并读取响应头，响应内容由调用方读取"""
+        while True:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except Empty:
+                conn, reused = self._connect(), False
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                return conn, conn.getresponse()
+            except ConnectionError:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+
+    def _finish(self, conn: http.client.HTTPConnection, response: http.client.HTTPResponse):
+        """响应内容已读完，归还连接"""
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[dict] = None) -> tuple[int, str, bytes]:
+        """发送请求并读取完整响应，返回 (状态码, 状态说明, 响应内容)"""
+        conn, response = self._open(method, path, body, headers)
+        try:
+            data = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        self._finish(conn, response)
+        return response.status, response.reason, data
+
+    def version(self) -> tuple[int, ...]:
+        """Ollama 版本号，无法获取时返回空元组"""
+        if self._version is None:
+            try:
+                status, _, data = self.request("GET", "/api/version")
+                text = json.loads(data.decode("utf-8"))["version"] if status == 200 else ""
+                self._version = tuple(int(part) for part in re.findall(r"\d+", text)[:3])
+            except (OSError, ValueError, KeyError, http.client.HTTPException):
+                self._version = ()
+        return self._version
+
+    def supports_schema(self) -> bool:
+        """``format`` 字段是否支持 JSON Schema"""
+        return self.version() >= SCHEMA_MIN_VERSION
+
+    def chat(self, payload: dict, cache: Optional["ResponseCache"] = None) -> dict:
+        """
+        调用 ``/api/chat``，返回解析后的响应
+
+        :param cache: 响应缓存，命中时不发送请求；响应通过校验后由调用方写入缓存
+        """
+        if cache is not None and (cached := cache.get(payload)) is not None:
+            return cached
+        status, reason, data = self.request(
+            "POST", "/api/chat", body=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        if status != 200:
+            raise OllamaError(status, reason, data)
+        return json.loads(data.decode("utf-8"))
+
+    def chat_stream(
+            self,
+            payload: dict,
+            validator: Optional[OutputValidator] = None,
+            max_tokens: Optional[int] = None,
+            max_seconds: Optional[float] = None,
+            cache: Optional["ResponseCache"] = None
+    ) -> dict:
+        """
+        以流式请求调用 ``/api/chat``，边接收边校验，返回与 :meth:`chat` 格式相同的响应
+
+        生成的内容已不可能符合 ``validator`` 的要求，或超过 ``max_tokens`` 个 token、``max_seconds`` 秒时，
+        断开连接使 Ollama 停止生成，并抛出 :class:`StreamAborted`（``ValueError`` 的子类）；
+        ``validator`` 判断内容已完整时同样断开连接，不再等待模型输出多余的内容。
+        模型停止输出时最多等到 ``max_seconds`` 为止；响应在收到 ``done`` 之前结束时断开连接并抛出 :class:`StreamAborted`
+
+        :param cache: 响应缓存，命中时不发送请求；响应通过校验后由调用方写入缓存
+        """
+        if cache is not None and (cached := cache.get(payload)) is not None:
+            return cached
+        conn, response = self._open(
+            "POST", "/api/chat", json.dumps(dict(payload, stream=True)).encode("utf-8"),
+            {"Content-Type": "application/json"}
+        )
+        parts = []
+        token_count = 0
+        deadline = None if max_seconds is None else time.monotonic() + max_seconds
+        try:
+            if response.status != 200:
+                raise OllamaError(response.status, response.reason, response.read())
+            while True:
+                line = self._read_line(conn, response, deadline, max_seconds)
+                if not line:
+                    # 没有收到 done 就结束了，内容可能不完整
+                    raise StreamAborted("响应在生成结束前中断")
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise OllamaError(response.status, str(chunk["error"]))
+                text = chunk.get("message", {}).get("content", "")
+                parts.append(text)
+                token_count += 1
+                if chunk.get("done"):
+                    # 读完分块传输的结尾，连接才能复用
+                    response.read()
+                    conn.sock.settimeout(self.read_timeout)
+                    self._finish(conn, response)
+                    break
+                if validator is not None and validator.feed(text):
+                    self._drain(conn, response)
+                    break
+                if max_tokens is not None and token_count >= max_tokens:
+                    raise StreamAborted(f"超过 {max_tokens} token 上限")
+        except BaseException:
+            # 断开连接后 Ollama 会停止生成
+            conn.close()
+            raise
+        return {
+            "model": payload.get("model"),
+            "message": {"role": "assistant", "content": "".join(parts)},
+            "done": True,
+            "eval_count": token_count
+        }
+
+    def _read_line(self, conn: http.client.HTTPConnection, response: http.client.HTTPResponse,
+                   deadline: Optional[float], max_seconds: Optional[float]) -> bytes:
+        """读取一行流式响应，模型停止输出时等待不超过剩余的时间上限"""
+        if deadline is None:
+            return response.readline()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise StreamAborted(f"超过 {max_seconds} 秒时间上限")
+        conn.sock.settimeout(min(remaining, self.read_timeout))
+        try:
+            return response.readline()
+        except TimeoutError:
+            if remaining < self.read_timeout:
+                raise StreamAborted(f"超过 {max_seconds} 秒时间上限")
+            raise
+
+    def _drain(self, conn: http.client.HTTPConnection, response: http.client.HTTPResponse):
+        """内容已完整，模型很快结束生成时读完响应以复用连接，否则断开连接使其停止生成"""
+        conn.sock.settimeout(STREAM_DRAIN_SECONDS)
+        try:
+            for _ in range(STREAM_DRAIN_TOKENS):
+                line = response.readline()
+                if not line:
+                    break
+                if line.strip() and json.loads(line).get("done"):
+                    response.read()
+                    conn.sock.settimeout(self.read_timeout)
+                    self._finish(conn, response)
+                    return
+        except (OSError, ValueError):
+            pass
+        conn.close()
+
+    def close(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+
+_clients: dict[str, OllamaClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url: str = DEFAULT_BASE_URL) -> OllamaClient:
+    """返回该地址共用的客户端"""
+    with _clients_lock:
+        if base_url not in _clients:
+            _clients[base_url] = OllamaClient(base_url)
+        return _clients[base_url]
@@ -0,0 +1,52 @@
+import asyncio
+from collections import deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def run_ordered(jobs: Iterable[T], send: Callable[[T], R], commit: Callable[[T, R], None], max_in_flight: int = 1):
+    """
+    并发执行 ``send``，按 ``jobs`` 的顺序依次调用 ``commit`` 提交结果
+
+    同时最多有 ``max_in_flight`` 个任务在执行或等待提交：先完成的后续任务会等待前面的任务提交，
+    因此已提交的结果总是 ``jobs`` 的一个前缀，中断后可以从第一个未提交的任务继续。
+    ``send`` 在线程池中执行（可以是阻塞的网络请求），``commit`` 在调用方线程中执行。
+    某个任务出错时，其之前的任务正常提交，之后的任务不再提交，等待已发出的请求结束后抛出该异常
+
+    :param max_in_flight: 最大并发数，为 1 时在当前线程中逐个执行
+    """
+    if max_in_flight <= 1:
+        for job in jobs:
+            commit(job, send(job))
+        return
+    asyncio.run(_run_ordered(jobs, send, commit, max_in_flight))
+
+
+async def _run_ordered(jobs: Iterable[T], send: Callable[[T], R], commit: Callable[[T, R], None], max_in_flight: int):
+    loop = asyncio.get_running_loop()
+    jobs = iter(jobs)
+    pending: deque[tuple[T, asyncio.Future]] = deque()
+    # 不使用默认线程池，其线程数与 CPU 核心数有关，可能小于 max_in_flight
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="ordered_dispatch") as executor:
+        try:
+            while True:
+                while len(pending) < max_in_flight:
+                    try:
+                        job = next(jobs)
+                    except StopIteration:
+                        break
+                    pending.append((job, loop.run_in_executor(executor, send, job)))
+                if not pending:
+                    return
+                job, future = pending.popleft()
+                commit(job, await future)
+        finally:
+            futures = [future for _, future in pending]
+            for future in futures:
+                future.cancel()
+            # 等待取消生效，已出错结束的任务在此取出异常，不会在事件循环关闭后报告 "exception was never retrieved"
+            await asyncio.gather(*futures, return_exceptions=True)
@@ -1,23 +1,41 @@
-import ast
-import csv
-import json
 import re
 
+from dataset_store import save_records
+from group_msg_io import (
+    parse_content_list, parse_timestamp, read_group_msg_rows, select_user_ids, user_output_path
+)
+from msg_cleaner import MultiPatternCleaner
+from stage_profiler import StageProfiler
+
 USER_ID = "123456789"
 """目标用户ID"""
+USER_IDS = None
+"""多个目标用户ID（如 ["123", "456"]），不为 None 时忽略 USER_ID，按用户分别输出到 <输出文件名>_<用户ID>.json"""
+MIN_MESSAGE_COUNT = None
+"""不为 None 时以消息数不少于该值的所有用户为目标用户，同样按用户分别输出"""
 CSV_PATH = r"C:\Users\mcdha\PyCharmProjects\qq_nt_decrpty\group_msg.csv"
-"""聊天记录CSV路径"""
+"""聊天记录CSV路径，也可以是 qq_nt_parse 输出的 Parquet 文件"""
+OUTPUT_JSON_PATH = r"proceed-group-msg.json"
+"""数据集输出路径，扩展名为 .jsonl 或 .jsonl.zst 时输出带偏移索引的 JSONL 文件"""
+OUTPUT_FORMAT = "alpaca"
+"""输出格式："alpaca" 将前文消息以换行拼接为提问；"sharegpt" 输出多轮对话，目标用户自己之前的消息作为模型回答"""
+HISTORY_SIZE = 1
+"""每条回答保留的前文消息条数"""
+HISTORY_MAX_SECONDS = None
+"""前文消息与回答的最大时间间隔（秒），为 None 时不限制"""
+PROFILE_REPORT_PATH = None
+"""性能报告输出路径（JSON），为 None 时不统计各阶段耗时"""
 
 
-def process_chat_content(content_str, nickname_regex):
+def process_chat_content(content, nickname_cleaner):
     """处理聊天内容：合并片段、删除@提及、清理空格"""
     try:
         # 解析原始内容列表并合并
-        content_list = ast.literal_eval(content_str)
+        content_list = parse_content_list(content)
         merged_content = ', '.join(str(item) for item in content_list)
 
         # 删除@用户昵称
-        cleaned_content = nickname_regex.sub('', merged_content)
+        cleaned_content = nickname_cleaner.sub(merged_content)
 
         # 清理多余空格并返回
         return re.sub(r'\s+', ' ', cleaned_content).strip()
@@ -25,50 +43,151 @@ def process_chat_content(content_str, nickname_regex):
         return ''
 
 
+def get_timestamp(value):
+    """解析消息时间，格式不正确时返回 None"""
+    try:
+        return parse_timestamp(value)
+    except ValueError:
+        return None
+
+
+def history_window(history, own_positions, include_self):
+    """
+    从所有用户共用的前文缓冲区末尾取出目标用户的最近 HISTORY_SIZE 条前文
+
+    :param history: 所有非空消息在记录中的下标，按时间顺序排列
+    :param own_positions: 目标用户自己的消息在 ``history`` 中的位置，按时间顺序排列
+    :param include_self: 是否包含目标用户自己的消息（sharegpt 格式）
+    :return: [(记录下标, 是否为目标用户自己的消息)]，按时间顺序排列
+    """
+    window = []
+    own_index = len(own_positions) - 1
+    position = len(history) - 1
+    while position >= 0 and len(window) < HISTORY_SIZE:
+        is_self = own_index >= 0 and own_positions[own_index] == position
+        if is_self:
+            own_index -= 1
+        if include_self or not is_self:
+            window.append((history[position], is_self))
+        position -= 1
+    window.reverse()
+    return window
+
+
+def build_sample(history, output, sharegpt):
+    """
+    根据前文消息生成训练数据条目，没有可用的前文时返回 None
+
+    :param history: 前文消息 (时间, 是否为目标用户自己的消息, 内容)，按时间顺序排列
+    """
+    if not sharegpt:
+        instructions = [content for _, _, content in history]
+        if not instructions:
+            return None
+        return {
+            "instruction": "\n".join(instructions),
+            "input": "",
+            "output": output
+        }
+
+    # 连续的同一角色消息合并为一轮，对话须以提问开始
+    conversations = []
+    for _, is_self, content in history:
+        role = "gpt" if is_self else "human"
+        if conversations and conversations[-1]["from"] == role:
+            conversations[-1]["value"] += "\n" + content
+        elif conversations or not is_self:
+            conversations.append({"from": role, "value": content})
+    if not conversations:
+        return None
+    if conversations[-1]["from"] == "gpt":
+        conversations[-1]["value"] += "\n" + output
+    else:
+        conversations.append({"from": "gpt", "value": output})
+    return {"conversations": conversations}
+
+
 def main():
+    profiler = StageProfiler("proceed-group-msg", enabled=PROFILE_REPORT_PATH is not None)
+    clean = profiler.timed("clean", process_chat_content)
+
     # 读取CSV数据并收集所有昵称
-    with open(CSV_PATH, 'r', encoding='gbk') as csvfile:
-        rows = list(csv.reader(csvfile))
+    with profiler.stage("read"):
+        rows = list(read_group_msg_rows(CSV_PATH, 'gbk'))
+
+    # 确定目标用户
+    target_ids = select_user_ids(rows, USER_IDS or [USER_ID], MIN_MESSAGE_COUNT)
+
+    # 构建昵称清理器
+    with profiler.stage("build_cleaner"):
+        nicknames = {row[2] for row in rows if row[2].strip()}
+        nickname_cleaner = MultiPatternCleaner(['@' + n for n in nicknames], boundary=True)
 
-    # 构建昵称正则表达式
-    nicknames = {row[2] for row in rows if row[2].strip()}
-    sorted_nicknames = sorted(nicknames, key=len, reverse=True)
-    nickname_regex = re.compile(
-        r'@(' + '|'.join(re.escape(n) for n in sorted_nicknames) + r')(?=\W|$)',
-        flags=re.UNICODE
-    )
+    # 预处理：每条记录只清理一次
+    with profiler.stage("preprocess"):
+        cleaned_contents = [clean(row[4], nickname_cleaner) for row in rows]
+        timestamps = [get_timestamp(row[1]) for row in rows] if HISTORY_MAX_SECONDS is not None else None
 
-    output_data = []
+    sharegpt = OUTPUT_FORMAT == "sharegpt"
+    # 所有目标用户共用一个前文缓冲区（非空消息的下标），各目标用户只记录自己的消息在其中的位置，
+    # 生成样本时从末尾往前取，不需要为每个目标用户各复制一份。
+    # alpaca 格式排除该模型自己的消息，期间没有其他用户的新消息时前文不变，直接复用上次的结果，
+    # 避免连续发言时反复跳过自己的消息
+    history = []
+    own_positions = {user_id: [] for user_id in target_ids}
+    last_windows = {}
+    output_data = {user_id: [] for user_id in target_ids}
 
     # 遍历所有记录
-    for idx, row in enumerate(rows):
-        user_id = row[3]
-        if user_id == USER_ID:  # 处理模型回答
-            # 处理当前回答内容
-            assistant_content = process_chat_content(row[4], nickname_regex)
-
-            # 收集前1条有效指令
-            instructions = []
-            pointer = idx - 1  # 从当前记录前一条开始
-            while pointer >= 0 and len(instructions) < 1:
-                if rows[pointer][3] != USER_ID:  # 排除其他模型消息
-                    # 处理指令内容
-                    processed = process_chat_content(rows[pointer][4], nickname_regex)
-                    if processed:  # 跳过空内容
-                        instructions.append(processed)
-                pointer -= 1
-
-            # 生成训练数据条目
-            for instruction in instructions:
-                output_data.append({
-                    "instruction": instruction,
-                    "input": "",
-                    "output": assistant_content
-                })
+    with profiler.stage("process"):
+        for idx, row in enumerate(rows):
+            user_id = row[3]
+            content = cleaned_contents[idx]
+            timestamp = timestamps[idx] if timestamps is not None else None
+
+            if user_id in output_data:  # 处理模型回答
+                positions = own_positions[user_id]
+                if sharegpt:
+                    window = history_window(history, positions, True)
+                else:
+                    other_count = len(history) - len(positions)
+                    last = last_windows.get(user_id)
+                    if last is None or last[0] != other_count:
+                        last = last_windows[user_id] = (other_count, history_window(history, positions, False))
+                    window = last[1]
+                messages = [
+                    (timestamps[i] if timestamps is not None else None, is_self, cleaned_contents[i])
+                    for i, is_self in window
+                ]
+                if timestamp is not None:
+                    messages = [
+                        message for message in messages
+                        if message[0] is not None and timestamp - message[0] <= HISTORY_MAX_SECONDS
+                    ]
+
+                # 生成训练数据条目
+                sample = build_sample(messages, content, sharegpt)
+                if sample is not None:
+                    output_data[user_id].append(sample)
+
+            if content:  # 跳过空内容
+                if user_id in own_positions:
+                    own_positions[user_id].append(len(history))
+                history.append(idx)
 
     # 输出JSON文件
-    with open(r"proceed-group-msg.json", 'w', encoding='utf-8') as jsonfile:
-        json.dump(output_data, jsonfile, ensure_ascii=False, indent=2)
+    with profiler.stage("dump"):
+        per_user = USER_IDS is not None or MIN_MESSAGE_COUNT is not None
+        for user_id in target_ids:
+            output_path = user_output_path(OUTPUT_JSON_PATH, user_id) if per_user else OUTPUT_JSON_PATH
+            save_records(output_path, output_data[user_id])
+
+    profiler.count("read", len(rows))
+    profiler.count("preprocess", len(rows))
+    profiler.count("process", len(rows))
+    profiler.count("dump", sum(map(len, output_data.values())))
+    if PROFILE_REPORT_PATH:
+        profiler.save(PROFILE_REPORT_PATH)
 
 
 if __name__ == '__main__':
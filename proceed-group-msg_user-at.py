@@ -1,20 +1,31 @@
-import ast
-import csv
-import json
 import re
-from datetime import datetime
+
+from dataset_store import save_records
+from group_msg_io import (
+    parse_content_list, parse_timestamp, read_group_msg_rows, select_user_ids, user_output_path
+)
+from msg_cleaner import MultiPatternCleaner
+from stage_profiler import StageProfiler
 
 USER_ID = "123456789"
 """目标用户ID"""
+USER_IDS = None
+"""多个目标用户ID（如 ["123", "456"]），不为 None 时忽略 USER_ID，按用户分别输出到 <输出文件名>_<用户ID>.json"""
+MIN_MESSAGE_COUNT = None
+"""不为 None 时以消息数不少于该值的所有用户为目标用户，同样按用户分别输出"""
 CSV_PATH = r"group_msg.csv"
-"""聊天记录CSV路径"""
+"""聊天记录CSV路径，也可以是 qq_nt_parse 输出的 Parquet 文件"""
+OUTPUT_JSON_PATH = r"proceed-group-msg_user-at.json"
+"""数据集输出路径，扩展名为 .jsonl 或 .jsonl.zst 时输出带偏移索引的 JSONL 文件"""
+PROFILE_REPORT_PATH = None
+"""性能报告输出路径（JSON），为 None 时不统计各阶段耗时"""
 
 
-def process_chat_content(content_str, nickname_regex):
+def process_chat_content(content, nickname_cleaner):
     """处理聊天内容并提取被@的昵称"""
     try:
         # 解析并合并聊天片段
-        content_list = ast.literal_eval(content_str)
+        content_list = parse_content_list(content)
         merged_content = ', '.join(str(item) for item in content_list)
     except (SyntaxError, ValueError, TypeError):
         return '', []
@@ -24,67 +35,87 @@ def process_chat_content(content_str, nickname_regex):
     mentioned_nicknames = list(set(raw_mentions))
 
     # 删除@提及并清理内容
-    cleaned_content = nickname_regex.sub('', merged_content)
+    cleaned_content = nickname_cleaner.sub(merged_content)
     cleaned_content = re.sub(r'\s+', ' ', cleaned_content).strip()
 
     return cleaned_content, mentioned_nicknames
 
 
 def main():
+    profiler = StageProfiler("proceed-group-msg_user-at", enabled=PROFILE_REPORT_PATH is not None)
+    clean = profiler.timed("clean", process_chat_content)
+
     # 读取原始数据
-    with open(CSV_PATH, 'r', encoding='gbk') as csvfile:
-        rows = list(csv.reader(csvfile))
+    with profiler.stage("read"):
+        rows = list(read_group_msg_rows(CSV_PATH, 'gbk'))
 
-    # 构建昵称正则表达式
-    all_nicknames = {row[2].strip() for row in rows if row[2].strip()}
-    sorted_nicknames = sorted(all_nicknames, key=lambda x: len(x), reverse=True)
-    nickname_regex = re.compile(
-        r'@(' + '|'.join(re.escape(n) for n in sorted_nicknames) + r')(?=\W|$)',
-        flags=re.UNICODE
-    )
+    # 确定目标用户
+    target_ids = select_user_ids(rows, USER_IDS or [USER_ID], MIN_MESSAGE_COUNT)
 
-    # 预处理：解析时间并排序
-    parsed_rows = []
-    for row in rows:
-        try:
-            dt = datetime.strptime(row[1], '%Y-%m-%dT%H:%M:%SZ')
-            parsed_rows.append((dt, row))
-        except ValueError:
-            continue
-    parsed_rows.sort(key=lambda x: x[0])  # 按时间升序排序
-
-    # 主处理逻辑
-    last_user_msg = {}  # 存储用户最后有效消息
-    output_data = []
+    # 构建昵称清理器
+    with profiler.stage("build_cleaner"):
+        all_nicknames = {row[2].strip() for row in rows if row[2].strip()}
+        nickname_cleaner = MultiPatternCleaner(['@' + n for n in all_nicknames], boundary=True)
 
-    for dt, row in parsed_rows:
-        user_id = row[3]
-        if user_id == USER_ID:  # 模型回答
-            content_str = row[4]
-            processed_content, mentions = process_chat_content(content_str, nickname_regex)
-
-            if not mentions:  # 跳过无@提及的回答
+    # 预处理：解析时间并排序
+    with profiler.stage("sort"):
+        parsed_rows = []
+        for row in rows:
+            try:
+                timestamp = parse_timestamp(row[1])
+                parsed_rows.append((timestamp, row))
+            except ValueError:
                 continue
+        parsed_rows.sort(key=lambda x: x[0])  # 按时间升序排序
 
-            # 为每个被@用户生成训练样本
-            for nickname in mentions:
-                if nickname in last_user_msg:
-                    output_data.append({
-                        "instruction": last_user_msg[nickname],
-                        "input": "",
-                        "output": processed_content
-                    })
-        else:  # 普通用户消息
+    # 主处理逻辑
+    with profiler.stage("process"):
+        # 存储各昵称最后一条有效消息的 (用户ID, 内容)，以及在那之前其他用户以该昵称发送的最后一条有效消息。
+        # 对任一目标用户，前者不是该用户发送的就是要找的消息，否则取后者
+        last_user_msg = {}
+        last_other_user_msg = {}
+        output_data = {user_id: [] for user_id in target_ids}
+
+        for _, row in parsed_rows:
+            user_id = row[3]
+            processed_content, mentions = clean(row[4], nickname_cleaner)
+
+            # 模型回答，跳过无@提及的回答
+            if user_id in output_data and mentions:
+                # 为每个被@用户生成训练样本
+                for nickname in mentions:
+                    if nickname not in last_user_msg:
+                        continue
+                    last_user_id, instruction = last_user_msg[nickname]
+                    if last_user_id == user_id:
+                        instruction = last_other_user_msg.get(nickname)
+                    if instruction is not None:
+                        output_data[user_id].append({
+                            "instruction": instruction,
+                            "input": "",
+                            "output": processed_content
+                        })
+
+            # 对其他目标用户而言都是普通用户消息
             nickname = row[2].strip()
-            content_str = row[4]
-            processed_content, _ = process_chat_content(content_str, nickname_regex)
-
             if nickname and processed_content:
-                last_user_msg[nickname] = processed_content
+                if nickname in last_user_msg and last_user_msg[nickname][0] != user_id:
+                    last_other_user_msg[nickname] = last_user_msg[nickname][1]
+                last_user_msg[nickname] = (user_id, processed_content)
 
     # 保存结果
-    with open(r"proceed-group-msg_user-at.json", 'w', encoding='utf-8') as jsonfile:
-        json.dump(output_data, jsonfile, ensure_ascii=False, indent=2)
+    with profiler.stage("dump"):
+        per_user = USER_IDS is not None or MIN_MESSAGE_COUNT is not None
+        for user_id in target_ids:
+            output_path = user_output_path(OUTPUT_JSON_PATH, user_id) if per_user else OUTPUT_JSON_PATH
+            save_records(output_path, output_data[user_id])
+
+    profiler.count("read", len(rows))
+    profiler.count("sort", len(parsed_rows))
+    profiler.count("process", len(parsed_rows))
+    profiler.count("dump", sum(map(len, output_data.values())))
+    if PROFILE_REPORT_PATH:
+        profiler.save(PROFILE_REPORT_PATH)
 
 
 if __name__ == '__main__':
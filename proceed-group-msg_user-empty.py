@@ -1,23 +1,33 @@
-import ast
-import csv
-import json
 import re
 
+from dataset_store import save_records
+from group_msg_io import parse_content_list, read_group_msg_rows, select_user_ids, user_output_path
+from msg_cleaner import MultiPatternCleaner
+from stage_profiler import StageProfiler
+
 USER_ID = "123456789"
 """目标用户ID"""
+USER_IDS = None
+"""多个目标用户ID（如 ["123", "456"]），不为 None 时忽略 USER_ID，按用户分别输出到 <输出文件名>_<用户ID>.json"""
+MIN_MESSAGE_COUNT = None
+"""不为 None 时以消息数不少于该值的所有用户为目标用户，同样按用户分别输出"""
 CSV_PATH = r"group_msg.csv"
-"""聊天记录CSV路径"""
+"""聊天记录CSV路径，也可以是 qq_nt_parse 输出的 Parquet 文件"""
+OUTPUT_JSON_PATH = r"proceed-group-msg_user-empty.json"
+"""数据集输出路径，扩展名为 .jsonl 或 .jsonl.zst 时输出带偏移索引的 JSONL 文件"""
+PROFILE_REPORT_PATH = None
+"""性能报告输出路径（JSON），为 None 时不统计各阶段耗时"""
 
 
-def process_chat_content(content_str, nickname_regex):
+def process_chat_content(content, nickname_cleaner):
     """处理聊天内容：合并片段、删除@提及、清理空格"""
     try:
         # 解析原始内容列表
-        content_list = ast.literal_eval(content_str)
+        content_list = parse_content_list(content)
         merged_content = ', '.join([str(item) for item in content_list])
 
         # 删除@用户昵称
-        cleaned_content = nickname_regex.sub('', merged_content)
+        cleaned_content = nickname_cleaner.sub(merged_content)
 
         # 清理多余空格
         cleaned_content = re.sub(r'\s+', ' ', cleaned_content).strip()
@@ -27,37 +37,49 @@ def process_chat_content(content_str, nickname_regex):
 
 
 def main():
+    profiler = StageProfiler("proceed-group-msg_user-empty", enabled=PROFILE_REPORT_PATH is not None)
+    clean = profiler.timed("clean", process_chat_content)
+
     # 读取CSV数据并收集所有昵称
-    with open(CSV_PATH, 'r', encoding='gbk') as csvfile:
-        rows = list(csv.reader(csvfile))
+    with profiler.stage("read"):
+        rows = list(read_group_msg_rows(CSV_PATH, 'gbk'))
+
+    # 确定目标用户
+    target_ids = select_user_ids(rows, USER_IDS or [USER_ID], MIN_MESSAGE_COUNT)
 
     # 获取去重后的昵称集合
-    nicknames = {row[2] for row in rows if row[2].strip()}
+    with profiler.stage("build_cleaner"):
+        nicknames = {row[2] for row in rows if row[2].strip()}
 
-    # 构建正则表达式（按昵称长度降序排列）
-    sorted_nicknames = sorted(nicknames, key=lambda x: len(x), reverse=True)
-    escaped_nicknames = [re.escape(nick) for nick in sorted_nicknames]
-    nickname_regex = re.compile(
-        r'@(' + '|'.join(escaped_nicknames) + r')(?=\W|$)',
-        flags=re.UNICODE
-    )
+        # 构建清理器（同一位置优先删除最长的昵称）
+        nickname_cleaner = MultiPatternCleaner(['@' + n for n in nicknames], boundary=True)
 
     # 处理聊天记录
-    output_data = []
-    for row in rows:
-        user_id = row[3]
-        if user_id == USER_ID:  # 仅处理模型回答
-            processed_content = process_chat_content(row[4], nickname_regex)
-
-            output_data.append({
-                "instruction": "",
-                "input": "",
-                "output": processed_content
-            })
+    with profiler.stage("process"):
+        output_data = {user_id: [] for user_id in target_ids}
+        for row in rows:
+            user_id = row[3]
+            if user_id in output_data:  # 仅处理模型回答
+                processed_content = clean(row[4], nickname_cleaner)
+
+                output_data[user_id].append({
+                    "instruction": "",
+                    "input": "",
+                    "output": processed_content
+                })
 
     # 输出JSON文件
-    with open(r"proceed-group-msg_user-empty.json", 'w', encoding='utf-8') as jsonfile:
-        json.dump(output_data, jsonfile, ensure_ascii=False, indent=2)
+    with profiler.stage("dump"):
+        per_user = USER_IDS is not None or MIN_MESSAGE_COUNT is not None
+        for user_id in target_ids:
+            output_path = user_output_path(OUTPUT_JSON_PATH, user_id) if per_user else OUTPUT_JSON_PATH
+            save_records(output_path, output_data[user_id])
+
+    profiler.count("read", len(rows))
+    profiler.count("process", len(rows))
+    profiler.count("dump", sum(map(len, output_data.values())))
+    if PROFILE_REPORT_PATH:
+        profiler.save(PROFILE_REPORT_PATH)
 
 
 if __name__ == '__main__':
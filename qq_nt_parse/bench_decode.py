@@ -0,0 +1,90 @@
+"""
+解析速度对比：完整解析（pydantic + 完整 protobuf）与快速解析，以及多进程解析（``--workers``）
+
+用法：python bench_decode.py [--rows 50000] [--workers 2 4 8]
+
+单核环境实测（20 万行）：多进程解析只有序列化与进程间通信的开销，2 或 4 进程时完整解析耗时为单进程的 1.5 倍，
+快速解析为 2 倍。多核机器上的加速比尚未测量
+"""
+import argparse
+import base64
+import contextlib
+import os
+import random
+import time
+
+import message_pb2
+from main import fast_load_group_msg, iter_group_msg, iter_group_msg_parallel
+
+GROUP_ID = 123456789
+
+
+def make_rows(count: int) -> list[dict]:
+    """生成与 JSON 导出文件格式一致的模拟数据，包含图片、回复、动态等非文字消息"""
+    rng = random.Random(0)
+    rows = []
+    for i in range(count):
+        message = message_pb2.Message()
+        for _ in range(rng.randint(1, 4)):
+            single = message.messages.add(messageId=rng.getrandbits(63), senderUid=rng.getrandbits(31))
+            kind = rng.random()
+            if kind < 0.5:
+                single.messageType = 1
+                single.messageText = "测试消息" * rng.randint(1, 10)
+            elif kind < 0.7:
+                single.messageType = 2
+                single.imageUrlLow = single.imageUrlHigh = single.imageUrlOrigin = f"https://example.com/{i}.jpg"
+            elif kind < 0.9:
+                single.messageType = 7
+                single.replyMessage.messageText = "被回复的消息"
+                single.replyMessage.senderId = "u_xxxxxxxx"
+            else:
+                single.messageType = 26
+                single.feedTitle.text = "动态标题"
+                single.feedContent.text = "动态内容" * 5
+                single.feedUrl = "https://example.com/feed"
+        rows.append({
+            "40021": GROUP_ID if rng.random() < 0.5 else 987654321,
+            "40050": 1660000000 + i,
+            "40090": f"成员{rng.randint(1, 200)}",
+            "40800": base64.encodebytes(message.SerializeToString()).decode(),
+            "40033": rng.randint(10000, 99999),
+        })
+    return rows
+
+
+def measure(label: str, func, baseline: float = None) -> tuple[list, float]:
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+    speedup = f"，相对单进程 {baseline / elapsed:.2f} 倍" if baseline else ""
+    print(f"{label}: {elapsed:.3f}秒{speedup}")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="解析速度对比")
+    parser.add_argument("--rows", type=int, default=50000, help="模拟数据行数（默认50000）")
+    parser.add_argument("--workers", type=int, nargs="*", default=[os.cpu_count()],
+                        help="对比的多进程解析进程数（默认为 CPU 核心数），不指定时只对比单进程")
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    group_ids = frozenset({GROUP_ID})
+    full, full_seconds = measure("完整解析", lambda: list(iter_group_msg(rows, "json", group_ids)))
+    fast, fast_seconds = measure("快速解析", lambda: [
+        x for x in (fast_load_group_msg(row, "json", group_ids) for row in rows) if x
+    ])
+    assert full == fast, "两种解析方式结果不一致"
+    for workers in args.workers:
+        for label, expected, baseline, use_fast in (("完整解析", full, full_seconds, False),
+                                                    ("快速解析", fast, fast_seconds, True)):
+            result, _ = measure(f"{label} {workers} 进程", lambda: list(
+                iter_group_msg_parallel(rows, workers, "json", group_ids, use_fast)
+            ), baseline)
+            assert result == expected, f"{label} {workers} 进程的结果与单进程不一致"
+
+
+if __name__ == "__main__":
+    main()
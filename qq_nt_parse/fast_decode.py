@@ -0,0 +1,124 @@
+import base64
+import binascii
+import time
+from collections.abc import Collection
+from typing import Literal, Optional
+
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+from google.protobuf.message import DecodeError
+
+from enums import NTGroupMsgFieldEnum
+
+MAX_SECOND_TIMESTAMP = 2e10
+"""pydantic 会将大于该值的时间戳视为毫秒，超出范围的行交给完整解析处理"""
+
+_GROUP_ID_KEY = str(NTGroupMsgFieldEnum.GROUP_ID.value)
+_TIME_KEY = str(NTGroupMsgFieldEnum.TIME.value)
+_NAME_KEY = str(NTGroupMsgFieldEnum.NAME.value)
+_MESSAGE_KEY = str(NTGroupMsgFieldEnum.MESSAGE.value)
+_USER_ID_KEY = str(NTGroupMsgFieldEnum.USER_ID.value)
+
+
+def _build_text_message_class():
+    """
+    构建只包含文字字段的消息类型
+
+    字段编号与 message.proto 一致，其余字段（图片、回复、动态等）作为未知字段跳过，不会被实例化
+    """
+    file_proto = descriptor_pb2.FileDescriptorProto(name="message_text.proto", package="text", syntax="proto3")
+    message = file_proto.message_type.add(name="Message")
+    message.field.add(
+        name="messages", number=40800,
+        type=descriptor_pb2.FieldDescriptorProto.TYPE_MESSAGE,
+        label=descriptor_pb2.FieldDescriptorProto.LABEL_REPEATED,
+        type_name=".text.SingleMessage"
+    )
+    single_message = file_proto.message_type.add(name="SingleMessage")
+    single_message.field.add(
+        name="messageText", number=45101,
+        type=descriptor_pb2.FieldDescriptorProto.TYPE_STRING,
+        label=descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL
+    )
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    return message_factory.GetMessageClass(pool.FindMessageTypeByName("text.Message"))
+
+
+TextMessage = _build_text_message_class()
+
+
+class FastDecodeError(ValueError):
+    """行格式不符合快速解析的预期，需要回退到完整解析"""
+
+
+class GroupMsgRecord:
+    """轻量的消息记录，字段与 ``NTGroupMsgModel.model_dump(mode="json")`` 的结果一致"""
+    __slots__ = ("group_id", "time", "name", "user_id", "message")
+
+    def __init__(self, group_id: int, time_: Optional[str], name: Optional[str], user_id: Optional[int],
+                 message: list[str]):
+        self.group_id = group_id
+        self.time = time_
+        self.name = name
+        self.user_id = user_id
+        self.message = message
+
+    def to_dict(self) -> dict:
+        return {
+            "group_id": self.group_id,
+            "time": self.time,
+            "name": self.name,
+            "user_id": self.user_id,
+            "message": self.message
+        }
+
+
+def decode_row(
+        row: dict,
+        mode: Literal["json", "sqlite"],
+        group_ids: Optional[Collection[int]]
+) -> Optional[GroupMsgRecord]:
+    """
+    快速解析一行原始数据
+
+    先检查群号，只解析消息中的文字内容；不属于目标群聊或没有文字时返回 None
+
+    :raise FastDecodeError: 行格式异常，需回退到完整解析
+    """
+    group_id = row.get(_GROUP_ID_KEY)
+    if type(group_id) is not int:
+        raise FastDecodeError(f"群号格式异常: {group_id!r}")
+    if group_ids is not None and group_id not in group_ids:
+        return None
+
+    raw_message = row.get(_MESSAGE_KEY)
+    if not raw_message:
+        return None
+
+    time_value = row.get(_TIME_KEY)
+    if not time_value:
+        time_ = None
+    elif type(time_value) is int and 0 < time_value <= MAX_SECOND_TIMESTAMP:
+        time_ = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time_value))
+    else:
+        raise FastDecodeError(f"时间格式异常: {time_value!r}")
+
+    name = row.get(_NAME_KEY)
+    user_id = row.get(_USER_ID_KEY)
+    if not (name is None or type(name) is str) or not (user_id is None or type(user_id) is int):
+        raise FastDecodeError("昵称或用户ID格式异常")
+
+    try:
+        if mode == "json":
+            if type(raw_message) is not str:
+                raise FastDecodeError("消息内容不是 base64 字符串")
+            raw_message = base64.decodebytes(raw_message.encode())
+        message = TextMessage()
+        message.ParseFromString(raw_message)
+    except (binascii.Error, DecodeError, TypeError) as e:
+        raise FastDecodeError(f"消息内容解析失败: {e}") from e
+
+    texts = [msg.messageText for msg in message.messages if msg.messageText]
+    if not texts:
+        return None
+    return GroupMsgRecord(group_id, time_, name, user_id, texts)
@@ -0,0 +1,77 @@
+import json
+from collections.abc import Iterator
+from typing import Any
+
+READ_SIZE = 1 << 20
+"""每次从文件读取的字符数"""
+
+_WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(path: str, read_size: int = READ_SIZE) -> Iterator[Any]:
+    """
+    逐个元素读取顶层为数组的 JSON 文件
+
+    只在内存中保留当前读取缓冲区和正在解析的元素，内存占用与文件大小无关
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        eof = False
+
+        def fill() -> bool:
+            """读取更多内容到缓冲区，并丢弃已解析部分；到达文件末尾时返回 False"""
+            nonlocal buffer, pos, eof
+            if eof:
+                return False
+            chunk = f.read(read_size)
+            if not chunk:
+                eof = True
+                return False
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            return True
+
+        def next_char() -> str:
+            """跳过空白，返回下一个非空白字符（不消耗），文件结束时返回空字符串"""
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                    pos += 1
+                if pos < len(buffer):
+                    return buffer[pos]
+                if not fill():
+                    return ""
+
+        if next_char() != "[":
+            raise ValueError(f"{path} 不是 JSON 数组")
+        pos += 1
+
+        if next_char() == "]":
+            return
+        while True:
+            if not next_char():
+                raise ValueError(f"{path} 意外结束")
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # 元素可能被缓冲区截断，读取更多内容后重试
+                    if fill():
+                        continue
+                    raise
+                # 数字等元素恰好在缓冲区末尾结束时，可能还未读完整
+                if end == len(buffer) and fill():
+                    continue
+                break
+            pos = end
+            yield value
+
+            separator = next_char()
+            if separator == ",":
+                pos += 1
+            elif separator == "]":
+                return
+            else:
+                raise ValueError(f"{path} 数组元素之间缺少分隔符")
@@ -1,13 +1,29 @@
+import argparse
 import csv
 import json
-from collections.abc import Iterable
-from typing import Literal
+import os
+import sys
+import textwrap
+from collections import deque
+from collections.abc import Collection, Iterable, Iterator
+from datetime import datetime
+from itertools import islice
+from multiprocessing import Pool, freeze_support
+from typing import Literal, Optional
 
 import message_pb2
+from fast_decode import FastDecodeError, decode_row
+from json_stream import iter_json_array
 from models import NTGroupMsgModel
+from sqlite_source import iter_rows_from_sqlite
+from watermark import Watermarks
+
+# 仓库根目录下的公共模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stage_profiler import StageProfiler
 
 GROUP_ID = 123456789
-"""目标群聊ID"""
+"""目标群聊ID，可通过 --group-id 参数指定多个群聊"""
 
 JSON_PATH = "group_msg_table.json"
 """原始数据路径"""
@@ -16,11 +32,36 @@ CSV_WRITE_FILE = "group_msg.csv"
 """解析后数据生成路径"""
 JSON_WRITE_FILE = "group_msg.json"
 """解析后数据生成路径"""
+PARQUET_WRITE_FILE = "group_msg.parquet"
+"""解析后数据生成路径（Parquet 格式，需安装 pyarrow）"""
+WATERMARK_SUFFIX = ".watermark.json"
+"""各群聊已解析到的最新消息时间保存在 JSON 输出文件旁（如 group_msg.watermark.json），用于增量解析"""
+
+DECODE_CHUNK_SIZE = 2000
+"""多进程解析时每个任务包含的原始行数"""
+
+PROFILE_REPORT_FILE = "qq_nt_parse_profile.json"
+"""性能报告默认输出路径"""
+
+QUIET = False
+"""是否不打印每条消息的解析结果，打印大量消息本身就会占用相当多的时间"""
+
+profiler = StageProfiler("qq_nt_parse", enabled=False)
+"""各阶段性能统计，通过 --profile 参数开启"""
 
 
-def load_group_msg(group_msg: NTGroupMsgModel, mode: Literal["csv", "json"]):
+def parse_message(group_msg: NTGroupMsgModel, mode: Literal["csv", "json", "sqlite"]) -> message_pb2.Message:
     message = message_pb2.Message()
-    message.ParseFromString(group_msg.message_from_base64 if mode == "json" else group_msg.message_from_unicode)
+    if mode == "json":
+        message.ParseFromString(group_msg.message_from_base64)
+    elif mode == "csv":
+        message.ParseFromString(group_msg.message_from_unicode)
+    else:
+        message.ParseFromString(group_msg.raw_message)
+    return message
+
+
+def print_group_msg(group_msg: NTGroupMsgModel, message: message_pb2.Message):
     print(
         f"{group_msg.time}, "
         f"{group_msg.user_id}, "
@@ -28,34 +69,400 @@ def load_group_msg(group_msg: NTGroupMsgModel, mode: Literal["csv", "json"]):
         f"{group_msg.name}, "
         f"{message}"
     )
+
+
+def dump_group_msg(group_msg: NTGroupMsgModel, message: message_pb2.Message) -> dict:
     group_msg_dict = group_msg.model_dump(mode="json", exclude={"raw_message"})
     group_msg_dict["message"] = [msg.messageText for msg in filter(lambda x: x.messageText, message.messages)]
+    return group_msg_dict
+
+
+def load_group_msg(group_msg: NTGroupMsgModel, mode: Literal["csv", "json", "sqlite"]):
+    message = profiler.timed("protobuf", parse_message)(group_msg, mode)
+    if not QUIET:
+        profiler.timed("print", print_group_msg)(group_msg, message)
+    group_msg_dict = profiler.timed("dump", dump_group_msg)(group_msg, message)
     return group_msg_dict if group_msg_dict["message"] else None
 
 
-def load_from_json():
-    with open(JSON_PATH, encoding="utf-8") as f:
-        rows = json.load(f)
-        rows_filter: Iterable[NTGroupMsgModel] = filter(
-            lambda x: x.group_id == GROUP_ID and x.raw_message,
-            map(NTGroupMsgModel.model_validate, rows)
-        )
-        group_msg_list = list(
-            filter(
-                lambda x: x,
-                map(
-                    lambda x: load_group_msg(x, "json"),
-                    rows_filter
-                )
+class GroupMsgWriter:
+    """
+    逐条写入解析结果（JSON 数组、CSV 以及可选的 Parquet），无需在内存中保留全部消息
+
+    追加模式下在已有文件末尾继续写入，Parquet 则写入新的分片文件 ``<文件名>.part<序号>.parquet``
+    """
+
+    def __init__(self, json_path: str, csv_path: str, parquet_path: Optional[str] = None, append: bool = False):
+        self.count = 0
+        if append and os.path.exists(json_path):
+            self.json_file = open(json_path, "r+b")
+            self.count = self._seek_json_end()
+        else:
+            self.json_file = open(json_path, "wb")
+        self.csv_file = open(csv_path, "a" if append else "w", newline="", encoding="utf-8")
+        self.csv_writer = csv.writer(self.csv_file)
+        self.parquet_writer = None
+        if parquet_path:
+            from parquet_output import ParquetGroupMsgWriter, next_part_path, remove_part_files
+            if append and os.path.exists(parquet_path):
+                self.parquet_writer = ParquetGroupMsgWriter(next_part_path(parquet_path), keep_empty=False)
+            else:
+                remove_part_files(parquet_path)
+                self.parquet_writer = ParquetGroupMsgWriter(parquet_path)
+
+    def _seek_json_end(self) -> int:
+        """定位到已有 JSON 数组的最后一个元素之后并截断结尾的 ``]``，返回已有元素数是否大于 0（1 或 0）"""
+        size = self.json_file.seek(0, os.SEEK_END)
+        start = max(0, size - 64)
+        self.json_file.seek(start)
+        tail = self.json_file.read().rstrip()
+        if not tail.endswith(b"]"):
+            raise ValueError(f"{self.json_file.name} 不是完整的 JSON 数组，无法追加")
+        content_end = start + len(tail[:-1].rstrip())
+        self.json_file.seek(content_end - 1)
+        has_items = self.json_file.read(1) != b"["
+        self.json_file.seek(content_end if has_items else 0)
+        self.json_file.truncate()
+        return int(has_items)
+
+    def write(self, group_msg_dict: dict):
+        # 与 json.dumps(list, indent=4) 的输出保持一致
+        item = textwrap.indent(json.dumps(group_msg_dict, indent=4, ensure_ascii=False), " " * 4)
+        self.json_file.write((("[\n" if not self.count else ",\n") + item).encode("utf-8"))
+        self.csv_writer.writerow(group_msg_dict.values())
+        if self.parquet_writer:
+            self.parquet_writer.write(group_msg_dict)
+        self.count += 1
+
+    def close(self):
+        self.json_file.write(b"\n]" if self.count else b"[]")
+        self.json_file.close()
+        self.csv_file.close()
+        if self.parquet_writer:
+            self.parquet_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class GroupMsgRouter:
+    """
+    按群号将解析结果分发到各自的输出文件
+
+    不分片时所有消息写入同一组文件；分片时每个群聊写入 ``<文件名>_<群号>.<扩展名>``
+    """
+
+    def __init__(
+            self,
+            json_path: str,
+            csv_path: str,
+            sharded: bool,
+            parquet_path: Optional[str] = None,
+            append: bool = False
+    ):
+        self.json_path = json_path
+        self.csv_path = csv_path
+        self.parquet_path = parquet_path
+        self.sharded = sharded
+        self.append = append
+        self.writers: dict[Optional[int], GroupMsgWriter] = {}
+        if not sharded:
+            self.writers[None] = GroupMsgWriter(json_path, csv_path, parquet_path, append)
+
+    def write(self, group_msg_dict: dict):
+        if not self.sharded:
+            self.writers[None].write(group_msg_dict)
+            return
+        group_id = group_msg_dict["group_id"]
+        if (writer := self.writers.get(group_id)) is None:
+            writer = self.writers[group_id] = GroupMsgWriter(
+                shard_path(self.json_path, group_id),
+                shard_path(self.csv_path, group_id),
+                shard_path(self.parquet_path, group_id) if self.parquet_path else None,
+                self.append
             )
+        writer.write(group_msg_dict)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def shard_path(path: str, group_id: int) -> str:
+    """生成群聊对应的分片文件路径"""
+    root, ext = os.path.splitext(path)
+    return f"{root}_{group_id}{ext}"
+
+
+def fast_load_group_msg(
+        row: dict,
+        mode: Literal["json", "sqlite"],
+        group_ids: Optional[Collection[int]]
+) -> Optional[dict]:
+    """快速解析一行原始数据，行格式异常时回退到完整的 pydantic/protobuf 解析"""
+    try:
+        record = profiler.timed("fast_decode", decode_row)(row, mode, group_ids)
+    except FastDecodeError:
+        group_msg = profiler.timed("validate", NTGroupMsgModel.model_validate)(row)
+        if (group_ids is None or group_msg.group_id in group_ids) and group_msg.raw_message:
+            return load_group_msg(group_msg, mode)
+        return None
+    if record is None:
+        return None
+    if not QUIET:
+        print(f"{record.time}, {record.user_id}, {record.group_id}, {record.name}, {record.message}")
+    return record.to_dict()
+
+
+def iter_group_msg(
+        rows: Iterable[dict],
+        mode: Literal["json", "sqlite"] = "json",
+        group_ids: Optional[Collection[int]] = frozenset({GROUP_ID}),
+        fast: bool = False
+) -> Iterator[dict]:
+    """
+    筛选目标群聊的消息并逐条解析
+
+    :param group_ids: 目标群号集合，为 None 时解析所有群聊
+    :param fast: 是否使用快速解析（跳过 pydantic 校验，只解析消息中的文字）
+    """
+    if fast:
+        return filter(None, (fast_load_group_msg(row, mode, group_ids) for row in rows))
+    rows_filter: Iterable[NTGroupMsgModel] = filter(
+        lambda x: (group_ids is None or x.group_id in group_ids) and x.raw_message,
+        map(profiler.timed("validate", NTGroupMsgModel.model_validate), rows)
+    )
+    return filter(
+        lambda x: x,
+        map(
+            lambda x: load_group_msg(x, mode),
+            rows_filter
         )
+    )
+
+
+def decode_rows(
+        rows: list[dict],
+        mode: Literal["json", "sqlite"],
+        group_ids: Optional[Collection[int]],
+        fast: bool
+) -> tuple[list[dict], dict]:
+    """解析一批原始行，供子进程调用，同时返回子进程中的性能统计"""
+    return list(iter_group_msg(rows, mode, group_ids, fast)), profiler.pop_stats()
+
+
+def init_worker(quiet: bool, profile: bool):
+    """子进程初始化：同步主进程的输出和统计设置"""
+    global QUIET
+    QUIET = quiet
+    profiler.enabled = profile
+
+
+def iter_group_msg_parallel(
+        rows: Iterable[dict],
+        workers: int,
+        mode: Literal["json", "sqlite"] = "json",
+        group_ids: Optional[Collection[int]] = frozenset({GROUP_ID}),
+        fast: bool = False
+) -> Iterator[dict]:
+    """
+    多进程解析消息，结果按原始顺序返回
+
+    同时提交的任务数有上限，避免流式读取时原始行全部堆积在任务队列中
+    """
+    row_iter = iter(rows)
+    chunks = iter(lambda: list(islice(row_iter, DECODE_CHUNK_SIZE)), [])
+    pending = deque()
+    with Pool(workers, initializer=init_worker, initargs=(QUIET, profiler.enabled)) as pool:
+        for chunk in chunks:
+            pending.append(pool.apply_async(decode_rows, (chunk, mode, group_ids, fast)))
+            if len(pending) >= workers * 2:
+                yield from collect_decoded(pending.popleft().get())
+        while pending:
+            yield from collect_decoded(pending.popleft().get())
+
+
+def collect_decoded(result: tuple[list[dict], dict]) -> list[dict]:
+    """合并子进程的性能统计，返回解析结果"""
+    group_msg_list, stats = result
+    profiler.merge(stats)
+    return group_msg_list
+
+
+def load_from_json(
+        stream: bool = False,
+        workers: int = 1,
+        group_ids: Optional[Collection[int]] = frozenset({GROUP_ID}),
+        fast: bool = False,
+        parquet: bool = False,
+        incremental: bool = False
+):
+    """
+    解析 JSON 导出文件
+
+    :param stream: 是否逐条读取导出文件，开启后内存占用不随文件大小增长
+    :param workers: 解析进程数，大于 1 时启用多进程解析
+    :param group_ids: 目标群号集合，为 None 时解析所有群聊；多个群聊时一次扫描写入各自的分片文件
+    :param fast: 是否使用快速解析
+    :param parquet: 是否同时输出 Parquet 文件
+    :param incremental: 是否增量解析，只解析上次运行之后的新消息并追加到已有输出文件
+    """
+    if stream:
+        rows = iter_json_array(JSON_PATH)
+    else:
+        with profiler.stage("json_load"), open(JSON_PATH, encoding="utf-8") as f:
+            rows = json.load(f)
+        profiler.count("json_load", len(rows))
+
+    watermarks = open_watermarks(group_ids, parquet, incremental)
+    if watermarks.incremental:
+        rows = watermarks.filter_rows(rows)
+    write_group_msg(rows, "json", workers, group_ids, fast, parquet, watermarks)
+
 
-    with open(JSON_WRITE_FILE, "w", encoding="utf-8") as f:
-        f.write(json.dumps(group_msg_list, indent=4, ensure_ascii=False))
+def load_from_sqlite(
+        path: str,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        workers: int = 1,
+        group_ids: Optional[Collection[int]] = frozenset({GROUP_ID}),
+        fast: bool = False,
+        parquet: bool = False,
+        incremental: bool = False
+):
+    """
+    直接从已解密的 QQNT 数据库解析消息，无需先导出为 JSON
+
+    :param start_time: 起始时间（包含）
+    :param end_time: 结束时间（不包含）
+    :param workers: 解析进程数，大于 1 时启用多进程解析
+    :param group_ids: 目标群号集合，为 None 时解析所有群聊；多个群聊时一次扫描写入各自的分片文件
+    :param fast: 是否使用快速解析
+    :param parquet: 是否同时输出 Parquet 文件
+    :param incremental: 是否增量解析，只解析上次运行之后的新消息并追加到已有输出文件
+    """
+    watermarks = open_watermarks(group_ids, parquet, incremental)
+    if (watermark_time := watermarks.start_time(group_ids)) is not None:
+        if start_time is None or start_time.timestamp() < watermark_time:
+            start_time = datetime.fromtimestamp(watermark_time)
+    rows = iter_rows_from_sqlite(path, group_ids, start_time, end_time)
+    if watermarks.incremental:
+        rows = watermarks.filter_rows(rows)
+    write_group_msg(rows, "sqlite", workers, group_ids, fast, parquet, watermarks)
+
+
+def is_sharded(group_ids: Optional[Collection[int]]) -> bool:
+    """解析所有群聊或多个群聊时按群号分片输出"""
+    return group_ids is None or len(group_ids) > 1
+
+
+def open_watermarks(group_ids: Optional[Collection[int]], parquet: bool, incremental: bool) -> Watermarks:
+    """读取当前输出目标的解析水位，输出文件或模式与上次不同时不使用已有水位"""
+    target = {
+        "json": os.path.abspath(JSON_WRITE_FILE),
+        "csv": os.path.abspath(CSV_WRITE_FILE),
+        "parquet": os.path.abspath(PARQUET_WRITE_FILE) if parquet else None,
+        "sharded": is_sharded(group_ids)
+    }
+    return Watermarks(os.path.splitext(JSON_WRITE_FILE)[0] + WATERMARK_SUFFIX, incremental, target)
+
+
+def write_group_msg(
+        rows: Iterable[dict],
+        mode: Literal["json", "sqlite"],
+        workers: int,
+        group_ids: Optional[Collection[int]],
+        fast: bool = False,
+        parquet: bool = False,
+        watermarks: Optional[Watermarks] = None
+):
+    """
+    解析原始行并写入 JSON 和 CSV（以及 Parquet）文件，解析多个群聊时按群号分片写入
+
+    :param watermarks: 解析水位，增量模式下跳过已写入的消息并追加到已有文件，结束后保存新的水位
+    """
+    rows = profiler.timed_iter("read", rows)
+    if workers > 1:
+        group_msg_iter = iter_group_msg_parallel(rows, workers, mode, group_ids, fast)
+    else:
+        group_msg_iter = iter_group_msg(rows, mode, group_ids, fast)
+    sharded = is_sharded(group_ids)
+    parquet_path = PARQUET_WRITE_FILE if parquet else None
+    append = watermarks is not None and watermarks.incremental
+    with GroupMsgRouter(JSON_WRITE_FILE, CSV_WRITE_FILE, sharded, parquet_path, append) as router:
+        write = profiler.timed("write", router.write)
+        for group_msg_dict in group_msg_iter:
+            if watermarks is None:
+                write(group_msg_dict)
+            elif watermarks.is_new(group_msg_dict):
+                write(group_msg_dict)
+                watermarks.update(group_msg_dict)
+    if watermarks is not None:
+        watermarks.save()
+
+
+def parse_group_ids(values: list[str]) -> Optional[frozenset[int]]:
+    """解析 --group-id 参数，包含 all 时返回 None 表示所有群聊"""
+    if "all" in values:
+        return None
+    return frozenset(map(int, values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QQNT 群聊记录解析工具")
+    parser.add_argument("--group-id", nargs="+", default=[str(GROUP_ID)],
+                        help="目标群号，可指定多个，或指定 all 解析所有群聊；多个群聊时按群号分片输出")
+    parser.add_argument("--stream", action="store_true",
+                        help="流式读取 JSON 导出文件，内存占用恒定，适合大文件")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="解析进程数（默认1），多核机器上可设为 CPU 核心数；单核时多进程反而更慢")
+    parser.add_argument("--fast", action="store_true",
+                        help="快速解析：跳过 pydantic 校验，只解析消息中的文字，异常行自动回退到完整解析")
+    parser.add_argument("--parquet", action="store_true",
+                        help="同时输出 Parquet 文件（需安装 pyarrow），聊天内容为字符串列表，时间为秒级时间戳")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量解析：只解析上次运行之后的新消息，并追加到已有输出文件")
+    parser.add_argument("--quiet", action="store_true", help="不打印每条消息的解析结果")
+    parser.add_argument("--profile", nargs="?", const=PROFILE_REPORT_FILE, metavar="PATH",
+                        help=f"统计各阶段耗时、处理速度和内存峰值，并保存 JSON 报告（默认 {PROFILE_REPORT_FILE}）")
+    parser.add_argument("--sqlite", metavar="PATH",
+                        help="直接读取已解密的数据库文件，而不是 JSON 导出文件")
+    parser.add_argument("--start-time", type=datetime.fromisoformat,
+                        help="起始时间（包含），如 2024-01-01T00:00:00，仅用于 --sqlite")
+    parser.add_argument("--end-time", type=datetime.fromisoformat,
+                        help="结束时间（不包含），仅用于 --sqlite")
+    args = parser.parse_args()
+
+    global QUIET
+    QUIET = args.quiet
+    profiler.enabled = args.profile is not None
+
+    group_ids = parse_group_ids(args.group_id)
+    if args.sqlite:
+        load_from_sqlite(
+            args.sqlite, args.start_time, args.end_time,
+            workers=args.workers, group_ids=group_ids, fast=args.fast, parquet=args.parquet,
+            incremental=args.incremental
+        )
+    else:
+        load_from_json(
+            stream=args.stream, workers=args.workers, group_ids=group_ids, fast=args.fast, parquet=args.parquet,
+            incremental=args.incremental
+        )
 
-    with open(CSV_WRITE_FILE, "w", newline="", encoding="utf-8") as f:
-        csv_writer = csv.writer(f)
-        csv_writer.writerows(map(lambda x: x.values(), group_msg_list))
+    if args.profile:
+        profiler.save(args.profile)
 
 
-load_from_json()
+if __name__ == "__main__":
+    freeze_support()
+    main()
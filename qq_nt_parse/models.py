@@ -28,3 +28,8 @@ class NTGroupMsgModel(BaseModel):
     @cached_property
     def message_from_unicode(self) -> bytes:
         return self.raw_message.decode().encode()
+
+
+def to_timestamp(value: Optional[str]) -> Optional[int]:
+    """将解析结果中的 ISO 时间转换为秒级时间戳"""
+    return int(datetime.fromisoformat(value).timestamp()) if value else None
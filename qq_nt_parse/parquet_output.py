@@ -0,0 +1,75 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from models import to_timestamp
+
+PARQUET_BATCH_SIZE = 10000
+"""每次写入 Parquet 文件的行数"""
+
+GROUP_MSG_SCHEMA = pa.schema([
+    ("group_id", pa.int64()),
+    ("time", pa.int64()),
+    ("name", pa.string()),
+    ("user_id", pa.int64()),
+    ("message", pa.list_(pa.string())),
+])
+"""Parquet 输出格式：时间为秒级时间戳，消息内容为字符串列表"""
+
+
+class ParquetGroupMsgWriter:
+    """
+    分批写入 Parquet 文件，内存中最多保留一批数据
+
+    :param keep_empty: 没有写入任何数据时是否仍生成空文件
+    """
+
+    def __init__(self, path: str, keep_empty: bool = True):
+        self.path = path
+        self.keep_empty = keep_empty
+        self.writer = None
+        self.columns: dict[str, list] = {name: [] for name in GROUP_MSG_SCHEMA.names}
+
+    def write(self, group_msg_dict: dict):
+        for name, column in self.columns.items():
+            value = group_msg_dict[name]
+            column.append(to_timestamp(value) if name == "time" else value)
+        if len(self.columns["group_id"]) >= PARQUET_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.columns["group_id"]:
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, GROUP_MSG_SCHEMA)
+            self.writer.write_table(pa.table(self.columns, schema=GROUP_MSG_SCHEMA))
+            self.columns = {name: [] for name in GROUP_MSG_SCHEMA.names}
+
+    def close(self):
+        self.flush()
+        if self.writer is None and self.keep_empty:
+            self.writer = pq.ParquetWriter(self.path, GROUP_MSG_SCHEMA)
+        if self.writer is not None:
+            self.writer.close()
+
+
+def part_path(path: str, part: int) -> str:
+    """增量解析追加的分片文件路径：``<文件名>.part<序号>.parquet``"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.part{part}{ext}"
+
+
+def next_part_path(path: str) -> str:
+    """追加写入时使用的下一个分片文件路径"""
+    part = 1
+    while os.path.exists(part_path(path, part)):
+        part += 1
+    return part_path(path, part)
+
+
+def remove_part_files(path: str):
+    """删除之前增量解析追加的分片文件，重写主文件时调用，否则读取时这些消息会重复"""
+    part = 1
+    while os.path.exists(current := part_path(path, part)):
+        os.remove(current)
+        part += 1
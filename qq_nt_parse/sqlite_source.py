@@ -0,0 +1,58 @@
+import sqlite3
+from collections.abc import Collection, Iterator
+from datetime import datetime
+from typing import Optional
+
+from enums import NTGroupMsgFieldEnum
+
+TABLE_NAME = "group_msg_table"
+"""群聊消息表名"""
+
+FETCH_SIZE = 5000
+"""每次从数据库游标读取的行数"""
+
+
+def iter_rows_from_sqlite(
+        path: str,
+        group_ids: Optional[Collection[int]],
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        fetch_size: int = FETCH_SIZE
+) -> Iterator[dict]:
+    """
+    直接从已解密的 QQNT 数据库读取群聊消息
+
+    只查询 ``NTGroupMsgFieldEnum`` 中的字段，群号和时间范围在 SQL 中过滤，
+    返回的行与 JSON 导出文件中的行格式一致（以字段编号字符串为键），消息内容为原始字节
+
+    :param group_ids: 目标群号集合，为 None 时读取所有群聊
+    :param start_time: 起始时间（包含）
+    :param end_time: 结束时间（不包含）
+    """
+    columns = [str(field.value) for field in NTGroupMsgFieldEnum]
+    conditions = []
+    params: list = []
+    if group_ids is not None:
+        conditions.append(
+            f'"{NTGroupMsgFieldEnum.GROUP_ID.value}" IN ({", ".join("?" * len(group_ids))})'
+        )
+        params.extend(group_ids)
+    if start_time is not None:
+        conditions.append(f'"{NTGroupMsgFieldEnum.TIME.value}" >= ?')
+        params.append(int(start_time.timestamp()))
+    if end_time is not None:
+        conditions.append(f'"{NTGroupMsgFieldEnum.TIME.value}" < ?')
+        params.append(int(end_time.timestamp()))
+    select = ", ".join(f'"{column}"' for column in columns)
+    sql = f"SELECT {select} FROM {TABLE_NAME}"
+    if conditions:
+        sql += f" WHERE {' AND '.join(conditions)}"
+
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        cursor = conn.execute(sql, params)
+        while batch := cursor.fetchmany(fetch_size):
+            for row in batch:
+                yield dict(zip(columns, row))
+    finally:
+        conn.close()
@@ -0,0 +1,96 @@
+import json
+import os
+from collections.abc import Collection, Iterable, Iterator
+from typing import Optional
+
+from enums import NTGroupMsgFieldEnum
+from models import to_timestamp
+
+_GROUP_ID_KEY = str(NTGroupMsgFieldEnum.GROUP_ID.value)
+_TIME_KEY = str(NTGroupMsgFieldEnum.TIME.value)
+
+
+class Watermarks:
+    """
+    各群聊已解析到的最新消息时间，保存在输出文件旁，用于增量解析
+
+    每个群聊记录最新消息的时间戳，以及该秒内已写入的消息，
+    增量解析时只解析不早于该时间的行，并跳过该秒内已写入的消息。
+    水位只对写入它的输出目标（输出文件、是否分片、是否输出 Parquet）有效，
+    输出目标与上次不同时忽略已有水位，增量解析改为全量解析，以免跳过从未写入当前输出文件的消息
+    """
+
+    def __init__(self, path: str, incremental: bool, target: Optional[dict] = None):
+        """
+        :param target: 当前的输出目标，与水位一同保存
+        """
+        self.path = path
+        self.target = target
+        self.marks: dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("target") == target:
+                self.marks = saved["groups"]
+            elif incremental:
+                print(f"输出文件或模式与 {path} 记录的不同，忽略已有水位，改为全量解析")
+                incremental = False
+        self.incremental = incremental
+        self.touched: set[str] = set()
+
+    def start_time(self, group_ids: Optional[Collection[int]]) -> Optional[int]:
+        """目标群聊中最早的水位时间，所有目标群聊都有水位时才返回，可用于数据库查询条件"""
+        if not self.incremental or group_ids is None:
+            return None
+        times = [self.marks.get(str(group_id), {}).get("time") for group_id in group_ids]
+        if not times or None in times:
+            return None
+        return min(times)
+
+    def filter_rows(self, rows: Iterable[dict]) -> Iterator[dict]:
+        """解析前跳过早于水位时间的原始行"""
+        for row in rows:
+            mark = self.marks.get(str(row.get(_GROUP_ID_KEY)))
+            row_time = row.get(_TIME_KEY)
+            if mark is not None and type(row_time) is int and row_time < mark["time"]:
+                continue
+            yield row
+
+    def is_new(self, group_msg_dict: dict) -> bool:
+        """解析后判断消息是否未写入过"""
+        if not self.incremental:
+            return True
+        mark = self.marks.get(str(group_msg_dict["group_id"]))
+        if mark is None:
+            return True
+        timestamp = to_timestamp(group_msg_dict["time"])
+        if timestamp is None or timestamp < mark["time"]:
+            return False
+        if timestamp == mark["time"]:
+            return self._key(group_msg_dict) not in mark["written"]
+        return True
+
+    def update(self, group_msg_dict: dict):
+        """记录已写入的消息"""
+        timestamp = to_timestamp(group_msg_dict["time"])
+        if timestamp is None:
+            return
+        group_key = str(group_msg_dict["group_id"])
+        mark = self.marks.get(group_key)
+        # 全量解析时输出文件会被重写，各群聊的水位从头开始记录
+        if group_key not in self.touched:
+            self.touched.add(group_key)
+            if not self.incremental:
+                mark = None
+        if mark is None or timestamp > mark["time"]:
+            self.marks[group_key] = {"time": timestamp, "written": [self._key(group_msg_dict)]}
+        elif timestamp == mark["time"]:
+            mark["written"].append(self._key(group_msg_dict))
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"target": self.target, "groups": self.marks}, f, ensure_ascii=False, indent=4)
+
+    @staticmethod
+    def _key(group_msg_dict: dict) -> str:
+        return json.dumps(group_msg_dict, ensure_ascii=False, sort_keys=True)
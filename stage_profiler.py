@@ -0,0 +1,133 @@
+import json
+import sys
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_memory_mb() -> Optional[float]:
+    """当前进程的内存峰值（MB），无法获取时返回 None"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 单位为字节，Linux 为 KB
+        return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory_info = psutil.Process().memory_info()
+    return getattr(memory_info, "peak_wset", memory_info.rss) / (1 << 20)
+
+
+class StageProfiler:
+    """
+    统计各处理阶段的耗时、处理行数和内存峰值，结束时输出 JSON 报告
+
+    未启用时各方法不做任何统计，可直接保留在处理流程中
+    """
+
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self.start_time = time.perf_counter()
+        self.stages: dict[str, dict] = {}
+
+    def add(self, stage: str, seconds: float, rows: int = 0):
+        """累加某阶段的耗时和处理行数"""
+        if not self.enabled:
+            return
+        record = self.stages.setdefault(stage, {"seconds": 0.0, "rows": 0, "peak_memory_mb": None})
+        record["seconds"] += seconds
+        record["rows"] += rows
+
+    @contextmanager
+    def stage(self, stage: str, rows: int = 0):
+        """统计一段代码的耗时，结束时记录内存峰值"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, rows)
+            self.stages[stage]["peak_memory_mb"] = peak_memory_mb()
+
+    def count(self, stage: str, rows: int):
+        """补充记录某阶段的处理行数（行数在阶段结束后才能确定时使用）"""
+        if self.enabled:
+            self.add(stage, 0.0, rows)
+
+    def timed(self, stage: str, func: Callable) -> Callable:
+        """包装逐行调用的函数，每次调用计为一行"""
+        if not self.enabled:
+            return func
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start, 1)
+
+        return wrapper
+
+    def timed_iter(self, stage: str, iterable: Iterable) -> Iterator:
+        """包装逐行读取的迭代器，统计读取每一行的耗时"""
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - start)
+                return
+            self.add(stage, time.perf_counter() - start, 1)
+            yield item
+
+    def pop_stats(self) -> dict[str, dict]:
+        """取出并清空已有统计，用于从子进程返回统计结果"""
+        stages, self.stages = self.stages, {}
+        return stages
+
+    def merge(self, stages: dict[str, dict]):
+        """合并子进程返回的统计结果"""
+        for stage, record in stages.items():
+            self.add(stage, record["seconds"], record["rows"])
+
+    def report(self) -> dict:
+        total = time.perf_counter() - self.start_time
+        return {
+            "script": self.name,
+            "total_seconds": round(total, 3),
+            "peak_memory_mb": peak_memory_mb(),
+            "stages": {
+                stage: {
+                    "seconds": round(record["seconds"], 3),
+                    "rows": record["rows"],
+                    "rows_per_second": round(record["rows"] / record["seconds"], 1) if record["rows"] and record["seconds"] else None,
+                    "peak_memory_mb": record["peak_memory_mb"],
+                } for stage, record in self.stages.items()
+            }
+        }
+
+    def save(self, path: str):
+        """打印各阶段统计并保存 JSON 报告"""
+        if not self.enabled:
+            return
+        report = self.report()
+        print(f"\n{'=' * 40}")
+        print(f"性能统计（总耗时 {report['total_seconds']}秒，内存峰值 {report['peak_memory_mb']}MB）：")
+        for stage, record in report["stages"].items():
+            print(f"{stage}: {record['seconds']}秒，{record['rows']}行，{record['rows_per_second']}行/秒")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,203 @@
+import argparse
+from abc import ABC, abstractmethod
+from typing import Optional
+
+STREAM_TOKEN_RATIO = 3
+"""未指定 token 上限时，按预计输出 token 数的该倍数限制每次请求生成的 token 数"""
+STREAM_TOKEN_MARGIN = 1024
+"""未指定 token 上限时额外允许的 token 数（供思考内容等使用）"""
+
+_THINK_START = "<think>"
+_THINK_END = "</think>"
+_FENCE = "```"
+_LITERAL_CHARS = frozenset("0123456789+-.eEtruefalsnoTFN")  # 数字和 true、false、null 以及 Python 的 True、False、None 中的字符
+_CLOSING = {"]": "[", "}": "{"}
+
+
+class StreamAborted(ValueError):
+    """流式生成的内容不符合要求或超出限制，已提前中止"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"生成内容不符合要求，已提前中止: {reason}")
+        self.reason = reason
+
+
+class OutputValidator(ABC):
+    """
+    逐段校验流式生成的内容
+
+    开头的 ``<think>...</think>`` 思考内容和 Markdown 代码块标记会被跳过，其余内容交给 :meth:`_feed_content` 校验。
+    每个请求使用一个新的实例
+    """
+
+    def __init__(self):
+        self._lead = ""
+        self._in_think = False
+        self._started = False
+
+    def feed(self, text: str) -> bool:
+        """
+        校验新生成的一段内容，内容已不可能符合要求时抛出 :class:`StreamAborted`
+
+        :return: 内容已经完整，无需再继续生成时返回 True
+        """
+        if self._started:
+            return self._feed_content(text)
+        self._lead += text
+        while True:
+            if self._in_think:
+                end = self._lead.find(_THINK_END)
+                if end == -1:
+                    # 只需保留可能是结束标签一部分的结尾
+                    self._lead = self._lead[-len(_THINK_END):]
+                    return False
+                self._lead = self._lead[end + len(_THINK_END):]
+                self._in_think = False
+            lead = self._lead.lstrip()
+            if not lead:
+                return False
+            if lead.startswith(_THINK_START):
+                self._lead = lead[len(_THINK_START):]
+                self._in_think = True
+            elif lead.startswith(_FENCE):
+                # 跳过整行 ```json
+                newline = lead.find("\n")
+                if newline == -1:
+                    return False
+                self._lead = lead[newline + 1:]
+            elif _THINK_START.startswith(lead) or _FENCE.startswith(lead):
+                return False
+            else:
+                self._lead = ""
+                self._started = True
+                return self._feed_content(lead)
+
+    @abstractmethod
+    def _feed_content(self, text: str) -> bool:
+        """校验跳过开头的思考内容等之后的内容，返回值同 :meth:`feed`"""
+
+
+class JsonListValidator(OutputValidator):
+    """
+    校验内容是否为 JSON 列表：只检查括号、字符串和条数等结构，列表结束时即认为内容完整
+
+    只在 :func:`llm_output.parse_output` 同样无法修复时中止，因此与其修复规则保持一致：
+    列表前的说明文字和列表后的内容被忽略，单引号字符串、字符串中的换行、尾随逗号和 ``None``、``True`` 等
+    Python 字面量都是允许的；元素本身的类型不检查，由调用方解析时修复或逐条校验
+
+    :param item_count: 列表应有的条数，超出时立即中止，结束时不等也中止
+    :param max_items: 列表最多的条数
+    """
+
+    def __init__(self, item_count: Optional[int] = None, max_items: Optional[int] = None):
+        super().__init__()
+        self.item_count = item_count
+        self.max_items = item_count if max_items is None else max_items
+        self.items = 0
+        """已开始生成的元素数"""
+        self._stack: list[str] = []
+        self._quote: Optional[str] = None
+        self._escape = False
+        self._expect_item = False
+
+    def _feed_content(self, text: str) -> bool:
+        for char in text:
+            if self._quote is not None:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == self._quote:
+                    self._quote = None
+                continue
+            if not self._stack:
+                # 列表之前的说明文字
+                if char == "[":
+                    self._stack.append(char)
+                    self._expect_item = True
+                continue
+            if char.isspace() or char == "`":
+                continue
+            if len(self._stack) == 1 and self._expect_item and char not in "],":
+                self._expect_item = False
+                self.items += 1
+                if self.max_items is not None and self.items > self.max_items:
+                    raise StreamAborted(f"列表条数超过 {self.max_items}")
+            if char in "\"'":
+                self._quote = char
+            elif char in "[{":
+                self._stack.append(char)
+            elif char in "]}":
+                if self._stack.pop() != _CLOSING[char]:
+                    raise StreamAborted("括号不匹配")
+                if not self._stack:
+                    if self.item_count is not None and self.items != self.item_count:
+                        raise StreamAborted(f"列表条数为 {self.items}，应为 {self.item_count}")
+                    return True
+            elif char == ",":
+                if len(self._stack) == 1:
+                    self._expect_item = True
+            elif char != ":" and char not in _LITERAL_CHARS:
+                raise StreamAborted("列表中出现非 JSON 内容")
+        return False
+
+
+class IntegerValidator(OutputValidator):
+    """
+    校验内容是否为一个整数：与 :func:`llm_output.parse_output` 一致，允许 ``"2"``、``[2]`` 和只含一个整数的文字，
+    出现第二个整数时中止
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.integers = 0
+        """已出现的整数个数"""
+        self._in_integer = False
+
+    def _feed_content(self, text: str) -> bool:
+        for char in text:
+            # isdecimal 与正则表达式中的 \d 相同；小数点视为数字的一部分，2.0 也能修复为整数
+            is_digit = char.isdecimal()
+            if is_digit and not self._in_integer:
+                self.integers += 1
+                if self.integers > 1:
+                    raise StreamAborted("输出中有多个整数")
+            self._in_integer = is_digit or (self._in_integer and char == ".")
+        return False
+
+
+class StreamLimits:
+    """
+    流式请求的限制
+
+    :param max_tokens: 每次请求最多生成的 token 数，为 None 时按输入长度估计
+    :param max_seconds: 每次请求的最长时间，为 None 时不限制
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, max_seconds: Optional[float] = None):
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+
+    def token_cap(self, expected_tokens: float) -> int:
+        """
+        :param expected_tokens: 预计输出的 token 数
+        """
+        if self.max_tokens is not None:
+            return self.max_tokens
+        return int(expected_tokens * STREAM_TOKEN_RATIO) + STREAM_TOKEN_MARGIN
+
+
+def add_stream_arguments(parser: argparse.ArgumentParser):
+    """添加流式请求相关的命令行参数"""
+    parser.add_argument("--stream", action="store_true",
+                        help="流式请求，边生成边校验，内容不符合要求或超出限制时提前中止并重试")
+    parser.add_argument("--max-tokens", type=int,
+                        help=f"流式请求时每次最多生成的 token 数（默认为预计输出的{STREAM_TOKEN_RATIO}倍加{STREAM_TOKEN_MARGIN}）")
+    parser.add_argument("--max-seconds", type=float, help="流式请求时每次请求的最长时间（秒）")
+
+
+def open_stream(args: argparse.Namespace) -> Optional[StreamLimits]:
+    """根据命令行参数返回流式请求的限制，未指定 ``--stream`` 时返回 None"""
+    if not args.stream:
+        return None
+    return StreamLimits(args.max_tokens, args.max_seconds)
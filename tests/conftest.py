@@ -0,0 +1,47 @@
+import base64
+import os
+import random
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QQ_NT_PARSE_DIR = os.path.join(REPO_DIR, "qq_nt_parse")
+sys.path.insert(0, REPO_DIR)
+sys.path.append(QQ_NT_PARSE_DIR)
+
+GROUP_IDS = (123456789, 987654321)
+"""测试数据中的群号"""
+
+
+@pytest.fixture
+def make_export():
+    """生成 QQNT 群聊消息表的行（与 JSON 导出文件格式一致，消息内容为 base64 编码的 protobuf）"""
+    import message_pb2
+
+    def make(count: int, seed: int = 1, start_time: int = 1660471938) -> list[dict]:
+        rng = random.Random(seed)
+        rows = []
+        for i in range(count):
+            message = message_pb2.Message()
+            for k in range(rng.randint(0, 3)):
+                element = message.messages.add()
+                element.messageId = i * 10 + k
+                element.messageType = rng.choice([1, 1, 2, 6])
+                if element.messageType == 1:
+                    element.messageText = rng.choice(["你好", "@王五 吃了吗", "it's ok", "换行\n测试", "  "]) + str(i)
+                elif element.messageType == 2:
+                    element.imageUrlLow = f"http://example.com/{i}"
+                else:
+                    element.emojiText = "/微笑"
+            user = rng.randint(1, 6)
+            rows.append({
+                "40021": rng.choice(GROUP_IDS),
+                "40050": start_time + i * 7,
+                "40090": f"用户{user}",
+                "40800": base64.encodebytes(message.SerializeToString()).decode() if rng.random() > 0.05 else None,
+                "40033": 1000 + user,
+            })
+        return rows
+
+    return make
@@ -0,0 +1,18 @@
+from llm_cache import ResponseCache
+
+
+def total_size(cache):
+    return cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+
+def test_overwrite_and_delete_keep_total_size(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    payload = {"model": "m", "messages": [{"role": "user", "content": "你好"}]}
+    for i in range(5):
+        cache.put(payload, {"message": {"content": "x" * (100 + i)}})
+    assert cache._total_size == total_size(cache)
+
+    cache.delete(payload)
+    assert cache._total_size == total_size(cache) == 0
+    cache.close()
+
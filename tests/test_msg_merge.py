@@ -0,0 +1,37 @@
+import random
+import time
+
+import pytest
+
+from msg_merge import merge_message_stream, merge_messages
+
+
+@pytest.fixture(params=["UTC", "Asia/Shanghai", "America/New_York"])
+def timezone(request, monkeypatch):
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+def make_messages(count, seed):
+    """按时间排序的消息，跨越夏令时切换，时间戳重复、间隔长短不一"""
+    rng = random.Random(seed)
+    now = 1699164000 - 5000  # 2023-11-05 纽约夏令时结束前后
+    messages = []
+    for i in range(count):
+        now += rng.choice([0, 0, 1, 5, 30, 61, 200])
+        messages.append((now, f"user{rng.randint(1, 5)}", f"消息{i}"))
+    return messages
+
+
+@pytest.mark.parametrize("window_min_messages", [1, 7, 100000])
+def test_stream_matches_merge_messages(timezone, window_min_messages):
+    messages = make_messages(3000, seed=len(timezone))
+    times, user_ids, contents = (list(column) for column in zip(*messages))
+
+    expected = merge_messages(times, user_ids, contents)
+    actual = list(merge_message_stream(iter(messages), window_min_messages=window_min_messages))
+
+    assert actual == expected
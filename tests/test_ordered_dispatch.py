@@ -0,0 +1,81 @@
+import gc
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ollama_client import OllamaClient, OllamaError
+from ordered_dispatch import run_ordered
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """模拟 /api/chat：按请求内容中的延迟返回，内容以 fail 开头时返回 500"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        content = payload["messages"][0]["content"]
+        delay, _, text = content.partition(":")
+        time.sleep(float(delay))
+        if text.startswith("fail"):
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"message": {"role": "assistant", "content": text.upper()}, "done": True}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def client():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = OllamaClient(f"http://127.0.0.1:{server.server_port}")
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def make_send(client):
+    def send(job):
+        delay, text = job
+        payload = {"model": "stub", "messages": [{"role": "user", "content": f"{delay}:{text}"}]}
+        return client.chat(payload)["message"]["content"]
+
+    return send
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 4])
+def test_results_are_committed_in_input_order(client, max_in_flight):
+    # 前面的任务更慢，后面的任务先完成
+    jobs = [((i % 4) * 0.02, f"item{i}") for i in range(40)][::-1]
+    committed = []
+
+    run_ordered(jobs, make_send(client), lambda job, result: committed.append((job[1], result)), max_in_flight)
+
+    assert committed == [(text, text.upper()) for _, text in jobs]
+    # 保持连接，连接数不超过并发数
+    assert client.connections_opened <= max_in_flight
+
+
+def test_failing_item_raises_after_committing_earlier_items(client, caplog):
+    jobs = [(0, "a"), (0.3, "b"), (0.3, "fail-c"), (0, "fail-d"), (0, "fail-e"), (0, "f")]
+    committed = []
+
+    with pytest.raises(OllamaError):
+        run_ordered(jobs, make_send(client), lambda job, result: committed.append(job[1]), max_in_flight=4)
+    gc.collect()
+
+    assert committed == ["a", "b"]
+    assert "never retrieved" not in caplog.text
@@ -0,0 +1,149 @@
+import base64
+import csv
+import glob
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+
+from conftest import GROUP_IDS, QQ_NT_PARSE_DIR
+from group_msg_io import read_group_msg_rows
+from sqlite_source import iter_rows_from_sqlite
+
+MAIN = os.path.join(QQ_NT_PARSE_DIR, "main.py")
+
+
+def run_main(cwd, *args):
+    subprocess.run([sys.executable, MAIN, "--quiet", *args], cwd=cwd, check=True, capture_output=True)
+
+
+def write_export(directory, rows):
+    with open(os.path.join(directory, "group_msg_table.json"), "w", encoding="utf-8") as f:
+        json.dump(rows, f)
+
+
+def count_csv_rows(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        return sum(1 for _ in csv.reader(f))
+
+
+def test_full_run_after_incremental_removes_parquet_parts(tmp_path, make_export):
+    rows = make_export(300)
+    write_export(tmp_path, rows[:150])
+    run_main(tmp_path, "--parquet")
+    write_export(tmp_path, rows)
+    run_main(tmp_path, "--incremental", "--parquet")
+    assert os.path.exists(tmp_path / "group_msg.part1.parquet")
+
+    run_main(tmp_path, "--parquet")
+
+    assert not glob.glob(str(tmp_path / "group_msg.part*.parquet"))
+    parquet_rows = list(read_group_msg_rows(str(tmp_path / "group_msg.parquet")))
+    assert len(parquet_rows) == count_csv_rows(tmp_path / "group_msg.csv")
+    with open(tmp_path / "group_msg.json", encoding="utf-8") as f:
+        assert len(parquet_rows) == len(json.load(f))
+
+
+def test_sharded_full_run_after_incremental_removes_parquet_parts(tmp_path, make_export):
+    rows = make_export(300)
+    group_args = ["--group-id", *map(str, GROUP_IDS)]
+    write_export(tmp_path, rows[:150])
+    run_main(tmp_path, "--parquet", *group_args)
+    write_export(tmp_path, rows)
+    run_main(tmp_path, "--incremental", "--parquet", *group_args)
+    assert glob.glob(str(tmp_path / "group_msg_*.part1.parquet"))
+
+    run_main(tmp_path, "--parquet", *group_args)
+
+    assert not glob.glob(str(tmp_path / "group_msg_*.part*.parquet"))
+    for group_id in GROUP_IDS:
+        parquet_rows = list(read_group_msg_rows(str(tmp_path / f"group_msg_{group_id}.parquet")))
+        assert len(parquet_rows) == count_csv_rows(tmp_path / f"group_msg_{group_id}.csv")
+
+
+def write_sqlite(path, rows):
+    """按 group_msg_table 的结构建立数据库，消息内容为原始字节"""
+    conn = sqlite3.connect(path)
+    conn.execute(
+        'CREATE TABLE group_msg_table ("40001" INTEGER PRIMARY KEY, "40021" INTEGER, "40050" INTEGER, '
+        '"40090" TEXT, "40800" BLOB, "40033" INTEGER, "40010" TEXT)'
+    )
+    conn.executemany(
+        "INSERT INTO group_msg_table VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (i, row["40021"], row["40050"], row["40090"],
+             base64.decodebytes(row["40800"].encode()) if row["40800"] else None, row["40033"], "其他字段")
+            for i, row in enumerate(rows)
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+
+def read_outputs(directory):
+    with open(os.path.join(directory, "group_msg.json"), encoding="utf-8") as f:
+        json_rows = json.load(f)
+    with open(os.path.join(directory, "group_msg.csv"), encoding="utf-8", newline="") as f:
+        csv_rows = list(csv.reader(f))
+    return json_rows, csv_rows
+
+
+@pytest.mark.parametrize("args", [[], ["--workers", "2"], ["--fast"], ["--fast", "--workers", "2"]])
+def test_sqlite_source_matches_json_export(tmp_path, make_export, args):
+    rows = make_export(400)
+    json_dir, sqlite_dir = tmp_path / "json", tmp_path / "sqlite"
+    json_dir.mkdir()
+    sqlite_dir.mkdir()
+    write_export(json_dir, rows)
+    write_sqlite(sqlite_dir / "nt_msg.db", rows)
+    group_args = ["--group-id", str(GROUP_IDS[0])]
+
+    run_main(json_dir, *group_args, *args)
+    run_main(sqlite_dir, "--sqlite", "nt_msg.db", *group_args, *args)
+
+    expected = read_outputs(json_dir)
+    assert expected[0]
+    assert read_outputs(sqlite_dir) == expected
+
+
+def test_sqlite_time_range_matches_filtered_json_export(tmp_path, make_export):
+    rows = make_export(400)
+    start, end = rows[100]["40050"], rows[300]["40050"]
+    json_dir, sqlite_dir = tmp_path / "json", tmp_path / "sqlite"
+    json_dir.mkdir()
+    sqlite_dir.mkdir()
+    write_export(json_dir, [row for row in rows if start <= row["40050"] < end])
+    write_sqlite(sqlite_dir / "nt_msg.db", rows)
+
+    run_main(json_dir)
+    run_main(
+        sqlite_dir, "--sqlite", "nt_msg.db",
+        "--start-time", datetime.fromtimestamp(start).isoformat(), "--end-time", datetime.fromtimestamp(end).isoformat()
+    )
+
+    expected = read_outputs(json_dir)
+    assert expected[0]
+    assert read_outputs(sqlite_dir) == expected
+
+
+@pytest.mark.parametrize("group_ids", [None, {GROUP_IDS[0]}, set(GROUP_IDS)])
+def test_sqlite_where_filters_match_python_filters(tmp_path, make_export, group_ids):
+    rows = make_export(400)
+    path = str(tmp_path / "nt_msg.db")
+    write_sqlite(path, rows)
+    start, end = rows[50]["40050"], rows[350]["40050"]
+
+    selected = list(iter_rows_from_sqlite(
+        path, group_ids, datetime.fromtimestamp(start), datetime.fromtimestamp(end), fetch_size=7
+    ))
+    all_rows = list(iter_rows_from_sqlite(path, None))
+
+    assert len(all_rows) == len(rows)
+    assert selected == [
+        row for row in all_rows
+        if (group_ids is None or row["40021"] in group_ids) and start <= row["40050"] < end
+    ]